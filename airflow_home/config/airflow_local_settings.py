@@ -0,0 +1,10 @@
+"""Cluster policies, see
+https://airflow.apache.org/docs/apache-airflow/2.5.3/concepts/cluster-policies.html
+"""
+import cold_start
+
+
+def dag_policy(dag):
+    """Mark the end of the DAG parse phase of a cold start
+    """
+    cold_start.mark("dag_parsed")
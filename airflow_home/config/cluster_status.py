@@ -0,0 +1,274 @@
+"""Keep a summary of the ECS cluster's tasks for the webserver.
+
+ClusterStatus lists the tasks of the cluster (running and recently stopped,
+following nextToken) and describes them in batches of DESCRIBE_TASKS_BATCH_SIZE
+from a background thread every refresh_interval seconds. Readers get the last
+snapshot and its ETag, and never call ECS themselves: a snapshot older than
+ttl (refreshes keep failing) is still served, marked stale, along with the
+last error. The ETag only covers what was read from the tasks, so a refresh
+that finds the same tasks keeps it.
+
+With a snapshot_path, the gunicorn workers of a webserver share one refresher:
+the worker holding an exclusive lock on <snapshot_path>.lock refreshes and
+writes the snapshot to snapshot_path, and the others read it from there. The
+lock is released when that worker exits, and another worker takes over within
+a refresh interval
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+log = logging.getLogger("airflow.cluster_status")
+
+DESCRIBE_TASKS_BATCH_SIZE = 100
+# Tasks shown in the snapshot's list of the most recently created ones
+RECENT_TASKS = 20
+
+
+def timestamp(value) -> float | None:
+    """Return ECS timestamps (datetimes from boto3) as seconds since the epoch"""
+    if value is None:
+        return None
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def family(task_definition_arn: str) -> str:
+    """Return the family of arn:aws:ecs:...:task-definition/<family>:<revision>"""
+    return task_definition_arn.rpartition("/")[2].partition(":")[0]
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": round(statistics.median(values), 1),
+        "p90": round(values[min(len(values) - 1, int(len(values) * 0.9))], 1),
+        "max": round(values[-1], 1),
+    }
+
+
+def summarize(tasks: list[dict]) -> dict:
+    """Return the task counts and start latencies of described tasks"""
+    by_status = Counter(task["lastStatus"] for task in tasks)
+    by_family = {}
+    for task in tasks:
+        counts = by_family.setdefault(family(task["taskDefinitionArn"]), {})
+        counts[task["lastStatus"]] = counts.get(task["lastStatus"], 0) + 1
+    start_latencies = [
+        timestamp(task["startedAt"]) - timestamp(task["createdAt"])
+        for task in tasks if task.get("startedAt") and task.get("createdAt")
+    ]
+    pending_created_at = [
+        timestamp(task["createdAt"])
+        for task in tasks if task.get("createdAt") and not task.get("startedAt") and task["lastStatus"] != "STOPPED"
+    ]
+    recent = sorted(tasks, key=lambda task: timestamp(task.get("createdAt")) or 0, reverse=True)[:RECENT_TASKS]
+    return {
+        "tasks": len(tasks),
+        "by_status": dict(sorted(by_status.items())),
+        "by_family": dict(sorted(by_family.items())),
+        "start_latency": percentiles(start_latencies),
+        # Turned into an age when the snapshot is read
+        "oldest_pending_created_at": min(pending_created_at) if pending_created_at else None,
+        "recent": [
+            {
+                "task_id": task["taskArn"].rpartition("/")[2],
+                "family": family(task["taskDefinitionArn"]),
+                "status": task["lastStatus"],
+                "created_at": timestamp(task.get("createdAt")),
+                "start_latency": (
+                    round(timestamp(task["startedAt"]) - timestamp(task["createdAt"]), 1)
+                    if task.get("startedAt") and task.get("createdAt") else None
+                ),
+                "stopped_reason": task.get("stoppedReason"),
+            }
+            for task in recent
+        ],
+    }
+
+
+class ClusterStatus:
+    def __init__(
+        self,
+        ecs,
+        cluster: str,
+        refresh_interval: float = 30.0,
+        ttl: float = 120.0,
+        desired_statuses: tuple[str, ...] = ("RUNNING", "STOPPED"),
+        snapshot_path: str | None = None,
+        clock=time.time,
+    ):
+        self.ecs = ecs
+        self.cluster = cluster
+        self.refresh_interval = refresh_interval
+        self.ttl = ttl
+        self.desired_statuses = desired_statuses
+        self.snapshot_path = snapshot_path
+        self.clock = clock
+        self.api_calls = Counter()
+        self.last_error: str | None = None
+        self._snapshot: dict | None = None
+        self._etag: str | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+        # Open, and locked, in the worker that refreshes
+        self._lock_file = None
+        self._loaded_mtime: int | None = None
+
+    def list_task_arns(self) -> list[str]:
+        task_arns = []
+        for desired_status in self.desired_statuses:
+            kwargs = {"cluster": self.cluster, "desiredStatus": desired_status, "maxResults": 100}
+            while True:
+                self.api_calls["list_tasks"] += 1
+                resp = self.ecs.list_tasks(**kwargs)
+                task_arns.extend(resp["taskArns"])
+                if not resp.get("nextToken"):
+                    break
+                kwargs["nextToken"] = resp["nextToken"]
+        return task_arns
+
+    def describe_tasks(self, task_arns: list[str]) -> list[dict]:
+        tasks = []
+        for start in range(0, len(task_arns), DESCRIBE_TASKS_BATCH_SIZE):
+            self.api_calls["describe_tasks"] += 1
+            resp = self.ecs.describe_tasks(
+                cluster=self.cluster, tasks=task_arns[start:start + DESCRIBE_TASKS_BATCH_SIZE],
+            )
+            tasks.extend(resp["tasks"])
+        return tasks
+
+    def refresh(self):
+        """Replace the snapshot with the current state of the cluster"""
+        try:
+            tasks = self.describe_tasks(self.list_task_arns())
+        except Exception as e:
+            log.warning("Could not refresh the status of cluster %s", self.cluster, exc_info=True)
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._publish()
+            return
+        summary = summarize(tasks)
+        etag = hashlib.sha1(json.dumps(summary, sort_keys=True).encode()).hexdigest()
+        snapshot = {"cluster": self.cluster, "refreshed_at": self.clock(), **summary}
+        with self._lock:
+            self._snapshot, self._etag = snapshot, etag
+            self.last_error = None
+        self._publish()
+
+    def _publish(self):
+        """Write the snapshot for the other workers of the webserver"""
+        if self.snapshot_path is None:
+            return
+        with self._lock:
+            state = {
+                "snapshot": self._snapshot,
+                "etag": self._etag,
+                "error": self.last_error,
+                "api_calls": dict(self.api_calls),
+            }
+        partial = f"{self.snapshot_path}.{os.getpid()}"
+        try:
+            with open(partial, "w") as f:
+                json.dump(state, f)
+            os.replace(partial, self.snapshot_path)
+        except OSError:
+            log.warning("Could not write the cluster status to %s", self.snapshot_path, exc_info=True)
+
+    def _load(self):
+        """Read the snapshot that the refreshing worker last wrote, if it
+        changed since the last read
+        """
+        try:
+            mtime = os.stat(self.snapshot_path).st_mtime_ns
+            if mtime == self._loaded_mtime:
+                return
+            with open(self.snapshot_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self._snapshot, self._etag, self.last_error = state["snapshot"], state["etag"], state["error"]
+            self.api_calls = Counter(state["api_calls"])
+            self._loaded_mtime = mtime
+
+    def is_refresher(self) -> bool:
+        """Return whether this process refreshes the snapshot, taking the
+        refresher lock if no other worker holds it
+        """
+        if self.snapshot_path is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.snapshot_path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        # Serve the previous refresher's snapshot until the first refresh
+        self._load()
+        return True
+
+    def snapshot(self) -> tuple[dict | None, str | None]:
+        """Return the last snapshot, with its age, staleness and the refresher's
+        last error, and its ETag (None until the first refresh succeeds)
+        """
+        if self._lock_file is None and self.snapshot_path is not None:
+            self._load()
+        with self._lock:
+            snapshot, etag, error = self._snapshot, self._etag, self.last_error
+        if snapshot is None:
+            return None, None
+        now = self.clock()
+        age = now - snapshot["refreshed_at"]
+        oldest_pending = snapshot["oldest_pending_created_at"]
+        stale = age > self.ttl
+        if stale or error:
+            # Clients holding the fresh version must see the warning
+            etag += "-" + hashlib.sha1(f"{stale}{error}".encode()).hexdigest()[:8]
+        return (
+            {
+                **snapshot,
+                "age": round(age, 1),
+                "oldest_pending": None if oldest_pending is None else round(now - oldest_pending, 1),
+                "stale": stale,
+                "error": error,
+                "api_calls": dict(self.api_calls),
+            },
+            etag,
+        )
+
+    def _run(self):
+        while True:
+            # The other workers only check that the refresher is still alive
+            if self.is_refresher():
+                self.refresh()
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def start(self):
+        """Refresh, or wait to take over refreshing, from a daemon thread,
+        once per process. Cheap to call again: gunicorn loads the app before
+        forking its workers, which do not inherit the thread
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                # A lock taken before the fork belongs to the parent
+                self._lock_file = None
+                self._loaded_mtime = None
+                self._thread = threading.Thread(target=self._run, name="cluster-status", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
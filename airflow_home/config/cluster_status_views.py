@@ -0,0 +1,101 @@
+"""Cluster status page of the webserver, see cluster_status"""
+import html
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import boto3
+from airflow.configuration import conf
+from airflow.security import permissions
+from airflow.www import auth
+from flask import Response, request
+from flask_appbuilder import BaseView, expose
+
+from cluster_status import ClusterStatus
+
+# One per webserver worker, shared by its requests. Only one worker of the
+# webserver refreshes, see ClusterStatus
+status: ClusterStatus | None = None
+
+
+def cluster_status() -> ClusterStatus:
+    global status
+    if status is None:
+        status = ClusterStatus(
+            boto3.client("ecs", region_name=conf.get("ecs_fargate", "region", fallback=None)),
+            conf.get("cluster_status", "cluster", fallback=None) or conf.get("ecs_fargate", "cluster"),
+            refresh_interval=conf.getfloat("cluster_status", "refresh_interval", fallback=30.0),
+            ttl=conf.getfloat("cluster_status", "ttl", fallback=120.0),
+            snapshot_path=(
+                conf.get("cluster_status", "snapshot_path", fallback=None)
+                or os.path.join(tempfile.gettempdir(), "airflow-cluster-status.json")
+            ),
+        )
+    status.start()
+    return status
+
+
+def seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value}s"
+
+
+def render(snapshot: dict) -> str:
+    def table(headers: list[str], rows: list[list]) -> str:
+        head = "".join(f"<th>{html.escape(h)}</th>" for h in headers)
+        body = "".join(
+            "<tr>" + "".join(f"<td>{html.escape('' if v is None else str(v))}</td>" for v in row) + "</tr>"
+            for row in rows
+        )
+        return f'<table class="table table-condensed"><tr>{head}</tr>{body}</table>'
+
+    refreshed_at = datetime.fromtimestamp(snapshot["refreshed_at"], timezone.utc).isoformat(timespec="seconds")
+    warning = ""
+    if snapshot["stale"] or snapshot["error"]:
+        warning = f'<div class="alert alert-warning">Stale: {html.escape(snapshot["error"] or "not refreshed")}</div>'
+    statuses = sorted({s for counts in snapshot["by_family"].values() for s in counts})
+    latency = snapshot["start_latency"]
+    return (
+        f"<h2>ECS cluster {html.escape(snapshot['cluster'])}</h2>{warning}"
+        f"<p>{snapshot['tasks']} tasks as of {refreshed_at} ({seconds(snapshot['age'])} ago). "
+        f"Start latency: p50 {seconds(latency.get('p50'))}, p90 {seconds(latency.get('p90'))}, "
+        f"max {seconds(latency.get('max'))} over {latency['count']} tasks. "
+        f"Oldest pending task: {seconds(snapshot['oldest_pending'])}.</p>"
+        + table(["Status", "Tasks"], [[s, n] for s, n in snapshot["by_status"].items()])
+        + table(["Family", *statuses],
+                [[name, *(counts.get(s, 0) for s in statuses)] for name, counts in snapshot["by_family"].items()])
+        + "<h3>Most recent tasks</h3>"
+        + table(["Task", "Family", "Status", "Start latency (s)", "Stopped reason"],
+                [[t["task_id"], t["family"], t["status"], t["start_latency"], t["stopped_reason"]]
+                 for t in snapshot["recent"]])
+    )
+
+
+class ClusterStatusView(BaseView):
+    route_base = "/cluster_status"
+    default_view = "status"
+
+    def respond(self, as_json: bool) -> Response:
+        snapshot, etag = cluster_status().snapshot()
+        if snapshot is None:
+            return Response("Cluster status is being read, try again in a few seconds", status=503,
+                            headers={"Retry-After": "5"}, mimetype="text/plain")
+        etag += "-json" if as_json else "-html"
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={"ETag": f'"{etag}"'})
+        body = json.dumps(snapshot) if as_json else render(snapshot)
+        response = Response(body, mimetype="application/json" if as_json else "text/html")
+        response.set_etag(etag)
+        # Revalidate on every view, the snapshot changes every refresh_interval
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @expose("/")
+    @auth.has_access([(permissions.ACTION_CAN_READ, permissions.RESOURCE_WEBSITE)])
+    def status(self):
+        return self.respond(as_json=False)
+
+    @expose("/json")
+    @auth.has_access([(permissions.ACTION_CAN_READ, permissions.RESOURCE_WEBSITE)])
+    def status_json(self):
+        return self.respond(as_json=True)
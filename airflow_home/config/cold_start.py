@@ -0,0 +1,135 @@
+"""Timestamp the phases of a container's cold start and log them as one JSON
+record per container.
+
+Phase marks are kept in COLD_START_<PHASE>_AT environment variables so that
+they survive the exec from wrapper.sh to bootstrap.py to /entrypoint and are
+inherited by the processes Airflow forks. The first mark of a phase wins.
+Image pull timings come from the ECS task metadata endpoint
+"""
+import json
+import logging
+import os
+import time
+import urllib.request
+from datetime import datetime
+
+# In the order they happen in an `airflow tasks run` container
+PHASE_MARKS = [
+    "container_started",  # first line of wrapper.sh
+    "bootstrap_started",  # bootstrap.py imported
+    "secrets_fetched",  # bootstrap.py about to exec /entrypoint
+    "airflow_imported",  # log_config imported while Airflow configures logging
+    "dag_parsed",  # first DAG handed to airflow_local_settings.dag_policy
+    "db_connected",  # first connection of the SQLAlchemy pool
+    "task_running",  # on_task_instance_running listener
+]
+# Reported duration of each phase: (name, start mark, end mark)
+PHASES = [
+    ("bootstrap_start", "container_started", "bootstrap_started"),
+    ("secrets", "bootstrap_started", "secrets_fetched"),
+    ("airflow_import", "secrets_fetched", "airflow_imported"),
+    ("dag_parse", "airflow_imported", "dag_parsed"),
+    ("db_connect", "dag_parsed", "db_connected"),
+    ("task_start", "db_connected", "task_running"),
+    ("total", "container_started", "task_running"),
+]
+EMITTED_ENV = "COLD_START_EMITTED"
+
+log = logging.getLogger("airflow.cold_start")
+
+
+def _env_name(phase: str) -> str:
+    return f"COLD_START_{phase.upper()}_AT"
+
+
+def mark(phase: str, timestamp: float | None = None):
+    """Record the wall-clock time at which the phase ended, unless it was
+    already recorded
+    """
+    name = _env_name(phase)
+    if name not in os.environ:
+        os.environ[name] = repr(time.time() if timestamp is None else timestamp)
+
+
+def marks() -> dict[str, float]:
+    result = {}
+    for phase in PHASE_MARKS:
+        value = os.environ.get(_env_name(phase))
+        if value:
+            result[phase] = float(value)
+    return result
+
+
+def _parse_metadata_time(value: str | None) -> float | None:
+    if not value:
+        return None
+    # e.g. 2023-05-17T21:21:19.044329461Z; fromisoformat only takes microseconds
+    value = value.rstrip("Z")
+    if "." in value:
+        head, fraction = value.split(".", 1)
+        value = f"{head}.{fraction[:6]}"
+    return datetime.fromisoformat(value + "+00:00").timestamp()
+
+
+def image_pull_timings(timeout: float = 0.5) -> dict[str, float]:
+    """Return the image pull window of the task from the ECS task metadata
+    endpoint, or an empty dictionary outside of ECS
+    """
+    base_uri = os.getenv("ECS_CONTAINER_METADATA_URI_V4")
+    if not base_uri:
+        return {}
+    try:
+        with urllib.request.urlopen(f"{base_uri}/task", timeout=timeout) as resp:
+            metadata = json.load(resp)
+    except (OSError, ValueError):
+        return {}
+    pull_started = _parse_metadata_time(metadata.get("PullStartedAt"))
+    pull_stopped = _parse_metadata_time(metadata.get("PullStoppedAt"))
+    if pull_started is None or pull_stopped is None:
+        return {}
+    return {"pull_started": pull_started, "pull_stopped": pull_stopped}
+
+
+def build_record() -> dict:
+    """Return the phase marks and the duration in seconds of every phase whose
+    start and end were both marked
+    """
+    phase_marks = marks()
+    durations = {}
+    for name, start, end in PHASES:
+        if start in phase_marks and end in phase_marks:
+            durations[name] = round(phase_marks[end] - phase_marks[start], 6)
+    pull = image_pull_timings()
+    if pull:
+        durations["image_pull"] = round(pull["pull_stopped"] - pull["pull_started"], 6)
+        if "container_started" in phase_marks:
+            durations["container_create"] = round(
+                phase_marks["container_started"] - pull["pull_stopped"], 6
+            )
+    return {"marks": phase_marks, "durations": durations}
+
+
+def emit(**context):
+    """Log the cold-start record once per container. Does nothing in processes
+    that were not started through wrapper.sh
+    """
+    if EMITTED_ENV in os.environ or _env_name("container_started") not in os.environ:
+        return
+    os.environ[EMITTED_ENV] = "1"
+    log.info("cold_start", extra={"cold_start": dict(build_record(), **context)})
+
+
+def _on_pool_connect(dbapi_connection, connection_record):
+    mark("db_connected")
+
+
+def watch_db_connect():
+    """Mark db_connected on the first connection any SQLAlchemy pool opens
+    """
+    try:
+        from sqlalchemy import event
+        from sqlalchemy.pool import Pool
+    except ImportError:
+        return
+    if not event.contains(Pool, "connect", _on_pool_connect):
+        event.listen(Pool, "connect", _on_pool_connect)
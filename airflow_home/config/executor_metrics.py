@@ -0,0 +1,238 @@
+"""Throughput and latency of the ECS Fargate executors, per phase of a task
+instance and per AWS API call.
+
+The phases of a task instance, between the events the executor sees:
+
+* executor_queue: queued by the scheduler -> handed to execute_async, i.e.
+  waiting for an open slot (PARALLELISM) and the next executor heartbeat
+* launch: execute_async -> RunTask accepted the task (pending queue, rate
+  limiting, retries and the RunTask calls themselves)
+* provisioning: RunTask accepted -> the ECS task's startedAt (Fargate)
+* running: startedAt -> the executor reports the final state
+* queued_to_running and total: queued -> startedAt, and queued -> final state
+
+Task instances run by a warm pool or a micro-batch have no Fargate task of
+their own, so only the phases without launched and started are recorded.
+
+Every observation goes to StatsD (Airflow's Stats, a no-op unless
+[metrics] statsd_on) and into in-memory histograms. Those are logged as one
+JSON record of the logger airflow.executor_metrics every log_interval seconds
+and reset, along with one record per finished task instance when log_tasks is
+set. InstrumentedClient wraps a boto3 client to time its calls and count
+their errors and the failures listed in RunTask responses
+"""
+import logging
+import math
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from airflow.stats import Stats
+
+log = logging.getLogger("airflow.executor_metrics")
+
+# (phase, start event, end event)
+PHASES = [
+    ("executor_queue", "queued", "submitted"),
+    ("launch", "submitted", "launched"),
+    ("provisioning", "launched", "started"),
+    ("running", "started", "finished"),
+    ("queued_to_running", "queued", "started"),
+    ("total", "queued", "finished"),
+]
+# Task instances whose timings are kept, oldest dropped first
+MAX_TRACKED_TASKS = 100_000
+
+
+def timestamp(value) -> float | None:
+    """Return ECS timestamps (datetimes from boto3) as seconds since the epoch"""
+    if value is None:
+        return None
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+class Histogram:
+    """Counts of observations in fixed buckets, about three per decade from
+    10ms to 1000s"""
+    BOUNDS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, math.inf)
+
+    def __init__(self):
+        self.counts = [0] * len(self.BOUNDS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.BOUNDS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket of the q-quantile (the maximum
+        for the last bucket)"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 3),
+            "p50": round(self.quantile(0.5), 3),
+            "p90": round(self.quantile(0.9), 3),
+            "p99": round(self.quantile(0.99), 3),
+            "max": round(self.max, 3),
+        }
+
+
+class ExecutorMetrics:
+    def __init__(self, prefix: str = "ecs_fargate", log_interval: float = 60.0, log_tasks: bool = True,
+                 clock=time.time):
+        self.prefix = prefix
+        self.log_interval = log_interval
+        self.log_tasks = log_tasks
+        self.clock = clock
+        self.histograms: dict[str, Histogram] = defaultdict(Histogram)
+        self.counters = Counter()
+        self.outcomes = Counter()
+        self.gauges = {}
+        self.api_seconds = 0.0
+        # task instance key -> event -> wall-clock time
+        self.tasks: dict = {}
+        self.window_started_at = clock()
+
+    def observe(self, name: str, seconds: float):
+        self.histograms[name].observe(seconds)
+        Stats.timing(f"{self.prefix}.{name}", timedelta(seconds=seconds))
+
+    def incr(self, name: str, count: int = 1):
+        self.counters[name] += count
+        Stats.incr(f"{self.prefix}.{name}", count)
+
+    def gauge(self, name: str, value: float):
+        self.gauges[name] = value
+        Stats.gauge(f"{self.prefix}.{name}", value)
+
+    def mark(self, key, event: str, at: float | None = None, first: bool = True):
+        """Record when a task instance went through an event; only the first
+        time unless first is False (e.g. a relaunch)"""
+        events = self.tasks.get(key)
+        if events is None:
+            if len(self.tasks) >= MAX_TRACKED_TASKS:
+                del self.tasks[next(iter(self.tasks))]
+            events = self.tasks[key] = {}
+        if first and event in events:
+            return
+        events[event] = self.clock() if at is None else at
+        if event == "launched":
+            events["launches"] = events.get("launches", 0) + 1
+
+    def finished(self, key, state: str):
+        """Record the phases of a task instance the executor reports in a final
+        state, and forget it"""
+        state = str(getattr(state, "value", state))
+        events = self.tasks.pop(key, {})
+        events["finished"] = self.clock()
+        durations = {}
+        for phase, start, end in PHASES:
+            if start in events and end in events:
+                # startedAt comes from ECS, whose clock may be slightly ahead
+                durations[phase] = max(0.0, events[end] - events[start])
+                self.observe(f"task.{phase}", durations[phase])
+        self.outcomes[state] += 1
+        self.incr(f"task.{state}")
+        if self.log_tasks:
+            log.info("task_timing", extra={"task_timing": {
+                "dag_id": key.dag_id,
+                "task_id": key.task_id,
+                "run_id": key.run_id,
+                "map_index": key.map_index,
+                "try_number": key.try_number,
+                "state": state,
+                "launches": events.get("launches", 0),
+                **{phase: round(seconds, 3) for phase, seconds in durations.items()},
+            }})
+
+    def api_call(self, operation: str, seconds: float, error: str | None = None, failures: list[str] = ()):
+        self.api_seconds += seconds
+        self.observe(f"api.{operation}", seconds)
+        if error:
+            self.incr(f"api.{operation}.errors")
+            self.counters[f"api.{operation}.errors.{error}"] += 1
+        for kind in failures:
+            self.incr(f"api.{operation}.failures.{kind}")
+
+    def summary(self) -> dict:
+        now = self.clock()
+        finished = sum(self.outcomes.values())
+        return {
+            "window": round(now - self.window_started_at, 1),
+            "tasks_finished": finished,
+            "tasks_per_minute": round(finished * 60 / max(now - self.window_started_at, 1e-9), 2),
+            "failure_rate": round(self.outcomes["failed"] / finished, 4) if finished else None,
+            "tracked_tasks": len(self.tasks),
+            "api_seconds": round(self.api_seconds, 3),
+            "gauges": dict(sorted(self.gauges.items())),
+            "counters": dict(sorted(self.counters.items())),
+            "histograms": {name: h.summary() for name, h in sorted(self.histograms.items())},
+        }
+
+    def maybe_log_summary(self, force: bool = False):
+        """Log the summary of the window and start a new one, once every
+        log_interval seconds"""
+        if self.log_interval <= 0 or (not force and self.clock() - self.window_started_at < self.log_interval):
+            return
+        log.info("executor_metrics", extra={"executor_metrics": self.summary()})
+        self.histograms.clear()
+        self.counters.clear()
+        self.outcomes.clear()
+        self.api_seconds = 0.0
+        self.window_started_at = self.clock()
+
+
+class InstrumentedClient:
+    """Proxy of a boto3 client that records the duration and outcome of each
+    API call in an ExecutorMetrics, as api.<service>.<operation>. Attributes
+    other than API calls (and those of stand-ins) are passed through"""
+
+    PASSTHROUGH = {"get_paginator", "can_paginate", "get_waiter", "close"}
+
+    def __init__(self, client, metrics: ExecutorMetrics, service: str, classify_failure=None):
+        self._client = client
+        self._metrics = metrics
+        self._service = service
+        self._classify_failure = classify_failure or (lambda reason: "other")
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or name in self.PASSTHROUGH or not callable(attr) or isinstance(attr, type):
+            return attr
+        operation = f"{self._service}.{name}"
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = attr(*args, **kwargs)
+            except Exception as e:
+                code = getattr(e, "response", {}).get("Error", {}).get("Code") or type(e).__name__
+                self._metrics.api_call(operation, time.perf_counter() - started, error=code)
+                raise
+            failures = response.get("failures", []) if isinstance(response, dict) else []
+            self._metrics.api_call(
+                operation, time.perf_counter() - started,
+                # DescribeTasks lists the tasks ECS forgot, which the executor handles
+                failures=[self._classify_failure(f.get("reason", "")) for f in failures] if name == "run_task" else [],
+            )
+            return response
+
+        return call
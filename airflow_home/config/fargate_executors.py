@@ -0,0 +1,843 @@
+"""ECS Fargate executors, registered by the aws_executors_plugin plugin.
+
+They live outside of the plugins folder so that the processes that load the
+plugins without running an executor (workers, the DAG processor) do not import
+them, see aws_executors_plugin
+"""
+import os
+import time
+import uuid
+from collections import Counter, deque
+from copy import deepcopy
+from datetime import timedelta
+import boto3
+from airflow import settings
+from airflow.configuration import conf
+from airflow.models.taskinstance import TaskInstance, TaskInstanceKey
+from airflow.stats import Stats
+from airflow.utils.session import create_session
+from airflow.utils.sqlalchemy import tuple_in_condition
+from airflow.utils.state import TaskInstanceState
+from airflow_aws_executors import AwsBatchExecutor, AwsEcsFargateExecutor
+from airflow_aws_executors.ecs_fargate_executor import (
+    BotoDescribeTasksSchema, BotoRunTaskSchema, EcsFargateQueuedTask, EcsFargateTaskCollection,
+)
+from botocore.exceptions import ClientError
+import micro_batch
+import warm_pool
+from executor_metrics import ExecutorMetrics, InstrumentedClient, timestamp
+from launch_control import (
+    CAPACITY, DEFAULT_RETRY_POLICIES, THROTTLE, RetryPolicy, TokenBucket,
+    capacity_kwargs, classify_error, classify_reason, classify_reasons,
+)
+from micro_batch import batch_command, split_batch
+from subnet_selection import SubnetSelector
+from warm_pool import IDLE_TTL_ENV, DbCommandQueue, desired_pool_size
+from worker_profiles import (
+    DEFAULT_PROFILE, PROFILE_KEY, load_worker_profiles, select_worker_profile, worker_profile_family
+)
+
+# Limits of the ECS API
+DESCRIBE_TASKS_BATCH_SIZE = 100
+RUN_TASK_MAX_COUNT = 10
+# States in which `airflow tasks run` exits with 0, and with an error
+SUCCEEDED_STATES = {
+    TaskInstanceState.SUCCESS, TaskInstanceState.SKIPPED,
+    TaskInstanceState.UP_FOR_RESCHEDULE, TaskInstanceState.DEFERRED,
+}
+FAILED_STATES = {
+    TaskInstanceState.FAILED, TaskInstanceState.UP_FOR_RETRY,
+    TaskInstanceState.UPSTREAM_FAILED, TaskInstanceState.REMOVED,
+}
+
+
+def describe_tasks(ecs, cluster: str, task_arns: list[str]) -> dict:
+    """Describe the tasks with as few DescribeTasks calls as possible and
+    return the EcsFargateTasks, the failures and the number of calls made"""
+    response = {"tasks": [], "failures": [], "calls": 0}
+    for i in range(0, len(task_arns), DESCRIBE_TASKS_BATCH_SIZE):
+        batch = BotoDescribeTasksSchema().load(
+            ecs.describe_tasks(cluster=cluster, tasks=task_arns[i:i + DESCRIBE_TASKS_BATCH_SIZE])
+        )
+        response["tasks"].extend(batch["tasks"])
+        response["failures"].extend(batch["failures"])
+        response["calls"] += 1
+    return response
+
+
+def dead_scheduler_jobs(job_ids: set[str]) -> list[str]:
+    """Return the ids among job_ids of the scheduler jobs that are no longer
+    alive, or that do not exist"""
+    from airflow.jobs.scheduler_job import SchedulerJob
+
+    with create_session() as session:
+        jobs = session.query(SchedulerJob).filter(
+            SchedulerJob.id.in_([int(job_id) for job_id in job_ids if job_id.isdigit()])
+        )
+        alive = {str(job.id) for job in jobs if job.is_alive()}
+    return sorted(job_id for job_id in job_ids if job_id not in alive)
+
+
+class TimedTaskCollection(EcsFargateTaskCollection):
+    """Collection of the executor's ECS tasks that marks when each task
+    instance was launched and started"""
+
+    def __init__(self, metrics: ExecutorMetrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def add_task(self, task, airflow_task_key, queue, airflow_cmd, exec_config):
+        super().add_task(task, airflow_task_key, queue, airflow_cmd, exec_config)
+        # A task that failed to start is launched again
+        self.metrics.mark(airflow_task_key, "launched", first=False)
+
+    def update_task(self, task):
+        super().update_task(task)
+        if task.started_at and task.task_arn in self.arn_to_key:
+            self.metrics.mark(self.arn_to_key[task.task_arn], "started", timestamp(task.started_at))
+
+
+class ProfileRoutingFargateExecutor(AwsEcsFargateExecutor):
+    """ECS Fargate executor that runs each task instance with the task definition
+    of a worker profile (see config/worker_profiles.json). The profile is taken
+    from the "worker_profile" key of the task's executor_config, otherwise from
+    a profile named like the task's queue, otherwise the default profile.
+
+    The subnets of each launch are picked among [ecs_fargate] subnets by free
+    IP addresses (see config/subnet_selection.py), unless [subnet_selection]
+    enabled is False.
+
+    The phases of every task instance, the AWS API calls and the heartbeats
+    are timed in self.metrics (see config/executor_metrics.py), which every
+    executor below inherits"""
+
+    def __init__(self, *args, **kwargs):
+        self.metrics = ExecutorMetrics(
+            log_interval=conf.getfloat("executor_metrics", "log_interval", fallback=60.0),
+            log_tasks=conf.getboolean("executor_metrics", "log_tasks", fallback=True),
+        )
+        super().__init__(*args, **kwargs)
+
+    @property
+    def ecs(self):
+        return self._ecs
+
+    @ecs.setter
+    def ecs(self, client):
+        # Also times the stand-ins that benchmarks swap in after start()
+        self._ecs = None if client is None else InstrumentedClient(client, self.metrics, "ecs", classify_reason)
+
+    def start(self):
+        super().start()
+        self.active_workers = TimedTaskCollection(self.metrics)
+        self.worker_profiles = load_worker_profiles()
+        self.base_task_definition = self.run_task_kwargs["taskDefinition"]
+        self.subnet_selector = None
+        vpc_config = self.run_task_kwargs.get("networkConfiguration", {}).get("awsvpcConfiguration")
+        if vpc_config and conf.getboolean("subnet_selection", "enabled", fallback=True):
+            self.subnet_selector = SubnetSelector(
+                InstrumentedClient(
+                    boto3.client("ec2", region_name=conf.get("ecs_fargate", "region")), self.metrics, "ec2",
+                ),
+                vpc_config["subnets"],
+                refresh_interval=conf.getfloat("subnet_selection", "refresh_interval", fallback=300.0),
+                min_free_ips=conf.getint("subnet_selection", "min_free_ips", fallback=16),
+            )
+
+    def queue_command(self, task_instance, command, priority=1, queue=None):
+        self.metrics.mark(task_instance.key, "queued")
+        super().queue_command(task_instance, command, priority, queue)
+
+    def _process_tasks(self, task_tuples):
+        for key, *_ in task_tuples:
+            self.metrics.mark(key, "submitted")
+        super()._process_tasks(task_tuples)
+
+    def change_state(self, key, state, info=None):
+        self.metrics.finished(key, state)
+        super().change_state(key, state, info)
+
+    def heartbeat(self):
+        started, api_seconds = time.perf_counter(), self.metrics.api_seconds
+        super().heartbeat()
+        self.metrics.observe("heartbeat", time.perf_counter() - started)
+        self.metrics.observe("heartbeat.api", self.metrics.api_seconds - api_seconds)
+        self.metrics.gauge("pending_tasks", len(self.pending_tasks))
+        self.metrics.gauge("active_tasks", len(self.active_workers))
+        self.metrics.maybe_log_summary()
+
+    def place(self, run_task_api: dict) -> dict:
+        """Set the subnets of a launch, given a copy of the RunTask kwargs"""
+        if self.subnet_selector is not None:
+            run_task_api["networkConfiguration"]["awsvpcConfiguration"]["subnets"] = self.subnet_selector.choose()
+        return run_task_api
+
+    def execute_async(self, key, command, queue=None, executor_config=None):
+        # Fail at queueing time rather than at launch time on a typo
+        select_worker_profile(queue, (executor_config or {}).get(PROFILE_KEY), self.worker_profiles)
+        super().execute_async(key, command, queue, executor_config)
+
+    def _run_task_kwargs(self, task_id, cmd, queue, exec_config):
+        exec_config = dict(exec_config)
+        profile = select_worker_profile(queue, exec_config.pop(PROFILE_KEY, None), self.worker_profiles)
+        run_task_api = super()._run_task_kwargs(task_id, cmd, queue, exec_config)
+        run_task_api["taskDefinition"] = worker_profile_family(
+            self.base_task_definition, profile, self.worker_profiles
+        )
+        return self.place(run_task_api)
+
+
+class WarmPoolFargateExecutor(ProfileRoutingFargateExecutor):
+    """ECS Fargate executor that hands task instances to a pool of long-running
+    worker tasks (see config/warm_pool.py) instead of starting a Fargate task
+    for each of them. The pool runs the worker profile [warm_pool] worker_profile
+    and is sized between [warm_pool] min_workers and max_workers by the number of
+    queued and running commands; workers above min_workers stop after
+    [warm_pool] idle_ttl seconds without work. Task instances that need another
+    profile or override the container still get a task of their own.
+
+    The commands and the workers outlive the executor. The commands of
+    schedulers that are no longer alive are taken over when the scheduler
+    adopts or resets their task instances (see try_adopt_task_instances), and
+    every [warm_pool] reconcile_interval seconds: queued and finished ones are
+    dropped, since the scheduler resets their task instances and queues them
+    again, and running ones are adopted. Their workers, tagged with their
+    scheduler job in the ECS startedBy, are adopted too, except for core
+    workers above min_workers, which are stopped once idle"""
+
+    def start(self):
+        super().start()
+        self.pool_profile = conf.get("warm_pool", "worker_profile", fallback=DEFAULT_PROFILE)
+        if self.pool_profile not in self.worker_profiles:
+            raise ValueError(f"Unknown warm pool worker profile {self.pool_profile!r}")
+        self.min_workers = conf.getint("warm_pool", "min_workers", fallback=1)
+        self.max_workers = max(self.min_workers, conf.getint("warm_pool", "max_workers", fallback=4))
+        self.idle_ttl = conf.getfloat("warm_pool", "idle_ttl", fallback=300.0)
+        self.reconcile_interval = conf.getfloat("warm_pool", "reconcile_interval", fallback=60.0)
+        self.reconciled_at = None
+        self.command_queue = DbCommandQueue(settings.engine)
+        self.command_queue.check_table()
+        # Set by the SchedulerJob before it starts the executor
+        self.owner = None if self.job_id is None else str(self.job_id)
+        # command queue item id -> task instance key
+        self.pool_commands = {}
+        # task ARN -> EcsFargateTask (None until described) of every pool
+        # worker that has not stopped
+        self.pool_workers = {}
+        # the workers that run without an idle TTL
+        self.core_workers = set()
+        self.pool_draining = False
+
+    def adopt_orphaned_commands(self, orphaned: list[str]):
+        """Drop the queued and finished commands of the dead scheduler jobs
+        `orphaned` and adopt their running ones"""
+        if self.owner is None or not orphaned:
+            return
+        dropped, running = self.command_queue.reconcile(orphaned, self.owner)
+        for item_id, ti_key, worker_id in running:
+            key = TaskInstanceKey(*ti_key)
+            self.pool_commands[item_id] = key
+            self.running.add(key)
+            self.pool_workers.setdefault(worker_id, None)
+        if dropped or running:
+            self.log.info(
+                "Took over the commands of dead schedulers %s: dropped %d queued or finished, adopted %d running",
+                orphaned, dropped, len(running),
+            )
+
+    def list_orphaned_pool_workers(self) -> dict[str, tuple[str, bool]]:
+        """Return the owner, and whether it is a core worker, of each running
+        pool worker that another scheduler job started"""
+        family = worker_profile_family(self.base_task_definition, self.pool_profile, self.worker_profiles)
+        arns, kwargs = [], {"cluster": self.cluster, "family": family, "desiredStatus": "RUNNING"}
+        while True:
+            response = self.ecs.list_tasks(**kwargs)
+            arns.extend(response.get("taskArns", []))
+            if not response.get("nextToken"):
+                break
+            kwargs["nextToken"] = response["nextToken"]
+        workers = {}
+        for i in range(0, len(arns), DESCRIBE_TASKS_BATCH_SIZE):
+            # The describe schema of the base executor drops startedBy
+            response = self.ecs.describe_tasks(cluster=self.cluster, tasks=arns[i:i + DESCRIBE_TASKS_BATCH_SIZE])
+            for task in response["tasks"]:
+                started_by = warm_pool.parse_pool_started_by(task.get("startedBy"))
+                if started_by is not None and started_by[0] != self.owner:
+                    workers[task["taskArn"]] = started_by
+        return workers
+
+    def adopt_orphaned_workers(self, workers: dict[str, bool]):
+        """Adopt the pool workers `workers` of dead schedulers, counting core
+        workers (True) towards min_workers, and stop the idle core workers
+        above it"""
+        busy = self.command_queue.busy_workers()
+        for arn, core in sorted(workers.items()):
+            if arn not in self.pool_workers:
+                self.log.info("Adopting pool worker %s of a dead scheduler", arn)
+                self.pool_workers[arn] = None
+            if not core:
+                continue
+            self.core_workers.add(arn)
+            if len(self.core_workers) > self.min_workers and arn not in busy:
+                # Stays in pool_workers until it stopped, in case it claimed a command
+                self.core_workers.discard(arn)
+                self.ecs.stop_task(cluster=self.cluster, task=arn, reason="Warm pool has enough core workers")
+
+    def reconcile_pool(self):
+        """Take over the commands and the pool workers of dead schedulers"""
+        workers = self.list_orphaned_pool_workers()
+        owners = self.command_queue.owners() | {owner for owner, _ in workers.values()}
+        orphaned = dead_scheduler_jobs(owners - {self.owner})
+        self.adopt_orphaned_commands(orphaned)
+        self.adopt_orphaned_workers({arn: core for arn, (owner, core) in workers.items() if owner in orphaned})
+
+    def try_adopt_task_instances(self, tis):
+        """Take over the commands of the dead schedulers that queued tis, keep
+        the task instances whose running command was adopted and let the
+        scheduler reset the others, whose commands were dropped"""
+        self.adopt_orphaned_commands(sorted(
+            {str(ti.queued_by_job_id) for ti in tis if ti.queued_by_job_id is not None} - {self.owner}
+        ))
+        adopted = {key.primary for key in self.pool_commands.values()}
+        return super().try_adopt_task_instances([ti for ti in tis if ti.key.primary not in adopted])
+
+    def execute_async(self, key, command, queue=None, executor_config=None):
+        executor_config = executor_config or {}
+        profile = select_worker_profile(queue, executor_config.get(PROFILE_KEY), self.worker_profiles)
+        if profile != self.pool_profile or set(executor_config) - {PROFILE_KEY}:
+            super().execute_async(key, command, queue, executor_config)
+            return
+        item_id = uuid.uuid4().hex
+        self.command_queue.put(item_id, command, owner=self.owner, ti_key=list(key))
+        self.pool_commands[item_id] = key
+
+    def sync(self):
+        super().sync()
+        now = time.monotonic()
+        due = self.reconciled_at is None or now - self.reconciled_at >= self.reconcile_interval
+        if self.owner is not None and due:
+            self.reconcile_pool()
+            self.reconciled_at = now
+        self.sync_pool_workers()
+        self.collect_pool_results()
+        if not self.pool_draining:
+            self.scale_pool()
+
+    def sync_pool_workers(self):
+        """Forget the pool workers that stopped, failing the commands they were
+        running"""
+        response = describe_tasks(self.ecs, self.cluster, list(self.pool_workers))
+        stopped = [(failure["arn"], failure["reason"]) for failure in response["failures"]]
+        for task in response["tasks"]:
+            if task.last_status == "STOPPED":
+                stopped.append((task.task_arn, task.stopped_reason))
+            else:
+                self.pool_workers[task.task_arn] = task
+        for arn, reason in stopped:
+            self.pool_workers.pop(arn, None)
+            self.core_workers.discard(arn)
+            lost = self.command_queue.release(arn)
+            if lost:
+                self.log.warning("Pool worker %s stopped (%s) while running %d commands", arn, reason, lost)
+            else:
+                self.log.info("Pool worker %s stopped (%s)", arn, reason)
+
+    def collect_pool_results(self):
+        if not self.pool_commands:
+            return
+        for item_id, return_code in self.command_queue.pop_results(list(self.pool_commands)).items():
+            key = self.pool_commands.pop(item_id)
+            if return_code == 0:
+                self.success(key)
+            else:
+                self.fail(key)
+
+    def scale_pool(self):
+        counts = self.command_queue.counts(list(self.pool_commands))
+        size = desired_pool_size(sum(counts.values()), self.min_workers, self.max_workers)
+        missing_core = self.min_workers - len(self.core_workers)
+        if missing_core > 0:
+            self.core_workers.update(self.launch_pool_workers(missing_core, idle_ttl=0))
+        missing = size - len(self.pool_workers)
+        if missing > 0:
+            self.launch_pool_workers(missing, idle_ttl=self.idle_ttl)
+
+    def launch_pool_workers(self, count: int, idle_ttl: float) -> list[str]:
+        """Start up to `count` pool workers and return their task ARNs"""
+        run_task_api = self.place(deepcopy(self.run_task_kwargs))
+        run_task_api["taskDefinition"] = worker_profile_family(
+            self.base_task_definition, self.pool_profile, self.worker_profiles
+        )
+        container = self.get_container(run_task_api["overrides"]["containerOverrides"])
+        container["command"] = ["python", os.path.abspath(warm_pool.__file__)]
+        container.setdefault("environment", []).append({"name": IDLE_TTL_ENV, "value": str(idle_ttl)})
+        if self.owner is not None:
+            run_task_api["startedBy"] = warm_pool.pool_started_by(self.owner, core=idle_ttl == 0)
+        launched = []
+        while len(launched) < count:
+            run_task_api["count"] = min(count - len(launched), RUN_TASK_MAX_COUNT)
+            response = BotoRunTaskSchema().load(self.ecs.run_task(**run_task_api))
+            launched.extend(response["tasks"])
+            if response["failures"] or not response["tasks"]:
+                self.log.warning(
+                    "Started %d of %d pool workers, will retry on the next sync: %s",
+                    len(launched), count, [failure.get("reason") for failure in response["failures"]],
+                )
+                break
+        for task in launched:
+            self.pool_workers[task.task_arn] = task
+        return [task.task_arn for task in launched]
+
+    def stop_pool_workers(self, reason: str):
+        for arn in list(self.pool_workers):
+            self.ecs.stop_task(cluster=self.cluster, task=arn, reason=reason)
+
+    def end(self, heartbeat_interval=10):
+        """Wait for the running task instances, then stop the pool"""
+        self.pool_draining = True
+        while True:
+            self.sync()
+            if not self.active_workers and not self.pool_commands:
+                break
+            time.sleep(heartbeat_interval)
+        self.stop_pool_workers("Airflow executor is shutting down")
+
+    def terminate(self):
+        self.pool_draining = True
+        self.stop_pool_workers("Airflow executor received a SIGTERM")
+        super().terminate()
+
+
+class PendingBatch:
+    """A batch of task instances waiting for a successful RunTask call"""
+
+    def __init__(self, profile: str, batch: list):
+        self.profile = profile
+        self.batch = batch
+        self.not_before = 0.0
+        self.failures = Counter()
+
+
+class MicroBatchFargateExecutor(ProfileRoutingFargateExecutor):
+    """ECS Fargate executor that packs the task instances queued within
+    [micro_batch] window seconds into one Fargate task per worker profile, of at
+    most [micro_batch] max_batch_size task instances, which runs their commands
+    [micro_batch] concurrency at a time (see config/micro_batch.py). The state
+    of each task instance is reported as soon as the metadata database shows
+    that its command finished. Task instances that override the container still
+    get a task of their own. A batch that fails to launch is retried with the
+    backoff of launch_control's DEFAULT_RETRY_POLICIES, after which its task
+    instances fail"""
+
+    def start(self):
+        super().start()
+        self.batch_window = conf.getfloat("micro_batch", "window", fallback=5.0)
+        self.max_batch_size = conf.getint("micro_batch", "max_batch_size", fallback=8)
+        self.batch_concurrency = conf.getint("micro_batch", "concurrency", fallback=4)
+        # profile -> [(key, command)] collected in the current window, and when
+        # the window opened
+        self.batch_buffers = {}
+        self.batch_window_started = {}
+        # PendingBatch of (key, command), in launch order
+        self.pending_batches = deque()
+        # task ARN -> keys of the batch's task instances not reported yet
+        self.batches = {}
+
+    def execute_async(self, key, command, queue=None, executor_config=None):
+        executor_config = executor_config or {}
+        if set(executor_config) - {PROFILE_KEY}:
+            super().execute_async(key, command, queue, executor_config)
+            return
+        profile = select_worker_profile(queue, executor_config.get(PROFILE_KEY), self.worker_profiles)
+        buffer = self.batch_buffers.setdefault(profile, [])
+        if not buffer:
+            self.batch_window_started[profile] = time.monotonic()
+        buffer.append((key, command))
+
+    def sync(self):
+        super().sync()
+        self.flush_batches()
+        self.sync_batches()
+
+    def flush_batches(self, force: bool = False):
+        """Launch the batches whose window closed or that are full"""
+        now = time.monotonic()
+        for profile, buffer in self.batch_buffers.items():
+            if buffer and (
+                force or len(buffer) >= self.max_batch_size
+                or now - self.batch_window_started[profile] >= self.batch_window
+            ):
+                for batch in split_batch(buffer, self.max_batch_size):
+                    self.pending_batches.append(PendingBatch(profile, batch))
+                self.batch_buffers[profile] = []
+        for _ in range(len(self.pending_batches)):
+            pending = self.pending_batches.popleft()
+            if pending.not_before > now:
+                self.pending_batches.append(pending)
+            else:
+                self.launch_batch(pending, now)
+
+    def launch_batch(self, pending: PendingBatch, now: float):
+        run_task_api = self.place(deepcopy(self.run_task_kwargs))
+        run_task_api["taskDefinition"] = worker_profile_family(
+            self.base_task_definition, pending.profile, self.worker_profiles
+        )
+        container = self.get_container(run_task_api["overrides"]["containerOverrides"])
+        container["command"] = batch_command(
+            os.path.abspath(micro_batch.__file__), [command for _, command in pending.batch], self.batch_concurrency
+        )
+        try:
+            response = BotoRunTaskSchema().load(self.ecs.run_task(**run_task_api))
+        except ClientError as e:
+            self.retry_batch(pending, classify_error(e), str(e), now)
+            return
+        if response["failures"] or not response["tasks"]:
+            reasons = [failure.get("reason", "unknown") for failure in response["failures"]] or ["no task started"]
+            self.retry_batch(pending, classify_reasons(reasons), ", ".join(reasons), now)
+            return
+        task_arn = response["tasks"][0].task_arn
+        self.batches[task_arn] = [key for key, _ in pending.batch]
+        self.log.info("Started batch %s of %d task instances (%s)", task_arn, len(pending.batch), pending.profile)
+
+    def retry_batch(self, pending: PendingBatch, kind: str, reason: str, now: float):
+        pending.failures[kind] += 1
+        policy = DEFAULT_RETRY_POLICIES[kind]
+        if pending.failures[kind] > policy.max_attempts:
+            self.log.error(
+                "Could not start a batch of %d task instances after %d %s failures: %s",
+                len(pending.batch), pending.failures[kind], kind, reason,
+            )
+            for key, _ in pending.batch:
+                self.fail(key)
+            return
+        delay = policy.delay(pending.failures[kind])
+        pending.not_before = now + delay
+        self.log.warning(
+            "Could not start a batch of %d task instances (%s: %s), retrying in %.1fs",
+            len(pending.batch), kind, reason, delay,
+        )
+        self.pending_batches.append(pending)
+
+    def sync_batches(self):
+        """Report the task instances whose command finished, and fail the
+        unreported ones of the batches that stopped"""
+        if not self.batches:
+            return
+        response = describe_tasks(self.ecs, self.cluster, list(self.batches))
+        stopped = {failure["arn"]: failure["reason"] for failure in response["failures"]}
+        stopped.update(
+            (task.task_arn, task.stopped_reason) for task in response["tasks"] if task.last_status == "STOPPED"
+        )
+        # Read the states after describing the batches, so that a batch that
+        # stopped has all its final states in the database already
+        states = self.task_instance_states([key for keys in self.batches.values() for key in keys])
+        for arn, keys in list(self.batches.items()):
+            for key in list(keys):
+                state = states.get(key.primary)
+                if state in SUCCEEDED_STATES:
+                    self.success(key)
+                elif state in FAILED_STATES:
+                    self.fail(key)
+                elif arn in stopped:
+                    self.log.error("Batch %s stopped (%s) before %s finished", arn, stopped[arn], key)
+                    self.fail(key)
+                else:
+                    continue
+                keys.remove(key)
+            if not keys:
+                del self.batches[arn]
+
+    @staticmethod
+    def task_instance_states(keys: list) -> dict:
+        """Return the state of each task instance, by the primary part of its key"""
+        if not keys:
+            return {}
+        ti = TaskInstance
+        with create_session() as session:
+            rows = session.query(ti.dag_id, ti.task_id, ti.run_id, ti.map_index, ti.state).filter(
+                tuple_in_condition((ti.dag_id, ti.task_id, ti.run_id, ti.map_index), [key.primary for key in keys])
+            )
+            return {(dag_id, task_id, run_id, map_index): state for dag_id, task_id, run_id, map_index, state in rows}
+
+    def end(self, heartbeat_interval=10):
+        """Launch what is still buffered, then wait for every task instance"""
+        while True:
+            self.flush_batches(force=True)
+            self.sync()
+            if not self.active_workers and not self.pending_batches and not self.batches:
+                break
+            time.sleep(heartbeat_interval)
+
+    def terminate(self):
+        self.batch_buffers.clear()
+        self.pending_batches.clear()
+        for arn in self.batches:
+            self.ecs.stop_task(cluster=self.cluster, task=arn, reason="Airflow executor received a SIGTERM")
+        super().terminate()
+
+
+class SyncMetrics:
+    """Durations and API usage of the last `window` state syncs, also sent to
+    StatsD under ecs_fargate.sync.*"""
+
+    def __init__(self, window: int = 100):
+        self.durations = deque(maxlen=window)
+        self.describe_calls = 0
+        self.tasks_polled = 0
+        self.tasks_skipped = 0
+
+    def record(self, duration: float, calls: int, polled: int, skipped: int):
+        self.durations.append(duration)
+        self.describe_calls += calls
+        self.tasks_polled += polled
+        self.tasks_skipped += skipped
+        Stats.timing("ecs_fargate.sync.duration", timedelta(seconds=duration))
+        Stats.incr("ecs_fargate.sync.describe_tasks_calls", calls)
+        Stats.gauge("ecs_fargate.sync.tasks_polled", polled)
+        Stats.gauge("ecs_fargate.sync.tasks_skipped", skipped)
+
+    def summary(self) -> dict:
+        durations = sorted(self.durations)
+        if not durations:
+            return {"syncs": 0}
+        return {
+            "syncs": len(durations),
+            "duration_p50": durations[len(durations) // 2],
+            "duration_p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "duration_max": durations[-1],
+            "describe_tasks_calls": self.describe_calls,
+            "tasks_polled": self.tasks_polled,
+            "tasks_skipped": self.tasks_skipped,
+        }
+
+
+class AdaptiveSyncFargateExecutor(ProfileRoutingFargateExecutor):
+    """ECS Fargate executor whose state sync describes 100 tasks per call and
+    only the tasks that are due. A task is due on every sync right after it was
+    launched or changed status, and then less and less often the longer its
+    status stays the same: every [adaptive_sync] poll_interval_factor times the
+    time spent in that status, between min_poll_interval and max_poll_interval
+    seconds. A task seen in a final state is dropped from the executor by the
+    same sync, so it is never described again. Sync durations and API calls
+    are kept in self.sync_metrics and sent to StatsD"""
+
+    def start(self):
+        super().start()
+        self.min_poll_interval = conf.getfloat("adaptive_sync", "min_poll_interval", fallback=0.0)
+        self.max_poll_interval = conf.getfloat("adaptive_sync", "max_poll_interval", fallback=30.0)
+        self.poll_interval_factor = conf.getfloat("adaptive_sync", "poll_interval_factor", fallback=0.1)
+        self.clock = time.monotonic
+        # task ARN -> (last status, desired status, when it was first seen with
+        # them, when it is due next)
+        self.poll_schedule = {}
+        self.sync_metrics = SyncMetrics()
+
+    def schedule_next_poll(self, task, now: float):
+        last_status, desired_status, since, _ = self.poll_schedule.get(task.task_arn, (None, None, now, now))
+        if (task.last_status, task.desired_status) != (last_status, desired_status):
+            since = now
+        interval = min(self.max_poll_interval, max(self.min_poll_interval, (now - since) * self.poll_interval_factor))
+        self.poll_schedule[task.task_arn] = (task.last_status, task.desired_status, since, now + interval)
+
+    def handle_failed_task(self, task_arn: str, reason: str):
+        """Launch the task instance again, or fail it after MAX_FAILURE_CHECKS
+        attempts, like the base executor does with its private handler"""
+        key = self.active_workers.arn_to_key[task_arn]
+        command, queue, exec_config = self.active_workers.info_by_key(key)
+        failure_count = self.active_workers.failure_count_by_key(key)
+        if failure_count < self.MAX_FAILURE_CHECKS:
+            self.log.warning(
+                "Task %s has failed due to %s. Failure %s out of %s occurred on %s. Rescheduling.",
+                key, reason, failure_count, self.MAX_FAILURE_CHECKS, task_arn,
+            )
+            self.active_workers.increment_failure_count(key)
+            self.pending_tasks.appendleft(EcsFargateQueuedTask(key, command, queue, exec_config))
+        else:
+            self.log.error("Task %s has failed a maximum of %s times. Marking as failed", key, failure_count)
+            self.active_workers.pop_by_key(key)
+            self.fail(key)
+
+    def update_running_task(self, task):
+        """Report the task instance of a task that finished and forget the
+        task, as the base executor does with its private handler"""
+        self.active_workers.update_task(task)
+        state = task.get_task_state()
+        key = self.active_workers.arn_to_key[task.task_arn]
+        if state == TaskInstanceState.FAILED:
+            self.fail(key)
+        elif state == TaskInstanceState.SUCCESS:
+            self.success(key)
+        elif state == TaskInstanceState.REMOVED:
+            self.handle_failed_task(task.task_arn, task.stopped_reason)
+        if state in (TaskInstanceState.FAILED, TaskInstanceState.SUCCESS):
+            self.active_workers.pop_by_key(key)
+
+    def sync_running_tasks(self):
+        started = time.perf_counter()
+        now = self.clock()
+        arns = self.active_workers.get_all_arns()
+        due = [arn for arn in arns if self.poll_schedule.get(arn, (None, None, now, now))[3] <= now]
+        response = describe_tasks(self.ecs, self.cluster, due)
+
+        for failure in response["failures"]:
+            self.handle_failed_task(failure["arn"], failure["reason"])
+        for task in response["tasks"]:
+            self.schedule_next_poll(task, now)
+            self.update_running_task(task)
+
+        active = set(self.active_workers.get_all_arns())
+        for arn in [arn for arn in self.poll_schedule if arn not in active]:
+            del self.poll_schedule[arn]
+        self.sync_metrics.record(
+            time.perf_counter() - started, response["calls"], len(due), len(arns) - len(due),
+        )
+        self.log.debug("Synced %d of %d tasks in %d DescribeTasks calls", len(due), len(arns), response["calls"])
+
+
+class LaunchAttempt:
+    """A queued task instance waiting for a successful RunTask call"""
+
+    def __init__(self, task, spot: bool):
+        self.task = task
+        self.spot = spot
+        self.not_before = 0.0
+        self.failures = Counter()
+
+
+class RateLimitedFargateExecutor(ProfileRoutingFargateExecutor):
+    """ECS Fargate executor whose RunTask calls go through a token bucket of
+    [run_task] rate calls per second and [run_task] burst calls (see
+    config/launch_control.py). Launch failures are retried with a backoff that
+    depends on whether RunTask was throttled, was out of capacity or was given
+    a wrong request; the latter fails the task instance. With [run_task]
+    fargate_spot, tasks are launched on Fargate Spot and fall back to on-demand
+    Fargate when Spot has no capacity; after that, launches skip Spot for
+    [run_task] spot_cooldown seconds. Task instances are never held back by the
+    ones waiting for their next retry. A task that ECS lost is dropped from the
+    executor as soon as its relaunch is queued, so each task instance waits in
+    the launch queue at most once"""
+
+    def start(self):
+        super().start()
+        self.run_task_bucket = TokenBucket(
+            rate=conf.getfloat("run_task", "rate", fallback=20.0),
+            burst=conf.getfloat("run_task", "burst", fallback=100.0),
+        )
+        self.use_spot = conf.getboolean("run_task", "fargate_spot", fallback=False)
+        self.spot_cooldown = conf.getfloat("run_task", "spot_cooldown", fallback=60.0)
+        self.spot_unavailable_until = 0.0
+        self.retry_policies = dict(DEFAULT_RETRY_POLICIES)
+        self.retry_policies[CAPACITY] = RetryPolicy(
+            base=conf.getfloat("run_task", "capacity_backoff", fallback=DEFAULT_RETRY_POLICIES[CAPACITY].base),
+            cap=DEFAULT_RETRY_POLICIES[CAPACITY].cap,
+            max_attempts=conf.getint(
+                "run_task", "capacity_max_attempts", fallback=DEFAULT_RETRY_POLICIES[CAPACITY].max_attempts,
+            ),
+        )
+        self.launch_queue = deque()
+        self.launch_counts = Counter()
+        # Times ECS lost the task of a task instance, which pop_by_key would
+        # forget along with the lost task
+        self.lost_counts = Counter()
+
+    def handle_lost_task(self, task_arn: str, reason: str):
+        """Queue the relaunch of the task instance of a task that ECS lost, or
+        fail it after MAX_FAILURE_CHECKS relaunches"""
+        key = self.active_workers.arn_to_key[task_arn]
+        command, queue, exec_config = self.active_workers.info_by_key(key)
+        self.active_workers.pop_by_key(key)
+        if self.lost_counts[key] < self.MAX_FAILURE_CHECKS:
+            self.log.warning(
+                "Task %s has failed due to %s. Failure %s out of %s occurred on %s. Rescheduling.",
+                key, reason, self.lost_counts[key], self.MAX_FAILURE_CHECKS, task_arn,
+            )
+            self.lost_counts[key] += 1
+            self.pending_tasks.appendleft(EcsFargateQueuedTask(key, command, queue, exec_config))
+        else:
+            self.log.error("Task %s has failed a maximum of %s times. Marking as failed", key, self.lost_counts[key])
+            del self.lost_counts[key]
+            self.fail(key)
+
+    def sync_running_tasks(self):
+        response = describe_tasks(self.ecs, self.cluster, self.active_workers.get_all_arns())
+        for failure in response["failures"]:
+            self.handle_lost_task(failure["arn"], failure["reason"])
+        for task in response["tasks"]:
+            self.active_workers.update_task(task)
+            state = task.get_task_state()
+            key = self.active_workers.arn_to_key[task.task_arn]
+            if state == TaskInstanceState.REMOVED:
+                self.handle_lost_task(task.task_arn, task.stopped_reason)
+            elif state in (TaskInstanceState.FAILED, TaskInstanceState.SUCCESS):
+                if state == TaskInstanceState.FAILED:
+                    self.fail(key)
+                else:
+                    self.success(key)
+                self.active_workers.pop_by_key(key)
+                self.lost_counts.pop(key, None)
+
+    def attempt_task_runs(self):
+        # pending_tasks also receives the relaunches of handle_lost_task
+        queued = {attempt.task[0] for attempt in self.launch_queue}
+        while self.pending_tasks:
+            task = self.pending_tasks.popleft()
+            if task[0] not in queued:
+                queued.add(task[0])
+                self.launch_queue.append(LaunchAttempt(task, spot=self.use_spot))
+        now = time.monotonic()
+        for _ in range(len(self.launch_queue)):
+            attempt = self.launch_queue.popleft()
+            if attempt.task[0] not in self.running:
+                # Failed or otherwise finished while waiting for its launch
+                self.lost_counts.pop(attempt.task[0], None)
+            elif attempt.not_before > now:
+                self.launch_queue.append(attempt)
+            elif not self.run_task_bucket.take():
+                self.launch_queue.appendleft(attempt)
+                break
+            else:
+                self.launch(attempt, now)
+        Stats.gauge("ecs_fargate.run_task.queued", len(self.launch_queue))
+
+    def launch(self, attempt: LaunchAttempt, now: float):
+        key, cmd, queue, exec_config = attempt.task
+        attempt.spot = attempt.spot and now >= self.spot_unavailable_until
+        run_task_api = capacity_kwargs(self._run_task_kwargs(key, cmd, queue, exec_config), attempt.spot)
+        try:
+            response = BotoRunTaskSchema().load(self.ecs.run_task(**run_task_api))
+        except ClientError as e:
+            self.retry(attempt, classify_error(e), str(e), now)
+            return
+        if response["failures"] or not response["tasks"]:
+            reasons = [failure.get("reason", "unknown") for failure in response["failures"]] or ["no task started"]
+            self.retry(attempt, classify_reasons(reasons), ", ".join(reasons), now)
+            return
+        self.run_task_bucket.succeeded()
+        self.launch_counts["spot" if attempt.spot else "on_demand"] += 1
+        Stats.incr("ecs_fargate.run_task.launched")
+        self.active_workers.add_task(response["tasks"][0], key, queue, cmd, exec_config)
+
+    def retry(self, attempt: LaunchAttempt, kind: str, reason: str, now: float):
+        key = attempt.task[0]
+        attempt.failures[kind] += 1
+        self.launch_counts[kind] += 1
+        Stats.incr(f"ecs_fargate.run_task.{kind}")
+        if kind == THROTTLE:
+            self.run_task_bucket.throttled()
+        if kind == CAPACITY and attempt.spot:
+            self.log.info("No Fargate Spot capacity for %s (%s), falling back to on-demand", key, reason)
+            attempt.spot = False
+            self.spot_unavailable_until = now + self.spot_cooldown
+            self.launch_queue.append(attempt)
+            return
+        policy = self.retry_policies[kind]
+        if attempt.failures[kind] > policy.max_attempts:
+            self.log.error("Could not launch %s after %d %s failures: %s", key, attempt.failures[kind], kind, reason)
+            self.lost_counts.pop(key, None)
+            self.fail(key)
+            return
+        delay = policy.delay(attempt.failures[kind])
+        attempt.not_before = now + delay
+        self.log.warning("Launching %s failed (%s: %s), retrying in %.1fs", key, kind, reason, delay)
+        self.launch_queue.append(attempt)
+
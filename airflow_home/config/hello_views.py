@@ -0,0 +1,10 @@
+"""Views of the Hello plugin, imported by the webserver only"""
+from flask_appbuilder import BaseView, expose
+
+class HelloWorld(BaseView):
+    route_base = "/hello"
+    default_view = "world"
+
+    @expose("/world")
+    def world(self):
+        return "<h1>Hello, world!</h1>"
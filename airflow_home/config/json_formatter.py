@@ -0,0 +1,110 @@
+"""Drop-in replacement for pythonjsonlogger.jsonlogger.JsonFormatter that
+produces the same keys with less work per record.
+
+The fields named in the format string and the set of attributes to skip when
+collecting extras are computed once, in __init__. The second-resolution part
+of asctime is reused across records of the same second, formatted tracebacks
+are cached on the record like logging.Formatter does, and the record is
+encoded with orjson when it is installed, otherwise with a JSONEncoder that is
+created once instead of on every call
+"""
+import json
+import logging
+import re
+import time
+import traceback
+from datetime import date, datetime, time as datetime_time
+from inspect import istraceback
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Same as pythonjsonlogger.jsonlogger.RESERVED_ATTRS so that extras match
+RESERVED_ATTRS = (
+    "args", "asctime", "created", "exc_info", "exc_text", "filename",
+    "funcName", "levelname", "levelno", "lineno", "module",
+    "msecs", "message", "msg", "name", "pathname", "process",
+    "processName", "relativeCreated", "stack_info", "thread", "threadName",
+)
+FIELD_PATTERNS = {
+    logging.StringTemplateStyle: re.compile(r"\$\{(.+?)\}"),
+    logging.StrFormatStyle: re.compile(r"\{(.+?)\}"),
+    logging.PercentStyle: re.compile(r"%\((.+?)\)"),
+}
+
+
+def json_default(obj):
+    """Encode the objects that pythonjsonlogger's JsonEncoder handles
+    """
+    if isinstance(obj, (date, datetime, datetime_time)):
+        return obj.isoformat()
+    if istraceback(obj):
+        return "".join(traceback.format_tb(obj)).strip()
+    try:
+        return str(obj)
+    except Exception:
+        return None
+
+
+class FastJsonFormatter(logging.Formatter):
+    def __init__(self, fmt=None, datefmt=None, style="%", validate=True):
+        super().__init__(fmt, datefmt, style, validate)
+        pattern = FIELD_PATTERNS[type(self._style)]
+        self._fields = tuple(pattern.findall(self._fmt or ""))
+        self._needs_asctime = "asctime" in self._fields
+        self._skip = frozenset(self._fields) | frozenset(RESERVED_ATTRS)
+        self._encoder = json.JSONEncoder(default=json_default)
+        # (second, formatted second), replaced as a whole so threads never see
+        # a second paired with another second's text
+        self._asctime_cache = (None, "")
+
+    def formatTime(self, record, datefmt=None):
+        if datefmt is not None:
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, prefix = self._asctime_cache
+        if second != cached_second:
+            prefix = time.strftime(self.default_time_format, self.converter(second))
+            self._asctime_cache = (second, prefix)
+        return self.default_msec_format % (prefix, record.msecs)
+
+    def encode(self, log_record: dict) -> str:
+        if orjson is not None:
+            try:
+                return orjson.dumps(
+                    log_record, default=json_default, option=orjson.OPT_NON_STR_KEYS,
+                ).decode("utf-8")
+            except TypeError:
+                pass  # e.g. integers wider than 64 bits
+        return self._encoder.encode(log_record)
+
+    def format(self, record: logging.LogRecord) -> str:
+        attrs = record.__dict__
+        message_dict = None
+        if isinstance(record.msg, dict):
+            message_dict = record.msg
+            record.message = ""
+        else:
+            record.message = record.getMessage()
+        if self._needs_asctime:
+            record.asctime = self.formatTime(record, self.datefmt)
+
+        log_record = {field: attrs.get(field) for field in self._fields}
+        if message_dict:
+            log_record.update(message_dict)
+        if record.exc_info and not (message_dict and message_dict.get("exc_info")):
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            log_record["exc_info"] = record.exc_text
+        if not log_record.get("exc_info") and record.exc_text:
+            log_record["exc_info"] = record.exc_text
+        if record.stack_info and not (message_dict and message_dict.get("stack_info")):
+            log_record["stack_info"] = self.formatStack(record.stack_info)
+
+        skip = self._skip
+        for key, value in attrs.items():
+            if key not in skip and not (isinstance(key, str) and key.startswith("_")):
+                log_record[key] = value
+        return self.encode(log_record)
@@ -0,0 +1,140 @@
+"""Pacing and retry policy of the RunTask calls of RateLimitedFargateExecutor.
+
+RunTask calls go through a token bucket sized after the account's Fargate task
+launch quota. A throttled call halves the bucket's rate, which then climbs back
+to the configured rate one successful call at a time, so that a burst of task
+instances keeps launching at the API ceiling instead of retrying into more
+throttling.
+
+Failed launches are classified as throttle, capacity or config failures:
+
+* throttle: RunTask throttled the call, retried after a short backoff
+* capacity: no Fargate capacity or ENI left right now, retried after a long
+  backoff; a Fargate Spot launch falls back to on-demand first
+* config: the request itself is wrong (task definition, subnets, permissions),
+  which retrying does not fix, so the task instance fails right away
+"""
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+THROTTLE, CAPACITY, CONFIG = "throttle", "capacity", "config"
+
+THROTTLE_CODES = {
+    "ThrottlingException", "Throttling", "RequestLimitExceeded", "TooManyRequestsException",
+}
+CONFIG_CODES = {
+    "AccessDeniedException", "ClusterNotFoundException", "InvalidParameterException",
+    "PlatformTaskDefinitionIncompatibilityException", "PlatformUnknownException",
+    "UnsupportedFeatureException", "BlockedException",
+}
+# Failure reasons of RunTask responses that retrying does not fix
+CONFIG_REASONS = ("ATTRIBUTE", "MISSING", "INACTIVE")
+
+
+class RetryPolicy:
+    def __init__(self, base: float, cap: float, max_attempts: int):
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts
+
+    def delay(self, attempt: int, rand=random.random) -> float:
+        """Return an exponential backoff with equal jitter for the attempt-th
+        retry, starting at 1
+        """
+        ceiling = min(self.cap, self.base * 2 ** (attempt - 1))
+        return ceiling / 2 + rand() * ceiling / 2
+
+
+DEFAULT_RETRY_POLICIES = {
+    THROTTLE: RetryPolicy(base=1.0, cap=30.0, max_attempts=50),
+    CAPACITY: RetryPolicy(base=10.0, cap=300.0, max_attempts=30),
+    CONFIG: RetryPolicy(base=0.0, cap=0.0, max_attempts=0),
+}
+
+
+def classify_error(error: ClientError) -> str:
+    """Return the kind of failure of a RunTask call that raised"""
+    error_info = error.response.get("Error", {})
+    code = error_info.get("Code", "")
+    message = error_info.get("Message", "").lower()
+    if code in THROTTLE_CODES or "rate exceeded" in message:
+        return THROTTLE
+    if code in CONFIG_CODES:
+        return CONFIG
+    if code == "ClientException" and "capacity" not in message and "limit" not in message:
+        return CONFIG
+    return CAPACITY
+
+
+def classify_reason(reason: str) -> str:
+    """Return the kind of failure of a failure listed in a RunTask response,
+    e.g. RESOURCE:ENI or "Capacity is unavailable at this time"
+    """
+    if "rate exceeded" in reason.lower() or "throttl" in reason.lower():
+        return THROTTLE
+    if reason.upper().startswith(CONFIG_REASONS):
+        return CONFIG
+    return CAPACITY
+
+
+def classify_reasons(reasons: list[str]) -> str:
+    """Return the kind of failure of a RunTask response listing `reasons`,
+    the one that retrying is least likely to fix"""
+    kinds = {classify_reason(reason) for reason in reasons}
+    return CONFIG if CONFIG in kinds else THROTTLE if THROTTLE in kinds else CAPACITY
+
+
+def capacity_kwargs(run_task_kwargs: dict, spot: bool) -> dict:
+    """Return RunTask kwargs that launch on Fargate Spot, or as configured"""
+    if not spot:
+        return run_task_kwargs
+    run_task_kwargs = dict(run_task_kwargs)
+    # launchType and capacityProviderStrategy are mutually exclusive
+    run_task_kwargs.pop("launchType", None)
+    run_task_kwargs["capacityProviderStrategy"] = [{"capacityProvider": "FARGATE_SPOT", "weight": 1}]
+    return run_task_kwargs
+
+
+class TokenBucket:
+    """Token bucket of `rate` tokens per second holding up to `burst` tokens,
+    whose rate is halved on throttling (down to min_rate) and recovers by
+    `recovery` tokens per second on every successful call
+    """
+
+    def __init__(self, rate: float, burst: float, min_rate: float = 1.0, recovery: float = 0.5,
+                 clock=time.monotonic):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.recovery = float(recovery)
+        self.clock = clock
+        self.tokens = float(burst)
+        self.refilled_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def take(self) -> bool:
+        with self._lock:
+            self._refill(self.clock())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def throttled(self):
+        with self._lock:
+            self._refill(self.clock())
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+
+    def succeeded(self):
+        with self._lock:
+            self._refill(self.clock())
+            self.rate = min(self.max_rate, self.rate + self.recovery)
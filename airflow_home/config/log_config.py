@@ -1,25 +1,117 @@
 """Switch Airflow webserver and DAG processor (scheduler) to format their logs
 in JSON. Keep Airflow task logs written to files as they are, but add a
-handler that writes task logs to STDOUT in JSON format
+handler that writes task logs to STDOUT in JSON format. Cold-start phase
+timings of worker containers are written to STDOUT in JSON format as well, and
+so are the executor's task timings and periodic metrics (see executor_metrics),
+which are never rate limited.
+
+Task records on STDOUT are rate limited and sampled per task (see
+log_sampling), tuned with AIRFLOW_TASK_LOG_RATE (records per second, 0 turns
+the token bucket off), AIRFLOW_TASK_LOG_BURST, AIRFLOW_TASK_LOG_REPEAT_THRESHOLD,
+AIRFLOW_TASK_LOG_SAMPLE_EVERY, and AIRFLOW_TASK_LOG_SUMMARY_INTERVAL. The task
+log files, and so the copies in S3, are not affected.
+
+With S3 remote logging, task logs are uploaded by
+s3_log_streaming.StreamingS3TaskHandler while the task runs, tuned with
+AIRFLOW_TASK_LOG_SEGMENT_SIZE, AIRFLOW_TASK_LOG_CHUNK_SIZE,
+AIRFLOW_TASK_LOG_FLUSH_INTERVAL, AIRFLOW_TASK_LOG_TAIL_BYTES, and
+AIRFLOW_TASK_LOG_CACHE_SIZE.
+
+QUEUED_LOG_CONFIG is the same configuration, except that the stream, console,
+and processor handlers sit behind bounded queues drained by background threads
+(see queue_logging), so that logging does not block task execution. It is
+tuned with AIRFLOW_LOG_QUEUE_SIZE, AIRFLOW_LOG_QUEUE_POLICY ("drop" or
+"block"), AIRFLOW_LOG_QUEUE_BLOCK_TIMEOUT, and AIRFLOW_LOG_QUEUE_BATCH_SIZE
 """
 from copy import deepcopy
-import sys
+import os
 from airflow.config_templates.airflow_local_settings import DEFAULT_LOGGING_CONFIG
+import cold_start
+from queue_logging import queued_handler_config
+
+# Airflow imports this module while configuring logging during `import airflow`
+cold_start.mark("airflow_imported")
+cold_start.watch_db_connect()
 
 LOG_CONFIG = deepcopy(DEFAULT_LOGGING_CONFIG)
+# Same keys as pythonjsonlogger.jsonlogger.JsonFormatter, see json_formatter
 LOG_CONFIG["formatters"]["json"] = {
-    "class": "pythonjsonlogger.jsonlogger.JsonFormatter",
+    "class": "json_formatter.FastJsonFormatter",
     "format": "[%%(asctime)s] {{%%(filename)s:%%(lineno)d}} %%(levelname)s - %%(message)s",
 }
 
+LOG_CONFIG["filters"]["task_rate_limit"] = {
+    "()": "log_sampling.TaskRateLimitFilter",
+    "rate": float(os.getenv("AIRFLOW_TASK_LOG_RATE", "50")),
+    "burst": float(os.getenv("AIRFLOW_TASK_LOG_BURST", "200")),
+    "repeat_threshold": int(os.getenv("AIRFLOW_TASK_LOG_REPEAT_THRESHOLD", "10")),
+    "sample_every": int(os.getenv("AIRFLOW_TASK_LOG_SAMPLE_EVERY", "100")),
+    "summary_interval": float(os.getenv("AIRFLOW_TASK_LOG_SUMMARY_INTERVAL", "30")),
+}
+
 STREAM_HANDLER_CONFIG = {
-    "class": "logging.StreamHandler",
+    "class": "log_sampling.RateLimitedStreamHandler",
     "formatter": "json",
-    "stream": sys.stdout,
+    "stream": "ext://sys.stdout",
+    "filters": ["task_rate_limit"],
 }
 LOG_CONFIG["handlers"]["stream"] = STREAM_HANDLER_CONFIG
+LOG_CONFIG["handlers"]["metrics"] = {
+    "class": "logging.StreamHandler",
+    "formatter": "json",
+    "stream": "ext://sys.stdout",
+}
 
 LOG_CONFIG["handlers"]["console"]["formatter"] = "json"  # used by FAB
 LOG_CONFIG["handlers"]["processor"]["formatter"] = "json"  # used by DAG processor
 LOG_CONFIG["handlers"]["processor_to_stdout"]["formatter"] = "json"  # same as above
 LOG_CONFIG["loggers"]["airflow.task"]["handlers"] = ["task", "stream"]
+LOG_CONFIG["loggers"]["airflow.cold_start"] = {
+    "handlers": ["stream"],
+    "level": "INFO",
+    "propagate": False,
+}
+LOG_CONFIG["loggers"]["airflow.executor_metrics"] = {
+    "handlers": ["metrics"],
+    "level": "INFO",
+    "propagate": False,
+}
+LOG_CONFIG["loggers"]["airflow.task_ratelimit"] = {  # summaries of suppressed records
+    "handlers": ["stream"],
+    "level": "INFO",
+    "propagate": False,
+}
+
+# With remote logging to S3, stream task logs to S3 as they are written (see
+# s3_log_streaming) instead of uploading them once the task finishes
+if LOG_CONFIG["handlers"]["task"].get("s3_log_folder"):
+    LOG_CONFIG["handlers"]["task"].update({
+        "class": "s3_log_streaming.StreamingS3TaskHandler",
+        "segment_size": int(os.getenv("AIRFLOW_TASK_LOG_SEGMENT_SIZE", str(8 * 1024 * 1024))),
+        "chunk_size": int(os.getenv("AIRFLOW_TASK_LOG_CHUNK_SIZE", str(1024 * 1024))),
+        "flush_interval": float(os.getenv("AIRFLOW_TASK_LOG_FLUSH_INTERVAL", "10")),
+        "tail_bytes": int(os.getenv("AIRFLOW_TASK_LOG_TAIL_BYTES", str(1024 * 1024))),
+        "cache_size": int(os.getenv("AIRFLOW_TASK_LOG_CACHE_SIZE", str(256 * 1024 * 1024))),
+    })
+
+QUEUED_HANDLERS = ["stream", "console", "processor"]
+QUEUE_OPTIONS = {
+    "maxsize": int(os.getenv("AIRFLOW_LOG_QUEUE_SIZE", "10000")),
+    "policy": os.getenv("AIRFLOW_LOG_QUEUE_POLICY", "drop"),
+    "block_timeout": os.getenv("AIRFLOW_LOG_QUEUE_BLOCK_TIMEOUT", ""),
+    "batch_size": int(os.getenv("AIRFLOW_LOG_QUEUE_BATCH_SIZE", "256")),
+}
+
+QUEUED_LOG_CONFIG = deepcopy(LOG_CONFIG)
+QUEUED_LOG_CONFIG["handlers"]["stream"]["class"] = "queue_logging.BatchStreamHandler"
+for name in QUEUED_HANDLERS:
+    QUEUED_LOG_CONFIG["handlers"][f"{name}_queued"] = queued_handler_config(name, **QUEUE_OPTIONS)
+# Rate limit before enqueueing so that suppressed records never take queue space
+QUEUED_LOG_CONFIG["handlers"]["stream_queued"]["()"] = "log_sampling.RateLimitedQueueHandler"
+QUEUED_LOG_CONFIG["handlers"]["stream_queued"]["filters"] = (
+    QUEUED_LOG_CONFIG["handlers"]["stream"].pop("filters")
+)
+for logger_config in [*QUEUED_LOG_CONFIG["loggers"].values(), QUEUED_LOG_CONFIG["root"]]:
+    logger_config["handlers"] = [
+        f"{h}_queued" if h in QUEUED_HANDLERS else h for h in logger_config["handlers"]
+    ]
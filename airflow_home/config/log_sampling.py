@@ -0,0 +1,187 @@
+"""Rate limit and sample the task records that are streamed to STDOUT (and from
+there to CloudWatch), per Airflow task.
+
+TaskRateLimitFilter keys records by dag_id and task_id and applies two rules:
+
+* a token bucket of `rate` records per second with room for `burst` records
+* within each summary interval, a message that has already been seen
+  `repeat_threshold` times only gets through once every `sample_every` times
+
+Records at ERROR and above always get through. Every `summary_interval`
+seconds, the next record that reaches the filter triggers a summary record
+with the number of suppressed records per reason, logged through the
+`summary_logger` logger. The state of a task that has not logged for a
+summary interval is evicted, after its pending summary is logged, on the next
+record of any task. The handlers below log every pending summary and drop all
+state when Airflow sets a new task context on them and when they close (which
+logging.shutdown does before the task process exits), so that the suppressed
+records of the last window are reported too.
+
+The filter is only attached to the stream handler, so the task log files and
+the copies uploaded to S3 stay complete.
+"""
+import logging
+import os
+import threading
+import time
+from queue_logging import NonBlockingQueueHandler
+
+SUMMARY_ATTR = "log_rate_limit_summary"
+
+
+class _TaskState:
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.refilled_at = now
+        self.last_record_at = now
+        self.window_started_at = now
+        self.repeats: dict[tuple, int] = {}
+        self.suppressed = {"rate": 0, "repeated": 0}
+
+
+class TaskRateLimitFilter(logging.Filter):
+    def __init__(
+        self,
+        rate: float = 50.0,
+        burst: float = 200.0,
+        repeat_threshold: int = 10,
+        sample_every: int = 100,
+        summary_interval: float = 30.0,
+        summary_logger: str = "airflow.task_ratelimit",
+        clock=time.monotonic,
+    ):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.repeat_threshold = int(repeat_threshold)
+        self.sample_every = max(1, int(sample_every))
+        self.summary_interval = float(summary_interval)
+        self.summary_logger = summary_logger
+        self.clock = clock
+        self._states: dict[tuple, _TaskState] = {}
+        self._swept_at = clock()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def task_key(record: logging.LogRecord) -> tuple:
+        # Airflow exports AIRFLOW_CTX_* once the task starts executing
+        return (
+            getattr(record, "dag_id", None) or os.environ.get("AIRFLOW_CTX_DAG_ID"),
+            getattr(record, "task_id", None) or os.environ.get("AIRFLOW_CTX_TASK_ID"),
+        )
+
+    def _allow(self, state: _TaskState, record: logging.LogRecord, now: float) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        template = (record.pathname, record.lineno, str(record.msg))
+        seen = state.repeats.get(template, 0) + 1
+        state.repeats[template] = seen
+        if seen > self.repeat_threshold and (seen - self.repeat_threshold) % self.sample_every:
+            state.suppressed["repeated"] += 1
+            return False
+        if self.rate <= 0:
+            return True
+        state.tokens = min(self.burst, state.tokens + (now - state.refilled_at) * self.rate)
+        state.refilled_at = now
+        if state.tokens < 1:
+            state.suppressed["rate"] += 1
+            return False
+        state.tokens -= 1
+        return True
+
+    @staticmethod
+    def _pending_summary(key: tuple, state: _TaskState, now: float) -> tuple | None:
+        if not any(state.suppressed.values()):
+            return None
+        return key, dict(state.suppressed), now - state.window_started_at
+
+    def _evict_idle(self, now: float) -> list[tuple]:
+        """Drop the state of the tasks that have not logged for a summary
+        interval and return their pending summaries; called with the lock held
+        """
+        summaries = []
+        for key, state in list(self._states.items()):
+            if now - state.last_record_at >= self.summary_interval:
+                summaries.append(self._pending_summary(key, state, now))
+                del self._states[key]
+        self._swept_at = now
+        return [summary for summary in summaries if summary is not None]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, SUMMARY_ATTR, False):
+            return True
+        key = self.task_key(record)
+        now = self.clock()
+        summaries = []
+        with self._lock:
+            if now - self._swept_at >= self.summary_interval:
+                summaries.extend(self._evict_idle(now))
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _TaskState(self.burst, now)
+            allowed = self._allow(state, record, now)
+            state.last_record_at = now
+            if now - state.window_started_at >= self.summary_interval:
+                summaries.append(self._pending_summary(key, state, now))
+                state.window_started_at = now
+                state.repeats.clear()
+                state.suppressed = {"rate": 0, "repeated": 0}
+        for summary in summaries:
+            if summary is not None:
+                self._log_summary(*summary)
+        return allowed
+
+    def flush(self):
+        """Log the pending summary of every task and drop all state"""
+        now = self.clock()
+        with self._lock:
+            summaries = [self._pending_summary(key, state, now) for key, state in self._states.items()]
+            self._states.clear()
+            self._swept_at = now
+        for summary in summaries:
+            if summary is not None:
+                self._log_summary(*summary)
+
+    def _log_summary(self, key: tuple, suppressed: dict, window: float):
+        dag_id, task_id = key
+        logging.getLogger(self.summary_logger).warning(
+            "Suppressed %d log records of %s.%s on STDOUT in the last %.0fs "
+            "(rate limited: %d, repeated: %d); the task log file has all of them",
+            sum(suppressed.values()), dag_id, task_id, window,
+            suppressed["rate"], suppressed["repeated"],
+            extra={
+                SUMMARY_ATTR: True,
+                "dag_id": dag_id,
+                "task_id": task_id,
+                "suppressed": suppressed,
+            },
+        )
+
+
+class _FlushSummaries:
+    """Handler mixin that flushes its TaskRateLimitFilters when Airflow sets a
+    new task context and when the handler closes"""
+
+    def flush_summaries(self):
+        for f in self.filters:
+            if isinstance(f, TaskRateLimitFilter):
+                f.flush()
+
+    def set_context(self, value):
+        self.flush_summaries()
+        set_context = getattr(super(), "set_context", None)
+        return set_context(value) if set_context is not None else None
+
+    def close(self):
+        # Summaries go through the summary logger, which writes to this same
+        # handler, so they must be logged before it closes
+        self.flush_summaries()
+        super().close()
+
+
+class RateLimitedStreamHandler(_FlushSummaries, logging.StreamHandler):
+    pass
+
+
+class RateLimitedQueueHandler(_FlushSummaries, NonBlockingQueueHandler):
+    pass
@@ -0,0 +1,78 @@
+"""Runner of MicroBatchFargateExecutor's batches.
+
+MicroBatchFargateExecutor (fargate_executors) collects the task instances
+queued within a short window, groups them by worker profile and starts one
+Fargate task per batch that runs this module as a script with the batch's
+`airflow tasks run` commands. The commands run with bounded concurrency, and
+each of them records its task instance's state in the metadata database, which
+is where the executor reads the state of every task instance in the batch from.
+
+    python /opt/airflow/config/micro_batch.py --concurrency 4 '[["airflow", "tasks", "run", ...], ...]'
+"""
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from warm_pool import run_command
+
+log = logging.getLogger("airflow.micro_batch")
+
+# ECS rejects RunTask calls whose overrides take more than 8192 bytes; leave
+# room for the rest of the container override
+MAX_COMMANDS_BYTES = 7000
+
+
+def batch_command(script: str, commands: list[list[str]], concurrency: int) -> list[str]:
+    return ["python", script, "--concurrency", str(concurrency), json.dumps(commands, separators=(",", ":"))]
+
+
+def split_batch(entries: list[tuple], max_size: int, max_bytes: int = MAX_COMMANDS_BYTES) -> list[list[tuple]]:
+    """Split (key, command) entries into batches of at most max_size entries
+    whose commands fit in max_bytes once JSON-encoded
+    """
+    batches, batch, size = [], [], 2
+    for entry in entries:
+        entry_size = len(json.dumps(entry[1], separators=(",", ":"))) + 1
+        if batch and (len(batch) >= max_size or size + entry_size > max_bytes):
+            batches.append(batch)
+            batch, size = [], 2
+        batch.append(entry)
+        size += entry_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def run_batch(commands: list[list[str]], concurrency: int, runner=run_command) -> list[int]:
+    """Run the commands, at most `concurrency` at a time, and return their
+    return codes in order
+    """
+    def run_one(command):
+        try:
+            return runner(command)
+        except Exception:
+            log.exception("Could not run %s", command)
+            return 1
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(run_one, commands))
+
+
+if __name__ == "__main__":
+    import cold_start
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("commands", help="JSON list of commands")
+    args = parser.parse_args()
+
+    # The batch task's cold start is shared by its commands, don't report it per command
+    os.environ[cold_start.EMITTED_ENV] = "1"
+    logging.basicConfig(level=logging.INFO)
+    commands = json.loads(args.commands)
+    return_codes = run_batch(commands, args.concurrency)
+    for command, return_code in zip(commands, return_codes):
+        log.info("%s exited with %d", " ".join(command[:6]), return_code)
+    exit(0 if not any(return_codes) else 1)
@@ -0,0 +1,33 @@
+"""Tell which Airflow component the current process belongs to.
+
+The task definitions set AIRFLOW_ROLE on every container. Without it (e.g.
+under docker-compose), the role is guessed from the command line. Plugins use
+the role to skip what the process never uses, see
+benchmarks/bench_plugin_imports.py for what each role imports
+"""
+import os
+import sys
+
+ROLE_ENV = "AIRFLOW_ROLE"
+WEBSERVER, SCHEDULER, DAG_PROCESSOR, TRIGGERER, WORKER = (
+    "webserver", "scheduler", "dag-processor", "triggerer", "worker",
+)
+ROLES = (WEBSERVER, SCHEDULER, DAG_PROCESSOR, TRIGGERER, WORKER)
+
+
+def current_role(argv: list[str] | None = None) -> str | None:
+    """Return the role of the process, or None if it cannot be told (e.g.
+    `airflow db upgrade`)
+    """
+    role = os.getenv(ROLE_ENV)
+    if role:
+        return role
+    argv = sys.argv if argv is None else argv
+    if argv and "gunicorn" in os.path.basename(argv[0]):
+        return WEBSERVER
+    args = argv[1:]
+    if args[:1] and args[0] in ROLES:
+        return args[0]
+    if args[:2] == ["tasks", "run"]:
+        return WORKER
+    return None
@@ -0,0 +1,186 @@
+"""Queue-based logging handlers so that emitting a record never waits on the
+handlers that write it.
+
+NonBlockingQueueHandler puts records on a bounded queue. A daemon thread drains
+the queue in batches into the target handlers (referenced by their names in the
+logging config) and flushes them once per batch. When the queue is full the
+record is either dropped ("drop") or the caller waits up to block_timeout
+seconds ("block"). Dropped records are counted and reported as a warning
+through the target handlers.
+"""
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+_STOP = object()
+
+
+class _SetContext:
+    """Queue item that forwards Airflow's set_context to the targets in order
+    with the records around it"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """StreamHandler that leaves flushing to whoever calls flush(), such as the
+    listener of a NonBlockingQueueHandler after each batch"""
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(
+        self,
+        targets: list[str],
+        maxsize: int = 10000,
+        policy: str = "drop",
+        block_timeout: float | None = None,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+    ):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown queue policy {policy!r}, expected 'drop' or 'block'")
+        super().__init__(queue.Queue(maxsize=int(maxsize)))
+        self.target_names = list(targets)
+        self.maxsize = int(maxsize)
+        self.policy = policy
+        self.block_timeout = None if block_timeout in (None, "") else float(block_timeout)
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.enqueued = 0
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._thread: threading.Thread | None = None
+        self._pid = os.getpid()
+        self._start_lock = threading.Lock()
+
+    def targets(self) -> list[logging.Handler]:
+        # Resolved by name once dictConfig has created every handler
+        return [h for h in (logging._handlers.get(n) for n in self.target_names) if h is not None]
+
+    def _ensure_listener(self):
+        if self._pid != os.getpid():
+            # Forked child: the parent's listener thread does not exist here and
+            # the queue's locks may have been copied in a locked state
+            self.queue = queue.Queue(maxsize=self.maxsize)
+            self._thread = None
+            self._pid = os.getpid()
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name=f"log-queue-{self.name}", daemon=True,
+                    )
+                    self._thread.start()
+
+    def prepare(self, record):
+        # Merge args into the message now, so that the record no longer depends
+        # on objects that may change before the listener formats it
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, item):
+        try:
+            if self.policy == "block":
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(item)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        try:
+            self._ensure_listener()
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def set_context(self, value):
+        self._ensure_listener()
+        self.queue.put(_SetContext(value))
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._report_dropped()
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._handle_batch(batch)
+            self._report_dropped()
+            if stop:
+                return
+
+    def _handle_batch(self, batch: list) -> bool:
+        targets = self.targets()
+        stop = False
+        for item in batch:
+            if item is _STOP:
+                stop = True
+            elif isinstance(item, _SetContext):
+                for target in targets:
+                    if hasattr(target, "set_context"):
+                        target.set_context(item.value)
+            else:
+                for target in targets:
+                    if item.levelno >= target.level:
+                        target.handle(item)
+        for target in targets:
+            target.flush()
+        return stop
+
+    def _report_dropped(self):
+        dropped = self.dropped
+        if dropped == self._reported_dropped:
+            return
+        record = logging.LogRecord(
+            name=__name__, level=logging.WARNING, pathname=__file__, lineno=0,
+            msg="Dropped %d log records because the logging queue was full (%d dropped in total)",
+            args=(dropped - self._reported_dropped, dropped), exc_info=None,
+        )
+        self._reported_dropped = dropped
+        self._handle_batch([self.prepare(record)])
+
+    def close(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            # Blocks if the queue is full so that the stop marker is not lost
+            self.queue.put(_STOP)
+            thread.join(timeout=5.0)
+        self._thread = None
+        super().close()
+
+    def stats(self) -> dict[str, int]:
+        return {"enqueued": self.enqueued, "dropped": self.dropped, "queued": self.queue.qsize()}
+
+
+def queued_handler_config(target: str, **options) -> dict:
+    """Return the dictConfig entry of a NonBlockingQueueHandler in front of the
+    target handler
+    """
+    return {"()": f"{__name__}.NonBlockingQueueHandler", "targets": [target], **options}
@@ -0,0 +1,359 @@
+"""Task log handler that streams task logs to S3 while the task runs.
+
+S3TaskHandler uploads a task log once the task finishes, so a worker that is
+killed loses the log, and the webserver downloads the whole object on every
+view. StreamingS3TaskHandler writes the local log file like FileTaskHandler,
+and the supervising `airflow tasks run` process tails that file from a
+background thread:
+
+* new lines are gzipped as independent gzip members of up to chunk_size
+  bytes; concatenated members are still a valid gzip file
+* every flush_interval seconds, the current segment of the log is published
+  whole with PutObject as <key>.<number>.gz, so that the log of a running (or
+  killed) task can be read
+* once a segment reaches segment_size bytes, it is left as it is and the
+  next lines go to the next segment
+
+A worker that is killed loses at most the lines written since the last
+flush. Each run of a try (a sensor in reschedule mode, a deferred task that
+resumed) starts a new segment after those of the earlier runs instead of
+overwriting them.
+
+S3TaskHandler's key is extended with ".<number>.gz". Reads list the segments
+of a log to get their sizes and ETags, and keep what they downloaded in a
+per-process LRU cache keyed by the ETags. The first view of a log larger than
+tail_bytes only fetches its last tail_bytes (ranged GETs starting at a gzip
+member), downloads fetch every segment, and follow-up reads of a running task
+only fetch the bytes after the previous read. Logs written whole to <key>.gz
+(an earlier version of this handler) or by S3TaskHandler (without the suffix)
+are still read.
+"""
+import gzip
+import hashlib
+import os
+import pathlib
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+from airflow.configuration import conf
+from airflow.utils.log.file_task_handler import FileTaskHandler
+from airflow.utils.log.logging_mixin import LoggingMixin
+from airflow.utils.state import State
+from botocore.exceptions import ClientError
+
+# Relative to the log's key: ".gz" for a log written whole, ".<number>.gz" for a segment
+SEGMENT_SUFFIX = re.compile(r"\.(?:(\d{6})\.)?gz")
+# gzip.compress(data, mtime=0) member header: magic, deflate, no flags, no mtime
+MEMBER_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00"
+
+
+def decompress_members(data: bytes) -> bytes:
+    """Decompress concatenated gzip members, ignoring a truncated last one"""
+    chunks = []
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        chunk = decompressor.decompress(data)
+        if not decompressor.eof:
+            break
+        chunks.append(chunk)
+        data = decompressor.unused_data
+    return b"".join(chunks)
+
+
+def decompress_tail(data: bytes) -> bytes:
+    """Decompress the members of data, which starts anywhere in a gzip stream,
+    from the first member header that decompresses to the end
+    """
+    start = data.find(MEMBER_HEADER)
+    while start >= 0:
+        try:
+            return decompress_members(data[start:])
+        except zlib.error:
+            start = data.find(MEMBER_HEADER, start + 1)
+    return b""
+
+
+def segment_key(key: str, number: int) -> str:
+    return f"{key}.{number:06d}.gz"
+
+
+class LogUpload:
+    """Gzip the lines written to it and upload them to s3://bucket/key as
+    numbered segments of about segment_size bytes, starting at first_segment
+    """
+
+    def __init__(self, s3, bucket: str, key: str, first_segment: int = 0, segment_size: int = 8 * 1024 * 1024,
+                 chunk_size: int = 1024 * 1024, compresslevel: int = 6, extra_args: dict | None = None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.segment = first_segment
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+        self.compresslevel = compresslevel
+        self.extra_args = extra_args or {}
+        self.pending = bytearray()  # lines not gzipped yet
+        self.buffer = bytearray()  # gzip members of the current segment
+        self.published = 0  # size of the current segment last published with PutObject
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes):
+        with self._lock:
+            self.pending += data
+
+    def _seal(self, final: bool = False):
+        """Gzip the complete lines of pending (every byte if final)"""
+        end = len(self.pending) if final else self.pending.rfind(b"\n") + 1
+        start = 0
+        while start < end:
+            stop = min(end, start + self.chunk_size)
+            if stop < end:
+                newline = self.pending.rfind(b"\n", start, stop)
+                stop = newline + 1 if newline >= start else stop
+            self.buffer += gzip.compress(bytes(self.pending[start:stop]), self.compresslevel, mtime=0)
+            start = stop
+        del self.pending[:end]
+
+    def _put(self):
+        self.s3.put_object(
+            Bucket=self.bucket, Key=segment_key(self.key, self.segment), Body=bytes(self.buffer), **self.extra_args,
+        )
+        self.published = len(self.buffer)
+
+    def checkpoint(self):
+        """Publish the current segment with what was written so far, and start
+        the next one once it is full"""
+        with self._lock:
+            self._seal()
+            if len(self.buffer) != self.published:
+                self._put()
+            if len(self.buffer) >= self.segment_size:
+                self.segment += 1
+                self.buffer.clear()
+                self.published = 0
+
+    def close(self):
+        with self._lock:
+            self._seal(final=True)
+            if len(self.buffer) != self.published:
+                self._put()
+
+
+class LogCache:
+    """LRU cache of downloaded logs keyed by ETag, bounded by their size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, text: str):
+        with self._lock:
+            if key in self._entries or len(text) > self.max_bytes:
+                return
+            self._entries[key] = text
+            self.size += len(text)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class StreamingS3TaskHandler(FileTaskHandler, LoggingMixin):
+    cache: LogCache | None = None
+
+    def __init__(
+        self,
+        base_log_folder: str,
+        s3_log_folder: str,
+        filename_template: str | None = None,
+        segment_size: int = 8 * 1024 * 1024,
+        chunk_size: int = 1024 * 1024,
+        flush_interval: float = 10.0,
+        tail_bytes: int = 1024 * 1024,
+        cache_size: int = 256 * 1024 * 1024,
+    ):
+        super().__init__(base_log_folder, filename_template)
+        self.remote_base = s3_log_folder
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.tail_bytes = tail_bytes
+        if StreamingS3TaskHandler.cache is None:
+            StreamingS3TaskHandler.cache = LogCache(cache_size)
+        self.log_relative_path = ""
+        self.upload: LogUpload | None = None
+        self.closed = False
+        self._s3 = None
+        self._position = 0
+        self._stop = threading.Event()
+        self._tailer: threading.Thread | None = None
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            from airflow.providers.amazon.aws.hooks.s3 import S3Hook
+
+            self._s3 = S3Hook(aws_conn_id=conf.get("logging", "REMOTE_LOG_CONN_ID")).get_conn()
+        return self._s3
+
+    def remote_location(self, log_relative_path: str) -> tuple[str, str]:
+        """Return the bucket and the key of S3TaskHandler's log, which the
+        segments' keys extend"""
+        bucket, _, prefix = self.remote_base.removeprefix("s3://").partition("/")
+        return bucket, "/".join(filter(None, [prefix.strip("/"), log_relative_path]))
+
+    def list_segments(self, bucket: str, key: str) -> list[tuple[int, str, int, str]]:
+        """Return the (number, key, size, ETag) of the gzipped segments of a log,
+        in order. A log written whole to <key>.gz comes first"""
+        segments = []
+        kwargs = {"Bucket": bucket, "Prefix": f"{key}."}
+        while True:
+            resp = self.s3.list_objects_v2(**kwargs)
+            for obj in resp.get("Contents", []):
+                match = SEGMENT_SUFFIX.fullmatch(obj["Key"][len(key):])
+                if match:
+                    number = int(match.group(1)) if match.group(1) else -1
+                    segments.append((number, obj["Key"], obj["Size"], obj["ETag"]))
+            if not resp.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+        return sorted(segments)
+
+    def set_context(self, ti):
+        super().set_context(ti)
+        self.log_relative_path = pathlib.Path(self.handler.baseFilename).relative_to(self.local_base).as_posix()
+        # The `--raw` process writes the file, the process supervising it uploads it
+        if ti.raw and not getattr(ti, "is_trigger_log_context", False):
+            # A forked `--raw` process inherits the supervisor's upload and
+            # tailer, which it must neither pump nor close
+            self.upload = None
+            self._tailer = None
+            return
+        extra_args = {"ContentType": "application/gzip"}
+        if conf.getboolean("logging", "ENCRYPT_S3_LOGS"):
+            extra_args["ServerSideEncryption"] = "AES256"
+        bucket, key = self.remote_location(self.log_relative_path)
+        # An earlier run of the same try (a sensor in reschedule mode, a
+        # deferred task that resumed) uploaded its own segments, and whatever
+        # it left in the local file: append new segments after them
+        segments = self.list_segments(bucket, key)
+        if segments:
+            self._position = os.path.getsize(self.handler.baseFilename)
+        self.upload = LogUpload(
+            self.s3, bucket, key, max(0, segments[-1][0] + 1) if segments else 0,
+            self.segment_size, self.chunk_size, extra_args=extra_args,
+        )
+        self._tailer = threading.Thread(target=self._tail, name="s3-log-upload", daemon=True)
+        self._tailer.start()
+
+    def _pump(self):
+        """Upload the lines added to the local file since the last call"""
+        with open(self.handler.baseFilename, "rb") as f:
+            f.seek(self._position)
+            data = f.read()
+        self._position += len(data)
+        self.upload.write(data)
+        self.upload.checkpoint()
+
+    def _tail(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._pump()
+            except Exception:
+                self.log.warning("Could not upload logs to s3://%s/%s", self.upload.bucket, self.upload.key,
+                                 exc_info=True)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if self.upload is not None:
+            self._stop.set()
+            self._tailer.join()
+            try:
+                self._pump()
+                self.upload.close()
+            except Exception:
+                self.log.exception("Could not write logs to s3://%s/%s", self.upload.bucket, self.upload.key)
+        self.closed = True
+
+    def _fetch(self, bucket: str, key: str, first: int, size: int) -> bytes:
+        """Fetch bytes first to size - 1 of an object listed with that size,
+        leaving out whatever was appended since it was listed"""
+        return self.s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={first}-{size - 1}")["Body"].read()
+
+    def _read(self, ti, try_number, metadata=None):
+        metadata = dict(metadata or {})
+        bucket, key = self.remote_location(self._render_filename(ti, try_number))
+        running = ti.state in (State.RUNNING, State.DEFERRED)
+        try:
+            segments = self.list_segments(bucket, key)
+        except ClientError as error:
+            return f"*** Could not read logs from s3://{bucket}/{key}: {error}\n", {"end_of_log": True}
+        if not segments:
+            return self._read_uncompressed(ti, try_number, metadata)
+        # Offsets are into the concatenated segments: earlier segments never
+        # change and the last one only grows, so reads stop at the listed sizes
+        segments = [segment for segment in segments if segment[2]]
+        size = sum(segment_size for _, _, segment_size, _ in segments)
+        version = hashlib.sha1("".join(etag for _, _, _, etag in segments).encode()).hexdigest()
+        end = {"end_of_log": not running, "offset": size}
+
+        if "offset" in metadata:
+            # Follow-up read of a running task
+            offset, start, chunks = int(metadata["offset"]), 0, []
+            for _, segment, segment_size, _ in segments:
+                if offset < start + segment_size:
+                    skip = max(0, offset - start)
+                    chunks.append(decompress_members(self._fetch(bucket, segment, skip, segment_size)))
+                start += segment_size
+            text = b"".join(chunks).decode("utf-8", errors="replace")
+            return text, {**end, "log_pos": int(metadata.get("log_pos", 0)) + len(text)}
+
+        header = f"*** Reading s3://{bucket}/{key}.*.gz ({len(segments)} segments)\n"
+        if metadata.get("download_logs") or size <= self.tail_bytes:
+            text = self.cache.get((version, "full"))
+            if text is None:
+                text = b"".join(
+                    decompress_members(self._fetch(bucket, segment, 0, segment_size))
+                    for _, segment, segment_size, _ in segments
+                ).decode("utf-8", errors="replace")
+                self.cache.put((version, "full"), text)
+        else:
+            text = self.cache.get((version, "tail"))
+            if text is None:
+                chunks, needed = [], self.tail_bytes
+                for _, segment, segment_size, _ in reversed(segments):
+                    if needed <= 0:
+                        break
+                    if segment_size <= needed:
+                        chunks.append(decompress_members(self._fetch(bucket, segment, 0, segment_size)))
+                    else:
+                        chunks.append(decompress_tail(
+                            self._fetch(bucket, segment, segment_size - needed, segment_size)
+                        ))
+                    needed -= segment_size
+                text = b"".join(reversed(chunks)).decode("utf-8", errors="replace")
+                self.cache.put((version, "tail"), text)
+            header += f"*** Showing the end of a {size}-byte log, download it for the rest\n"
+        return header + text, {**end, "log_pos": len(text)}
+
+    def _read_uncompressed(self, ti, try_number, metadata):
+        """Read a log uploaded by S3TaskHandler, or else the local log"""
+        bucket, key = self.remote_location(self._render_filename(ti, try_number))
+        try:
+            text = self.s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8", errors="replace")
+            return f"*** Reading s3://{bucket}/{key}\n{text}", {"end_of_log": True}
+        except ClientError:
+            log, metadata = super()._read(ti, try_number, metadata)
+            return f"*** No log in S3 yet, falling back to local log\n{log}", metadata
@@ -0,0 +1,80 @@
+"""Pick the subnets of each Fargate launch of the executors by free IP capacity.
+
+The executors are configured with a static list of subnets ([ecs_fargate]
+subnets). SubnetSelector reads the availability zone and free IP addresses of
+those subnets with DescribeSubnets every refresh_interval seconds, and for
+each launch picks one availability zone at random, weighted by its free
+addresses, and returns that zone's subnets that still have at least
+min_free_ips addresses, most free first. Launches made since the last refresh
+are subtracted from the counts. If DescribeSubnets fails, or every subnet is
+exhausted, the configured list is returned unchanged
+"""
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger("airflow.subnet_selection")
+
+
+class SubnetSelector:
+    def __init__(
+        self,
+        ec2,
+        subnet_ids: list[str],
+        refresh_interval: float = 300.0,
+        min_free_ips: int = 16,
+        clock=time.monotonic,
+        rand=random.random,
+    ):
+        self.ec2 = ec2
+        self.subnet_ids = list(subnet_ids)
+        self.refresh_interval = refresh_interval
+        self.min_free_ips = min_free_ips
+        self.clock = clock
+        self.rand = rand
+        self.refreshed_at = None
+        # availability zone -> {subnet ID: free addresses}
+        self.zones: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        self.refreshed_at = self.clock()
+        try:
+            resp = self.ec2.describe_subnets(SubnetIds=self.subnet_ids)
+        except Exception:
+            log.warning("Could not describe subnets %s, launching into all of them", self.subnet_ids, exc_info=True)
+            self.zones = {}
+            return
+        zones = {}
+        for sn in resp["Subnets"]:
+            zones.setdefault(sn["AvailabilityZone"], {})[sn["SubnetId"]] = sn["AvailableIpAddressCount"]
+        self.zones = zones
+        log.debug("Free IP addresses per subnet: %s", zones)
+
+    def choose(self) -> list[str]:
+        """Return the subnets of the next launch"""
+        with self._lock:
+            if self.refreshed_at is None or self.clock() - self.refreshed_at >= self.refresh_interval:
+                self.refresh()
+            weights = {
+                az: sum(free - self.min_free_ips + 1 for free in subnets.values() if free >= self.min_free_ips)
+                for az, subnets in self.zones.items()
+            }
+            weights = {az: weight for az, weight in weights.items() if weight > 0}
+            if not weights:
+                if self.zones:
+                    log.warning("Every subnet has fewer than %d free IP addresses", self.min_free_ips)
+                return list(self.subnet_ids)
+            target = self.rand() * sum(weights.values())
+            for az, weight in weights.items():
+                target -= weight
+                if target < 0:
+                    break
+            subnets = sorted(
+                (sn for sn, free in self.zones[az].items() if free >= self.min_free_ips),
+                key=lambda sn: -self.zones[az][sn],
+            )
+            # Count the address the task will take until the next refresh
+            self.zones[az][subnets[0]] -= 1
+            return subnets
@@ -0,0 +1,387 @@
+"""Command queue and worker loop of the warm worker pool.
+
+WarmPoolFargateExecutor (fargate_executors) puts the `airflow tasks run`
+command of each task instance on a CommandQueue instead of calling RunTask
+for it, and keeps between min_workers and max_workers pool workers running on
+ECS. Each pool worker runs this module as a script: it claims one command at a
+time, runs it and records its return code, which the executor turns into the
+task instance's state on its next sync.
+
+The first min_workers workers never stop on their own. Workers started above
+that exit once they have been idle for the idle TTL, which stops their ECS
+task and shrinks the pool.
+
+Airflow's migrations only cover its own tables, so the warm_pool_command
+table is created, or given the columns it lacks, by `./run.sh
+airflow-initialize` next to `airflow db init`; the executor refuses to start
+without it:
+
+    python /opt/airflow/config/warm_pool.py create-table
+    python /opt/airflow/config/warm_pool.py
+"""
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, func, inspect, select, text
+
+log = logging.getLogger("airflow.warm_pool")
+
+# Passed to the pool worker's container through the RunTask overrides
+IDLE_TTL_ENV = "WARM_POOL_IDLE_TTL"
+POLL_INTERVAL_ENV = "WARM_POOL_POLL_INTERVAL"
+# Overrides the ECS task ARN as the worker's identity, e.g. outside of ECS
+WORKER_ID_ENV = "WARM_POOL_WORKER_ID"
+
+QUEUED, RUNNING, DONE, LOST = "queued", "running", "done", "lost"
+
+# The ECS startedBy of a pool worker names the scheduler job that started it,
+# and whether it is a core worker (no idle TTL), so that another scheduler can
+# take it over once that job died
+STARTED_BY_PREFIX = "warm-pool-"
+
+
+def pool_started_by(owner: str, core: bool) -> str:
+    return f"{STARTED_BY_PREFIX}{'core' if core else 'ttl'}-{owner}"
+
+
+def parse_pool_started_by(started_by: str | None) -> tuple[str, bool] | None:
+    """Return the owner of a pool worker and whether it is a core worker, or
+    None for a task that is not a pool worker"""
+    if not started_by or not started_by.startswith(STARTED_BY_PREFIX):
+        return None
+    kind, _, owner = started_by[len(STARTED_BY_PREFIX):].partition("-")
+    if kind not in ("core", "ttl") or not owner:
+        return None
+    return owner, kind == "core"
+
+
+def desired_pool_size(demand: int, min_workers: int, max_workers: int) -> int:
+    """Return the number of workers needed for `demand` queued and running
+    commands, one command per worker, clamped to [min_workers, max_workers]
+    """
+    return max(min_workers, min(max_workers, demand))
+
+
+class InMemoryCommandQueue:
+    """CommandQueue shared by threads of one process, for the local ECS
+    stand-in and for the benchmarks
+    """
+
+    def __init__(self):
+        self._items: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def put(self, item_id: str, command: list[str], owner: str | None = None, ti_key: list | None = None):
+        with self._lock:
+            self._items[item_id] = {
+                "command": list(command), "state": QUEUED, "worker_id": None,
+                "return_code": None, "queued_at": time.monotonic(), "owner": owner, "ti_key": ti_key,
+            }
+
+    def claim(self, worker_id: str) -> tuple[str, list[str]] | None:
+        with self._lock:
+            queued = [(item["queued_at"], item_id) for item_id, item in self._items.items()
+                      if item["state"] == QUEUED]
+            if not queued:
+                return None
+            _, item_id = min(queued)
+            item = self._items[item_id]
+            item["state"], item["worker_id"] = RUNNING, worker_id
+            return item_id, item["command"]
+
+    def complete(self, item_id: str, return_code: int):
+        with self._lock:
+            item = self._items.get(item_id)
+            if item is not None and item["state"] == RUNNING:
+                item["state"], item["return_code"] = DONE, return_code
+
+    def release(self, worker_id: str) -> int:
+        with self._lock:
+            lost = [item for item in self._items.values()
+                    if item["worker_id"] == worker_id and item["state"] == RUNNING]
+            for item in lost:
+                item["state"] = LOST
+            return len(lost)
+
+    def pop_results(self, item_ids: list[str]) -> dict[str, int | None]:
+        with self._lock:
+            results = {}
+            for item_id in item_ids:
+                item = self._items.get(item_id)
+                if item is not None and item["state"] in (DONE, LOST):
+                    results[item_id] = item["return_code"]
+                    del self._items[item_id]
+            return results
+
+    def counts(self, item_ids: list[str]) -> dict[str, int]:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0}
+            for item_id in item_ids:
+                item = self._items.get(item_id)
+                if item is not None and item["state"] in counts:
+                    counts[item["state"]] += 1
+            return counts
+
+    def owners(self) -> set[str]:
+        with self._lock:
+            return {item["owner"] for item in self._items.values() if item["owner"] is not None}
+
+    def busy_workers(self) -> set[str]:
+        with self._lock:
+            return {item["worker_id"] for item in self._items.values() if item["state"] == RUNNING}
+
+    def reconcile(self, owners: list[str], new_owner: str) -> tuple[int, list[tuple[str, list, str]]]:
+        with self._lock:
+            dropped, running = 0, []
+            for item_id, item in list(self._items.items()):
+                if item["owner"] not in owners:
+                    continue
+                if item["state"] == RUNNING and item["ti_key"] is not None:
+                    item["owner"] = new_owner
+                    running.append((item_id, item["ti_key"], item["worker_id"]))
+                elif item["state"] != RUNNING:
+                    del self._items[item_id]
+                    dropped += 1
+            return dropped, running
+
+
+class DbCommandQueue:
+    """CommandQueue kept in a table of the Airflow metadata database, which
+    both the scheduler and the pool workers can reach. Workers claim rows with
+    SELECT ... FOR UPDATE SKIP LOCKED so that concurrent claims never block on
+    or hand out the same row
+    """
+
+    TABLE_NAME = "warm_pool_command"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.table = Table(
+            self.TABLE_NAME, MetaData(),
+            Column("id", String(32), primary_key=True),
+            Column("command", Text, nullable=False),
+            Column("state", String(16), nullable=False, index=True),
+            Column("worker_id", String(250), index=True),
+            Column("return_code", Integer),
+            Column("queued_at", DateTime, nullable=False),
+            Column("updated_at", DateTime, nullable=False),
+            # Scheduler job of the executor that put the command, and the key
+            # of its task instance, so that another executor can take it over
+            Column("owner", String(250), index=True),
+            Column("ti_key", Text),
+        )
+        self.skip_locked = engine.dialect.name in ("postgresql", "mysql")
+
+    def missing_columns(self) -> list[Column] | None:
+        """Return the columns that the table lacks, None if there is no table"""
+        inspector = inspect(self.engine)
+        if not inspector.has_table(self.TABLE_NAME):
+            return None
+        existing = {column["name"] for column in inspector.get_columns(self.TABLE_NAME)}
+        return [column for column in self.table.columns if column.name not in existing]
+
+    def create_table(self):
+        """Create the table, or add the (nullable) columns that a table created
+        by an earlier version lacks
+        """
+        missing = self.missing_columns()
+        if missing is None:
+            self.table.create(self.engine)
+            return
+        with self.engine.begin() as conn:
+            for column in missing:
+                conn.execute(text(
+                    f"ALTER TABLE {self.TABLE_NAME} ADD COLUMN {column.name} "
+                    f"{column.type.compile(dialect=self.engine.dialect)}"
+                ))
+
+    def check_table(self):
+        missing = self.missing_columns()
+        if missing is None or missing:
+            raise RuntimeError(
+                f"The {self.TABLE_NAME} table is missing or out of date, create it with "
+                f"`python {os.path.abspath(__file__)} create-table` (run by ./run.sh airflow-initialize)"
+            )
+
+    def put(self, item_id: str, command: list[str], owner: str | None = None, ti_key: list | None = None):
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert().values(
+                id=item_id, command=json.dumps(command), state=QUEUED, queued_at=now, updated_at=now,
+                owner=owner, ti_key=None if ti_key is None else json.dumps(ti_key),
+            ))
+
+    def claim(self, worker_id: str) -> tuple[str, list[str]] | None:
+        t = self.table
+        query = select(t.c.id, t.c.command).where(t.c.state == QUEUED).order_by(t.c.queued_at).limit(1)
+        if self.skip_locked:
+            query = query.with_for_update(skip_locked=True)
+        while True:
+            with self.engine.begin() as conn:
+                row = conn.execute(query).first()
+                if row is None:
+                    return None
+                # Without row locks (SQLite), another worker may have read the
+                # same row: only the first update wins it
+                claimed = conn.execute(t.update().where(t.c.id == row.id, t.c.state == QUEUED).values(
+                    state=RUNNING, worker_id=worker_id, updated_at=datetime.utcnow(),
+                )).rowcount
+            if claimed:
+                return row.id, json.loads(row.command)
+
+    def complete(self, item_id: str, return_code: int):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id == item_id, t.c.state == RUNNING).values(
+                state=DONE, return_code=return_code, updated_at=datetime.utcnow(),
+            ))
+
+    def release(self, worker_id: str) -> int:
+        t = self.table
+        with self.engine.begin() as conn:
+            result = conn.execute(t.update().where(t.c.worker_id == worker_id, t.c.state == RUNNING).values(
+                state=LOST, updated_at=datetime.utcnow(),
+            ))
+        return result.rowcount
+
+    def pop_results(self, item_ids: list[str]) -> dict[str, int | None]:
+        t = self.table
+        if not item_ids:
+            return {}
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(t.c.id, t.c.return_code).where(t.c.id.in_(item_ids), t.c.state.in_([DONE, LOST]))
+            ).all()
+            if rows:
+                conn.execute(t.delete().where(t.c.id.in_([row.id for row in rows])))
+        return {row.id: row.return_code for row in rows}
+
+    def counts(self, item_ids: list[str]) -> dict[str, int]:
+        t = self.table
+        counts = {QUEUED: 0, RUNNING: 0}
+        if not item_ids:
+            return counts
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(t.c.state, func.count()).where(t.c.id.in_(item_ids), t.c.state.in_(list(counts)))
+                .group_by(t.c.state)
+            ).all()
+        counts.update({state: count for state, count in rows})
+        return counts
+
+    def owners(self) -> set[str]:
+        t = self.table
+        with self.engine.begin() as conn:
+            return set(conn.execute(select(t.c.owner).where(t.c.owner.is_not(None)).distinct()).scalars())
+
+    def busy_workers(self) -> set[str]:
+        """Return the workers running a command"""
+        t = self.table
+        with self.engine.begin() as conn:
+            return set(conn.execute(select(t.c.worker_id).where(t.c.state == RUNNING).distinct()).scalars())
+
+    def reconcile(self, owners: list[str], new_owner: str) -> tuple[int, list[tuple[str, list, str]]]:
+        """Delete the queued and finished commands of `owners`, and hand their
+        running ones over to new_owner. Return the number of deleted commands,
+        and the item id, task instance key and worker of each running one
+        """
+        t = self.table
+        if not owners:
+            return 0, []
+        with self.engine.begin() as conn:
+            dropped = conn.execute(t.delete().where(t.c.owner.in_(owners), t.c.state != RUNNING)).rowcount
+            rows = conn.execute(
+                select(t.c.id, t.c.ti_key, t.c.worker_id)
+                .where(t.c.owner.in_(owners), t.c.state == RUNNING, t.c.ti_key.is_not(None))
+                .with_for_update()
+            ).all()
+            if rows:
+                conn.execute(t.update().where(t.c.id.in_([row.id for row in rows])).values(
+                    owner=new_owner, updated_at=datetime.utcnow(),
+                ))
+        return dropped, [(row.id, json.loads(row.ti_key), row.worker_id) for row in rows]
+
+
+def run_command(command: list[str]) -> int:
+    return subprocess.run(command).returncode
+
+
+def run_pool_worker(
+    command_queue,
+    worker_id: str,
+    idle_ttl: float = 0.0,
+    poll_interval: float = 1.0,
+    runner=run_command,
+    stop_event: threading.Event | None = None,
+    clock=time.monotonic,
+) -> int:
+    """Claim and run commands until stop_event is set or, with a positive
+    idle_ttl, until no command was claimed for idle_ttl seconds. Return the
+    number of commands that were run
+    """
+    stop_event = stop_event or threading.Event()
+    ran = 0
+    idle_since = clock()
+    while not stop_event.is_set():
+        claimed = command_queue.claim(worker_id)
+        if claimed is None:
+            if idle_ttl > 0 and clock() - idle_since >= idle_ttl:
+                log.info("Pool worker %s idle for %.0fs after %d commands, exiting", worker_id, idle_ttl, ran)
+                break
+            stop_event.wait(poll_interval)
+            continue
+        item_id, command = claimed
+        try:
+            return_code = runner(command)
+        except Exception:
+            log.exception("Pool worker %s could not run %s", worker_id, command)
+            return_code = 1
+        command_queue.complete(item_id, return_code)
+        ran += 1
+        idle_since = clock()
+    return ran
+
+
+def current_worker_id(timeout: float = 0.5) -> str:
+    """Return the ARN of the ECS task this process runs in, which is how the
+    executor knows its pool workers, falling back to the hostname outside of ECS
+    """
+    worker_id = os.getenv(WORKER_ID_ENV)
+    if worker_id:
+        return worker_id
+    base_uri = os.getenv("ECS_CONTAINER_METADATA_URI_V4")
+    if base_uri:
+        try:
+            with urllib.request.urlopen(f"{base_uri}/task", timeout=timeout) as resp:
+                return json.load(resp)["TaskARN"]
+        except (OSError, ValueError, KeyError):
+            pass
+    return socket.gethostname()
+
+
+if __name__ == "__main__":
+    from airflow import settings
+
+    if sys.argv[1:] == ["create-table"]:
+        DbCommandQueue(settings.engine).create_table()
+        exit(0)
+
+    import cold_start
+
+    # Commands run in an already warm container, their cold start was paid once
+    os.environ[cold_start.EMITTED_ENV] = "1"
+    logging.basicConfig(level=logging.INFO)
+    run_pool_worker(
+        DbCommandQueue(settings.engine),
+        current_worker_id(),
+        idle_ttl=float(os.getenv(IDLE_TTL_ENV, "0")),
+        poll_interval=float(os.getenv(POLL_INTERVAL_ENV, "1")),
+    )
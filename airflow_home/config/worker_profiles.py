@@ -0,0 +1,64 @@
+"""Named Fargate shapes for Airflow workers.
+
+The profiles are declared in worker_profiles.json, next to this module, and
+load_worker_profiles checks that each one is a valid Fargate size. The
+task-definition generator in helpers imports this module to register one task
+definition family per profile (the worker family plus the profile's
+familySuffix), and the executor picks a profile for each task instance with
+select_worker_profile
+"""
+import json
+import os
+
+WORKER_PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker_profiles.json")
+DEFAULT_PROFILE = "default"
+# Key of a task's executor_config that names its profile, e.g.
+# @task(executor_config={"worker_profile": "large"})
+PROFILE_KEY = "worker_profile"
+# Memory range in MiB that Fargate accepts for each CPU value
+FARGATE_MEMORY_RANGES = {
+    "256": (512, 2048),
+    "512": (1024, 4096),
+    "1024": (2048, 8192),
+    "2048": (4096, 16384),
+    "4096": (8192, 30720),
+}
+
+
+def check_fargate_size(name: str, size: dict):
+    """Raise a ValueError unless the cpu and memory of size are a valid
+    Fargate size
+    """
+    memory_range = FARGATE_MEMORY_RANGES.get(size["cpu"])
+    if memory_range is None or not memory_range[0] <= int(size["memory"]) <= memory_range[1]:
+        raise ValueError(
+            f"{name} has an invalid Fargate size: {size['cpu']} CPU, {size['memory']} MiB"
+        )
+
+
+def load_worker_profiles(path: str = WORKER_PROFILES_PATH) -> dict[str, dict]:
+    """Return the worker profiles declared in worker_profiles.json, after
+    checking that each one is a valid Fargate size
+    """
+    with open(path) as f:
+        profiles = json.load(f)
+    for name, profile in profiles.items():
+        check_fargate_size(f"Worker profile {name}", profile)
+    return profiles
+
+
+def worker_profile_family(base_family: str, profile: str, profiles: dict[str, dict]) -> str:
+    return base_family + profiles[profile].get("familySuffix", "")
+
+
+def select_worker_profile(queue: str | None, requested: str | None, profiles: dict[str, dict]) -> str:
+    """Return the profile named in the executor_config, otherwise the profile
+    named like the task's queue, otherwise the default profile
+    """
+    if requested is not None:
+        if requested not in profiles:
+            raise ValueError(f"Unknown worker profile {requested!r}, expected one of {sorted(profiles)}")
+        return requested
+    if queue in profiles:
+        return queue
+    return DEFAULT_PROFILE
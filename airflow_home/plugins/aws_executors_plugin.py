@@ -1,8 +1,32 @@
+"""Register the ECS Fargate executors without importing them.
+
+Every Airflow process loads every plugin, but only the scheduler runs an
+executor, and only the webserver lists them. The executors (fargate_executors,
+in airflow_home/config) are imported the first time the plugin's executors
+are read, or when one is imported from this module, e.g. through
+AIRFLOW__CORE__EXECUTOR="aws_executors_plugin.ProfileRoutingFargateExecutor"
+"""
+import importlib
 from airflow.plugins_manager import AirflowPlugin
-from airflow_aws_executors import AwsBatchExecutor, AwsEcsFargateExecutor
+
+EXECUTORS = [
+    "AwsBatchExecutor", "AwsEcsFargateExecutor", "ProfileRoutingFargateExecutor", "WarmPoolFargateExecutor",
+    "MicroBatchFargateExecutor", "AdaptiveSyncFargateExecutor", "RateLimitedFargateExecutor",
+]
+
+
+def __getattr__(name: str):
+    module = importlib.import_module("fargate_executors")
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
 
 
 class AwsExecutorsPlugin(AirflowPlugin):
     """AWS Batch & AWS ECS & AWS FARGATE Plugin"""
     name = "aws_executors_plugin"
-    executors = [AwsBatchExecutor, AwsEcsFargateExecutor]
+
+    @property
+    def executors(self):
+        return [__getattr__(name) for name in EXECUTORS]
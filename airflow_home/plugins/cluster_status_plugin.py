@@ -0,0 +1,16 @@
+from airflow.plugins_manager import AirflowPlugin
+
+class ClusterStatusPlugin(AirflowPlugin):
+    """Page with the task counts and start latencies of the ECS cluster"""
+    name = "cluster_status"
+
+    @property
+    def appbuilder_views(self):
+        # Only read by the webserver, see hello.py
+        from cluster_status_views import ClusterStatusView
+
+        return [{
+            "category": "Browse",
+            "name": "ECS Cluster",
+            "view": ClusterStatusView(),
+        }]
@@ -0,0 +1,19 @@
+import sys
+from airflow.listeners import hookimpl
+from airflow.plugins_manager import AirflowPlugin
+import cold_start
+from process_role import WORKER, current_role
+
+
+@hookimpl
+def on_task_instance_running(previous_state, task_instance, session):
+    cold_start.mark("task_running")
+    cold_start.emit(dag_id=task_instance.dag_id, task_id=task_instance.task_id)
+
+
+class ColdStartListenerPlugin(AirflowPlugin):
+    """Log the cold-start phase timings of a worker container once its first
+    task instance is running"""
+    name = "cold_start_listener"
+    # Other processes never run a task instance themselves
+    listeners = [sys.modules[__name__]] if current_role() == WORKER else []
@@ -0,0 +1,279 @@
+"""XCom backend that keeps large values out of the metadata database.
+
+Values are serialized like the default backend. Those of at least
+[s3_xcom] threshold bytes are gzipped and written to the remote-logging bucket
+(the bucket of [logging] remote_base_log_folder, or [s3_xcom] bucket) under
+[s3_xcom] prefix, and the XCom row only holds a reference to the object.
+Objects are never overwritten, so reads are cached in the process by
+reference, up to [s3_xcom] cache_size bytes. The web UI shows the reference
+instead of downloading the value.
+
+Enable it with AIRFLOW__CORE__XCOM_BACKEND="s3_xcom_backend.S3XComBackend".
+The objects of XComs that are overwritten, cleared or deleted through XCom are
+deleted once the session commits. Rows deleted otherwise (with their DAG run,
+or by `airflow db clean`) leave orphaned objects, which sweep_orphans deletes
+(see run.sh sweep-xcom-objects).
+"""
+import gzip
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from airflow.configuration import conf
+from airflow.models.xcom import BaseXCom
+from airflow.utils.session import NEW_SESSION, provide_session
+from sqlalchemy import and_, event, func, or_
+
+log = logging.getLogger(__name__)
+
+REFERENCE_PREFIX = b"xcom-s3://"
+# Longer than any reference: a bucket name, the prefix, and the IDs of the XCom
+# (up to 250 bytes each, 512 for the key)
+MAX_REFERENCE_BYTES = 2048
+# session.info key of the references to delete when the session commits
+PENDING_DELETIONS = "s3_xcom_pending_deletions"
+
+
+class ValueCache:
+    """LRU cache of decompressed values, bounded by their total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class XComValueMissing(KeyError):
+    """The object of an XCom's value is gone from S3"""
+
+
+class S3XComBackend(BaseXCom):
+    # Replaced by tests and benchmarks with a stand-in of boto3.client("s3")
+    s3_client = None
+    cache = ValueCache(conf.getint("s3_xcom", "cache_size", fallback=64 * 1024 * 1024))
+
+    @classmethod
+    def client(cls):
+        if cls.s3_client is None:
+            import boto3  # every process loads the plugins, few of them push or pull XComs
+
+            cls.s3_client = boto3.client("s3")
+        return cls.s3_client
+
+    @staticmethod
+    def location() -> tuple[str, str]:
+        """Return the bucket and key prefix the values are written to"""
+        bucket = conf.get("s3_xcom", "bucket", fallback=None)
+        if not bucket:
+            bucket = urlparse(conf.get("logging", "remote_base_log_folder")).netloc
+        return bucket, conf.get("s3_xcom", "prefix", fallback="xcom").strip("/")
+
+    @staticmethod
+    def serialize_value(
+        value,
+        *,
+        key: str | None = None,
+        task_id: str | None = None,
+        dag_id: str | None = None,
+        run_id: str | None = None,
+        map_index: int | None = None,
+    ):
+        data = BaseXCom.serialize_value(
+            value, key=key, task_id=task_id, dag_id=dag_id, run_id=run_id, map_index=map_index,
+        )
+        if len(data) < conf.getint("s3_xcom", "threshold", fallback=16 * 1024):
+            return data
+        bucket, prefix = S3XComBackend.location()
+        object_key = f"{prefix}/{dag_id}/{run_id}/{task_id}/{map_index}/{key}/{uuid.uuid4().hex}.gz"
+        S3XComBackend.client().put_object(
+            Bucket=bucket,
+            Key=object_key,
+            Body=gzip.compress(data, compresslevel=conf.getint("s3_xcom", "compress_level", fallback=6)),
+            ContentEncoding="gzip",
+            ContentType="application/octet-stream",
+        )
+        reference = f"{bucket}/{object_key}"
+        S3XComBackend.cache.put(reference, data)
+        return REFERENCE_PREFIX + reference.encode("utf-8")
+
+    @staticmethod
+    def reference(result) -> str | None:
+        value = result.value
+        if isinstance(value, bytes) and value.startswith(REFERENCE_PREFIX):
+            return value[len(REFERENCE_PREFIX):].decode("utf-8")
+        return None
+
+    @staticmethod
+    def read(reference: str) -> bytes:
+        data = S3XComBackend.cache.get(reference)
+        if data is None:
+            bucket, object_key = reference.split("/", 1)
+            from botocore.exceptions import ClientError
+
+            try:
+                response = S3XComBackend.client().get_object(Bucket=bucket, Key=object_key)
+            except ClientError as error:
+                if error.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                    raise
+                raise XComValueMissing(
+                    f"The value of this XCom was deleted from s3://{reference}, e.g. by run.sh "
+                    f"sweep-xcom-objects after its row was deleted; clear the upstream task to push it again"
+                ) from None
+            data = gzip.decompress(response["Body"].read())
+            S3XComBackend.cache.put(reference, data)
+        return data
+
+    @staticmethod
+    def deserialize_value(result):
+        reference = S3XComBackend.reference(result)
+        if reference is None:
+            return BaseXCom.deserialize_value(result)
+        return BaseXCom.deserialize_value(SimpleNamespace(value=S3XComBackend.read(reference)))
+
+    def orm_deserialize_value(self):
+        reference = S3XComBackend.reference(self)
+        if reference is None:
+            return super().orm_deserialize_value()
+        return f"s3://{reference}"
+
+    @classmethod
+    def references_of(cls, query) -> list[str]:
+        return [
+            value[len(REFERENCE_PREFIX):].decode("utf-8")
+            for value, in query.with_entities(cls.value)
+            if isinstance(value, bytes) and value.startswith(REFERENCE_PREFIX)
+        ]
+
+    @classmethod
+    def delete_objects_after_commit(cls, session, references: list[str]):
+        """Delete the objects once the rows that referenced them are gone for
+        good; a rollback keeps them"""
+        if not references:
+            return
+        if PENDING_DELETIONS not in session.info:
+            session.info[PENDING_DELETIONS] = []
+            event.listen(session, "after_commit", cls._delete_pending)
+            event.listen(session, "after_rollback", lambda session: session.info[PENDING_DELETIONS].clear())
+        session.info[PENDING_DELETIONS].extend(references)
+
+    @classmethod
+    def _delete_pending(cls, session):
+        references = session.info[PENDING_DELETIONS][:]
+        session.info[PENDING_DELETIONS].clear()
+        for reference in references:
+            bucket, object_key = reference.split("/", 1)
+            try:
+                cls.client().delete_object(Bucket=bucket, Key=object_key)
+            except Exception:
+                log.warning("Could not delete the XCom value s3://%s", reference, exc_info=True)
+
+    @classmethod
+    def run_id_of(cls, session, dag_id: str, execution_date) -> str | None:
+        from airflow.models.dagrun import DagRun
+
+        return session.query(DagRun.run_id).filter(
+            DagRun.dag_id == dag_id, DagRun.execution_date == execution_date,
+        ).scalar()
+
+    @classmethod
+    @provide_session
+    def set(cls, key, value, task_id, dag_id, execution_date=None, session=NEW_SESSION, *, run_id=None,
+            map_index=-1):
+        """Store the value, and delete the object of the value it replaces"""
+        replaced = cls.references_of(session.query(cls).filter_by(
+            key=key, task_id=task_id, dag_id=dag_id, map_index=map_index,
+            run_id=run_id or cls.run_id_of(session, dag_id, execution_date),
+        ))
+        super().set(key, value, task_id, dag_id, execution_date, session=session, run_id=run_id,
+                    map_index=map_index)
+        cls.delete_objects_after_commit(session, replaced)
+
+    @classmethod
+    @provide_session
+    def clear(cls, execution_date=None, dag_id=None, task_id=None, session=NEW_SESSION, *, run_id=None,
+              map_index=None):
+        """Clear the XComs of a task instance and delete their objects"""
+        query = session.query(cls).filter_by(
+            dag_id=dag_id, task_id=task_id, run_id=run_id or cls.run_id_of(session, dag_id, execution_date),
+        )
+        if map_index is not None:
+            query = query.filter_by(map_index=map_index)
+        cleared = cls.references_of(query)
+        super().clear(execution_date, dag_id, task_id, session=session, run_id=run_id, map_index=map_index)
+        cls.delete_objects_after_commit(session, cleared)
+
+    @classmethod
+    @provide_session
+    def delete(cls, xcoms, session=NEW_SESSION):
+        xcoms = [xcoms] if isinstance(xcoms, BaseXCom) else list(xcoms)
+        if xcoms:
+            # Loaded rows hold orm_deserialize_value() as their value, read the stored one
+            cls.delete_objects_after_commit(session, cls.references_of(session.query(cls).filter(or_(*(
+                and_(cls.dag_run_id == xcom.dag_run_id, cls.task_id == xcom.task_id,
+                     cls.map_index == xcom.map_index, cls.key == xcom.key)
+                for xcom in xcoms
+            )))))
+        super().delete(xcoms, session=session)
+
+
+@provide_session
+def sweep_orphans(min_age: timedelta, dry_run: bool = False, session=NEW_SESSION) -> list[str]:
+    """Delete the objects under the prefix that are older than min_age and that
+    no XCom row references, and return their references. min_age covers values
+    written by tasks whose row is not committed yet
+    """
+    from airflow.models.xcom import XCom
+
+    bucket, prefix = S3XComBackend.location()
+    referenced = set(S3XComBackend.references_of(
+        session.query(XCom).filter(func.length(XCom.value) <= MAX_REFERENCE_BYTES)
+    ))
+    cutoff = datetime.now(timezone.utc) - min_age
+    client = S3XComBackend.client()
+    orphans = []
+    kwargs = {"Bucket": bucket, "Prefix": f"{prefix}/"}
+    while True:
+        resp = client.list_objects_v2(**kwargs)
+        for obj in resp.get("Contents", []):
+            reference = f"{bucket}/{obj['Key']}"
+            if reference not in referenced and obj["LastModified"] < cutoff:
+                orphans.append(reference)
+        if not resp.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+    if not dry_run:
+        for start in range(0, len(orphans), 1000):
+            client.delete_objects(Bucket=bucket, Delete={
+                "Objects": [{"Key": reference.split("/", 1)[1]} for reference in orphans[start:start + 1000]],
+                "Quiet": True,
+            })
+    return orphans
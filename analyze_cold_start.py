@@ -0,0 +1,89 @@
+"""Report p50 and p95 of every cold-start phase from worker container logs
+
+Reads the JSON records that airflow_home/config/cold_start.py logs to STDOUT,
+from files exported from CloudWatch or saved from `docker logs`. Lines may
+carry a prefix (such as a CloudWatch timestamp) before the JSON object.
+
+    python analyze_cold_start.py logs/*.log
+"""
+import argparse
+import json
+import math
+import sys
+
+PHASE_ORDER = [
+    "image_pull", "container_create", "bootstrap_start", "secrets",
+    "airflow_import", "dag_parse", "db_connect", "task_start", "total",
+]
+
+
+def read_records(lines) -> list[dict]:
+    """Return the cold_start payload of every log line that carries one
+    """
+    records = []
+    for line in lines:
+        start = line.find("{")
+        if start == -1 or "cold_start" not in line:
+            continue
+        try:
+            payload = json.loads(line[start:])
+        except ValueError:
+            continue
+        if isinstance(payload, dict) and isinstance(payload.get("cold_start"), dict):
+            records.append(payload["cold_start"])
+    return records
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(records: list[dict]) -> dict[str, dict[str, float]]:
+    durations: dict[str, list[float]] = {}
+    for record in records:
+        for phase, seconds in record.get("durations", {}).items():
+            durations.setdefault(phase, []).append(seconds)
+    ordered = [p for p in PHASE_ORDER if p in durations] + sorted(set(durations) - set(PHASE_ORDER))
+    return {
+        phase: {
+            "count": len(durations[phase]),
+            "p50": percentile(durations[phase], 50),
+            "p95": percentile(durations[phase], 95),
+            "max": max(durations[phase]),
+        }
+        for phase in ordered
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="log files, STDIN if omitted")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    records = []
+    if args.paths:
+        for path in args.paths:
+            with open(path, errors="replace") as f:
+                records.extend(read_records(f))
+    else:
+        records.extend(read_records(sys.stdin))
+    if not records:
+        print("No cold_start records found", file=sys.stderr)
+        exit(1)
+
+    summary = summarize(records)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        exit(0)
+    print(f"{len(records)} container starts")
+    print(f"{'phase':<18}{'count':>7}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+    for phase, stats in summary.items():
+        print(
+            f"{phase:<18}{stats['count']:>7}{stats['p50']:>10.2f}"
+            f"{stats['p95']:>10.2f}{stats['max']:>10.2f}"
+        )
@@ -0,0 +1,125 @@
+"""Compare the container start cost of bootstrap.py against the aws CLI + jq
+secret pipeline that wrapper.sh used before.
+
+Both sides talk to a stubbed Secrets Manager with the same simulated latency:
+the legacy pipeline gets a fake `aws` executable on PATH, bootstrap.py gets
+LocalSecretsManager. The fake CLI starts much faster than the real one, so the
+reported speedup is a lower bound.
+
+    python benchmarks/bench_bootstrap.py --runs 20 --latency 0.05
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+
+LEGACY_PIPELINE = """
+export RDS_SECRET_ID="airflow_rds_conn"
+export RDS_SECRET_STR=$(aws secretsmanager get-secret-value --secret-id ${RDS_SECRET_ID} --query "SecretString")
+export RDS_HOST=$(echo ${RDS_SECRET_STR} | jq -r ". | fromjson | .host")
+export RDS_PORT=$(echo ${RDS_SECRET_STR} | jq -r ". | fromjson | .port")
+export RDS_USER=$(echo ${RDS_SECRET_STR} | jq -r ". | fromjson | .login")
+export RDS_PASSWORD=$(echo ${RDS_SECRET_STR} | jq -r ". | fromjson | .password")
+
+export AIRFLOW_CONFIG_SECRET_ID="airflow_config"
+export AIRFLOW_CONFIG_SECRET_STR=$(
+    aws secretsmanager get-secret-value \\
+    --secret-id ${AIRFLOW_CONFIG_SECRET_ID} \\
+    --query "SecretString")
+export AIRFLOW__DATABASE__SQL_ALCHEMY_CONN="postgresql+psycopg2://${RDS_USER}:${RDS_PASSWORD}@${RDS_HOST}:${RDS_PORT}/airflow"
+export AIRFLOW__LOGGING__REMOTE_BASE_LOG_FOLDER=$(
+    echo ${AIRFLOW_CONFIG_SECRET_STR} | jq -r ". | fromjson | .logging__remote_base_log_folder")
+export AIRFLOW__ECS_FARGATE__SECURITY_GROUPS=$(
+    echo ${AIRFLOW_CONFIG_SECRET_STR} | jq -r ". | fromjson | .ecs_fargate__security_groups")
+export AIRFLOW__ECS_FARGATE__SUBNETS=$(
+    echo ${AIRFLOW_CONFIG_SECRET_STR} | jq -r ". | fromjson | .ecs_fargate__subnets")
+"""
+
+FAKE_AWS_CLI = """#!{python}
+import json, sys, time
+secrets = {secrets!r}
+time.sleep({latency!r})
+secret_id = sys.argv[sys.argv.index("--secret-id") + 1]
+print(json.dumps(json.dumps(secrets[secret_id])))
+"""
+
+
+def run_child(latency: float, cache_ttl: float, cache_path: str):
+    """Body of one bootstrap.py run, minus the final exec
+    """
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import bootstrap
+    from local_aws import LocalSecretsManager, SAMPLE_SECRETS
+
+    secrets = bootstrap.load_secrets(
+        [bootstrap.RDS_SECRET_ID, bootstrap.AIRFLOW_CONFIG_SECRET_ID],
+        client_factory=lambda: LocalSecretsManager(SAMPLE_SECRETS, latency=latency),
+        cache_path=cache_path,
+        cache_ttl=cache_ttl,
+    )
+    os.environ.update(bootstrap.build_environment(
+        secrets[bootstrap.RDS_SECRET_ID], secrets[bootstrap.AIRFLOW_CONFIG_SECRET_ID],
+    ))
+
+
+def time_runs(cmd: list[str], runs: int, env: dict) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(name: str, timings: list[float]) -> float:
+    median = statistics.median(timings)
+    print(
+        f"{name:<28} median {median * 1000:8.1f} ms   "
+        f"min {min(timings) * 1000:8.1f} ms   max {max(timings) * 1000:8.1f} ms"
+    )
+    return median
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Secrets Manager call")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--cache-ttl", type=float, default=0.0, help=argparse.SUPPRESS)
+    parser.add_argument("--cache-path", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.latency, args.cache_ttl, args.cache_path)
+        exit(0)
+
+    sys.path.insert(0, BENCHMARKS_DIR)
+    from local_aws import SAMPLE_SECRETS
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fake_aws = os.path.join(tmp, "aws")
+        with open(fake_aws, "w") as f:
+            f.write(FAKE_AWS_CLI.format(
+                python=sys.executable, secrets=SAMPLE_SECRETS, latency=args.latency,
+            ))
+        os.chmod(fake_aws, 0o755)
+        env = dict(os.environ, PATH=f"{tmp}{os.pathsep}{os.environ['PATH']}")
+        cache_path = os.path.join(tmp, "secrets.json")
+        child = [sys.executable, os.path.abspath(__file__), "--child", "--latency", str(args.latency)]
+
+        legacy = summarize("aws CLI + jq (legacy)", time_runs(["bash", "-c", LEGACY_PIPELINE], args.runs, env))
+        fresh = summarize("bootstrap.py", time_runs(child, args.runs, env))
+        # The first run populates the cache, the rest read it
+        cached = summarize(
+            "bootstrap.py, tmpfs cache",
+            time_runs(child + ["--cache-ttl", "3600", "--cache-path", cache_path], args.runs, env),
+        )
+    print(f"speedup: {legacy / fresh:.1f}x without cache, {legacy / cached:.1f}x with cache")
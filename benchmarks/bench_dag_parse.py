@@ -0,0 +1,183 @@
+"""Measure how long each DAG file takes to import, and flag regressions.
+
+Each file is imported in a fresh interpreter that has already imported
+airflow, like a DAG file processor does, so only the file's own top-level work
+is measured: wall time (median of --runs), peak Python memory (tracemalloc),
+and the modules it imports that were not loaded yet (from -X importtime).
+
+A file fails the check when it takes longer than --budget seconds, or when a
+baseline exists and it takes more than --max-regression times its baseline
+time (plus --slack seconds, to ignore noise). The baseline is written by
+--update-baseline; commit it along with the DAGs.
+
+    python benchmarks/bench_dag_parse.py                    # report and check
+    python benchmarks/bench_dag_parse.py --update-baseline  # accept current times
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+DAGS_FOLDER = os.path.join(REPO_ROOT, "airflow_home", "dags")
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "dag_parse_baseline.json")
+IMPORT_MARKER = "-- dag file import starts --"
+
+# Runs in the child interpreter with the DAG file's path as argv[1]
+IMPORT_DAG_FILE = f"""
+import importlib.machinery, importlib.util, json, sys, time, tracemalloc
+import airflow
+from airflow.models.dag import DAG, DagContext
+path = sys.argv[1]
+print({IMPORT_MARKER!r}, file=sys.stderr, flush=True)
+tracemalloc.start()
+start = time.perf_counter()
+error = None
+try:
+    loader = importlib.machinery.SourceFileLoader("unusual_prefix_bench", path)
+    spec = importlib.util.spec_from_loader("unusual_prefix_bench", loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    DagContext.current_autoregister_module_name = spec.name
+    loader.exec_module(module)
+    dags = len({{id(v) for v in vars(module).values() if isinstance(v, DAG)}}
+               | {{id(dag) for dag, _ in DagContext.autoregistered_dags}})
+except Exception as e:
+    error, dags = f"{{type(e).__name__}}: {{e}}", 0
+seconds = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+print(json.dumps({{"seconds": seconds, "peak_kib": peak / 1024, "dags": dags, "error": error}}))
+"""
+
+
+def dag_files(folder: str) -> list[str]:
+    """Return the Python files of the folder that mention DAG, like the
+    DAG processor's safe mode
+    """
+    paths = []
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            if name.endswith(".py") and "__pycache__" not in root:
+                with open(path, "rb") as f:
+                    content = f.read()
+                if b"airflow" in content and (b"DAG" in content or b"dag" in content):
+                    paths.append(path)
+    return paths
+
+
+def parse_importtime(stderr: str, top: int) -> list[tuple[str, float]]:
+    """Return the slowest top-level imports made after the marker, as (module,
+    cumulative seconds) pairs
+    """
+    _, _, after = stderr.partition(IMPORT_MARKER)
+    imports = []
+    for line in after.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented under the module that imported them
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda kv: -kv[1])[:top]
+
+
+def measure(path: str, runs: int, env: dict, top: int) -> dict:
+    results, imports = [], []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", IMPORT_DAG_FILE, path],
+            capture_output=True, text=True, env=env, cwd=REPO_ROOT,
+        )
+        if proc.returncode != 0 or not proc.stdout.strip():
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "no output"}
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        imports = parse_importtime(proc.stderr, top)
+    return {
+        "seconds": statistics.median(r["seconds"] for r in results),
+        "peak_kib": max(r["peak_kib"] for r in results),
+        "dags": results[0]["dags"],
+        "error": results[0]["error"],
+        "imports": imports,
+    }
+
+
+def check(name: str, result: dict, baseline: dict, budget: float, max_regression: float, slack: float) -> list[str]:
+    """Return the reasons the file fails the check"""
+    if result.get("error"):
+        return [f"import failed: {result['error']}"]
+    problems = []
+    if result["seconds"] > budget:
+        problems.append(f"{result['seconds']:.3f}s is over the {budget:.3f}s budget")
+    if name in baseline:
+        allowed = baseline[name]["seconds"] * max_regression + slack
+        if result["seconds"] > allowed:
+            problems.append(
+                f"{result['seconds']:.3f}s regressed from the {baseline[name]['seconds']:.3f}s baseline"
+            )
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dags-folder", default=DAGS_FOLDER)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("DAG_PARSE_BUDGET", "1.0")))
+    parser.add_argument("--max-regression", type=float, default=1.5)
+    parser.add_argument("--slack", type=float, default=0.05)
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to show per file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    airflow_home = tempfile.mkdtemp(prefix="bench-dag-parse-")
+    env = dict(
+        os.environ,
+        AIRFLOW_HOME=airflow_home,
+        AIRFLOW__CORE__LOAD_EXAMPLES="False",
+        AIRFLOW__CORE__DAGS_FOLDER=args.dags_folder,
+        # Same sys.path entries as Airflow processes get
+        PYTHONPATH=os.pathsep.join([
+            args.dags_folder,
+            os.path.join(REPO_ROOT, "airflow_home", "config"),
+            os.path.join(REPO_ROOT, "airflow_home", "plugins"),
+        ]),
+    )
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results, failures = {}, {}
+    for path in dag_files(args.dags_folder):
+        name = os.path.relpath(path, args.dags_folder)
+        result = results[name] = measure(path, args.runs, env, args.top)
+        if result.get("error") and "seconds" not in result:
+            print(f"{name}: {result['error']}")
+        else:
+            print(f"{name}: {result['seconds']:.3f}s, {result['peak_kib']:.0f} KiB peak, {result['dags']} DAGs")
+            for module, seconds in result["imports"]:
+                print(f"    {seconds:.3f}s  import {module}")
+        problems = check(name, result, baseline, args.budget, args.max_regression, args.slack)
+        if problems:
+            failures[name] = problems
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {name: {"seconds": round(r["seconds"], 4), "peak_kib": round(r["peak_kib"])}
+                 for name, r in sorted(results.items()) if "seconds" in r},
+                f, indent=4,
+            )
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+    elif failures:
+        for name, problems in failures.items():
+            for problem in problems:
+                print(f"{name}: {problem}", file=sys.stderr)
+        exit(1)
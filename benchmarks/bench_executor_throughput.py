@@ -0,0 +1,385 @@
+"""Run Airflow's scheduler end to end with the ECS Fargate executors against the
+in-process stand-ins for ECS and Secrets Manager (benchmarks/local_aws.py), and
+sweep the executor and PARALLELISM to see how the setup scales.
+
+Each point of the sweep runs in a fresh process with its own SQLite metadata
+database and synthetic DAGs of --tasks parallel tasks each. Every DAG gets one
+DAG run and the scheduler runs until the executor reported all task instances.
+A Fargate task spends --cold-start seconds provisioning, then bootstraps like
+bootstrap.py (fetching the secrets from the Secrets Manager stand-in), then
+"runs" each of its task instances for --duration seconds: the task instance is
+set to running and then to success in the metadata database, as `airflow
+tasks run` would. For each point it reports:
+
+* tasks per minute and makespan, from the start of the scheduler
+* the median time from queued to running and to finished (see
+  executor_metrics)
+* scheduler loop time (scheduling, executor heartbeat and its events), p50,
+  p95 and max, and the executor's share of it
+* RunTask and DescribeTasks calls
+* the scheduler's metadata database connections: peak checked out at once and
+  connections opened, and the workers' peak modelled as running task
+  instances x CONNECTIONS_PER_TASK (see helpers/connections.py)
+
+Needs an environment with Airflow and the executors installed.
+
+    python benchmarks/bench_executor_throughput.py --dags 4 --tasks 25 --parallelism 8,32 --cold-start 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "airflow_home", "config"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "airflow_home", "plugins"))
+sys.path.insert(0, os.path.join(REPO_ROOT, "benchmarks"))
+
+EXECUTORS = [
+    "ProfileRoutingFargateExecutor",
+    "RateLimitedFargateExecutor",
+    "AdaptiveSyncFargateExecutor",
+    "WarmPoolFargateExecutor",
+    "MicroBatchFargateExecutor",
+]
+
+DAG_TEMPLATE = """import pendulum
+from airflow import DAG
+from airflow.operators.bash import BashOperator
+
+with DAG(
+    "bench_throughput_{index}",
+    schedule=None,
+    start_date=pendulum.datetime(2023, 1, 1, tz="UTC"),
+    max_active_tasks={tasks},
+    catchup=False,
+):
+    for i in range({tasks}):
+        BashOperator(task_id=f"task_{{i}}", bash_command="true")
+"""
+
+
+def write_dags(dags_folder: str, dags: int, tasks: int):
+    os.makedirs(dags_folder, exist_ok=True)
+    for index in range(dags):
+        with open(os.path.join(dags_folder, f"bench_throughput_{index}.py"), "w") as f:
+            f.write(DAG_TEMPLATE.format(index=index, tasks=tasks))
+
+
+def quantile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+class Workers:
+    """Container runner for LocalEcs that stands in for the worker image: it
+    bootstraps, then serves the warm pool's command queue, runs a micro-batch or
+    runs its own task instance, writing the task instances' states to the
+    metadata database through an engine of its own
+    """
+
+    def __init__(self, sql_alchemy_conn: str, duration: float, secrets_latency: float, command_queue=None):
+        from local_aws import LocalSecretsManager, SAMPLE_SECRETS
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+
+        self.duration = duration
+        self.command_queue = command_queue
+        self.secrets = LocalSecretsManager(SAMPLE_SECRETS, latency=secrets_latency)
+        self.engine = create_engine(sql_alchemy_conn, connect_args={"timeout": 30})
+        self.Session = sessionmaker(self.engine)
+        self.running = 0
+        self.peak_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, task_arn, command, environment, stop_event) -> int:
+        import bootstrap
+        from micro_batch import run_batch
+        from warm_pool import IDLE_TTL_ENV, run_pool_worker
+
+        bootstrap.load_secrets(
+            [bootstrap.RDS_SECRET_ID, bootstrap.AIRFLOW_CONFIG_SECRET_ID],
+            client_factory=lambda: self.secrets,
+            cache_ttl=0,
+        )
+        script = os.path.basename(command[1]) if command[:1] == ["python"] else None
+        if script == "warm_pool.py":
+            run_pool_worker(
+                self.command_queue, task_arn, idle_ttl=float(environment.get(IDLE_TTL_ENV, 0)),
+                poll_interval=0.05, runner=self.run_task, stop_event=stop_event,
+            )
+            return 0
+        if script == "micro_batch.py":
+            # python micro_batch.py --concurrency N '[commands]'
+            return max(run_batch(json.loads(command[4]), int(command[3]), runner=self.run_task), default=0)
+        return self.run_task(command, stop_event)
+
+    def run_task(self, command: list[str], stop_event: threading.Event | None = None) -> int:
+        """Play `airflow tasks run <dag_id> <task_id> <run_id> ...`"""
+        dag_id, task_id, run_id = command[3:6]
+        map_index = int(command[command.index("--map-index") + 1]) if "--map-index" in command else -1
+        key = {"dag_id": dag_id, "task_id": task_id, "run_id": run_id, "map_index": map_index}
+        self.set_state(key, "running")
+        with self._lock:
+            self.running += 1
+            self.peak_running = max(self.peak_running, self.running)
+        try:
+            interrupted = (stop_event or threading.Event()).wait(self.duration)
+        finally:
+            with self._lock:
+                self.running -= 1
+        self.set_state(key, "failed" if interrupted else "success")
+        return 1 if interrupted else 0
+
+    def set_state(self, key: dict, state: str):
+        from airflow.models.taskinstance import TaskInstance
+        from airflow.utils import timezone
+
+        with self.Session() as session:
+            ti = session.query(TaskInstance).filter_by(**key).one()
+            if state == "running":
+                ti._try_number += 1
+                ti.start_date = timezone.utcnow()
+                ti.hostname = "local-ecs"
+            else:
+                ti.end_date = timezone.utcnow()
+                ti.duration = (ti.end_date - ti.start_date).total_seconds()
+            ti.state = state
+            session.commit()
+
+
+class PoolUsage:
+    """Connections of a SQLAlchemy engine, from its pool events"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.connects = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "connect", self.on_connect)
+        event.listen(engine, "checkout", self.on_checkout)
+        event.listen(engine, "checkin", self.on_checkin)
+
+    def on_connect(self, *args):
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checked_out -= 1
+
+
+def run_child(executor_name: str, parallelism: int, args) -> dict:
+    """Schedule every task instance of fresh DAG runs with one executor"""
+    airflow_home = tempfile.mkdtemp(prefix="bench_executor_throughput_")
+    dags_folder = os.path.join(airflow_home, "dags")
+    write_dags(dags_folder, args.dags, args.tasks)
+    sql_alchemy_conn = f"sqlite:///{airflow_home}/airflow.db"
+    os.environ.update({
+        "AIRFLOW_HOME": airflow_home,
+        "AIRFLOW__DATABASE__SQL_ALCHEMY_CONN": sql_alchemy_conn,
+        "AIRFLOW__CORE__DAGS_FOLDER": dags_folder,
+        "AIRFLOW__CORE__LOAD_EXAMPLES": "False",
+        "AIRFLOW__CORE__DAGS_ARE_PAUSED_AT_CREATION": "False",
+        "AIRFLOW__CORE__PARALLELISM": str(parallelism),
+        "AIRFLOW__CORE__DEFAULT_POOL_TASK_SLOT_COUNT": str(args.dags * args.tasks),
+        "AIRFLOW__SCHEDULER__STANDALONE_DAG_PROCESSOR": "True",
+        "AIRFLOW__LOGGING__LOGGING_LEVEL": "WARNING",
+        "AIRFLOW__EXECUTOR_METRICS__LOG_INTERVAL": "0",
+        "AIRFLOW__EXECUTOR_METRICS__LOG_TASKS": "False",
+        "AIRFLOW__ECS_FARGATE__REGION": "us-west-2",
+        "AIRFLOW__ECS_FARGATE__CLUSTER": "bench",
+        "AIRFLOW__ECS_FARGATE__CONTAINER_NAME": "worker",
+        "AIRFLOW__ECS_FARGATE__TASK_DEFINITION": "airflow-worker",
+        "AIRFLOW__ECS_FARGATE__LAUNCH_TYPE": "FARGATE",
+    })
+
+    from airflow import settings
+    from airflow.jobs.scheduler_job import SchedulerJob
+    from airflow.models import DagBag
+    from airflow.utils import db, timezone
+    from airflow.utils.state import DagRunState
+    from airflow.utils.types import DagRunType
+
+    import fargate_executors
+    from helpers.connections import CONNECTIONS_PER_TASK
+    from local_aws import LocalEcs
+    from warm_pool import DbCommandQueue, InMemoryCommandQueue
+
+    db.initdb()
+    DbCommandQueue(settings.engine).create_table()
+    dagbag = DagBag(dags_folder, include_examples=False)
+    dagbag.sync_to_db()
+    for dag in dagbag.dags.values():
+        dag.create_dagrun(
+            run_type=DagRunType.MANUAL,
+            run_id=f"bench__{dag.dag_id}",
+            execution_date=timezone.utcnow(),
+            state=DagRunState.QUEUED,
+        )
+
+    command_queue = InMemoryCommandQueue()
+    workers = Workers(sql_alchemy_conn, args.duration, args.secrets_latency, command_queue)
+    ecs = LocalEcs(cold_start=args.cold_start, runner=workers, latency=args.api_latency)
+
+    def start(self):
+        super(executor_cls, self).start()
+        self.ecs = ecs
+        if hasattr(self, "command_queue"):
+            # Pool workers are threads of this process
+            self.command_queue = command_queue
+
+    base_cls = getattr(fargate_executors, executor_name)
+    executor_cls = type(executor_name, (base_cls,), {"start": start})
+    executor = executor_cls(parallelism=parallelism)
+    expected = args.dags * args.tasks
+    pool_usage = PoolUsage(settings.engine)
+
+    job = SchedulerJob(subdir=dags_folder, executor=executor)
+    # Time each loop from _do_scheduling to the job's heartbeat, i.e.
+    # scheduling, the executor's heartbeat and its events, and stop once every
+    # task instance was reported. Patched on the instance: SchedulerJob is an
+    # ORM model whose subclasses would need a polymorphic identity
+    loop_seconds, loop = [], {"count": 0, "started": None}
+    do_scheduling, heartbeat = job._do_scheduling, job.heartbeat
+
+    def timed_do_scheduling(session):
+        loop["count"] += 1
+        loop["started"] = time.perf_counter()
+        return do_scheduling(session)
+
+    def stopping_heartbeat(only_if_necessary=False):
+        if loop["started"] is not None:
+            loop_seconds.append(time.perf_counter() - loop["started"])
+            loop["started"] = None
+            if sum(executor.metrics.outcomes.values()) >= expected or time.monotonic() - started > args.timeout:
+                job.num_runs = loop["count"]
+        heartbeat(only_if_necessary)
+
+    job._do_scheduling, job.heartbeat = timed_do_scheduling, stopping_heartbeat
+    started = time.monotonic()
+    job.run()
+
+    metrics = executor.metrics
+    finished = sum(metrics.outcomes.values())
+    makespan = time.monotonic() - started
+    histograms = {name: h.summary() for name, h in metrics.histograms.items()}
+    return {
+        "executor": executor_name,
+        "parallelism": parallelism,
+        "tasks": expected,
+        "finished": finished,
+        "failed": metrics.outcomes["failed"],
+        "makespan": round(makespan, 2),
+        "tasks_per_minute": round(finished * 60 / makespan, 1),
+        # Task instances of a warm pool or a micro-batch have no startedAt
+        "queued_to_running_p50": histograms.get("task.queued_to_running", {}).get("p50"),
+        "total_p50": histograms.get("task.total", {}).get("p50"),
+        "loops": len(loop_seconds),
+        "loop_p50": round(statistics.median(loop_seconds), 4) if loop_seconds else None,
+        "loop_p95": round(quantile(loop_seconds, 0.95), 4),
+        "loop_max": round(max(loop_seconds, default=0.0), 4),
+        "heartbeat_seconds": round(metrics.histograms["heartbeat"].sum, 2),
+        "heartbeat_api_seconds": round(metrics.histograms["heartbeat.api"].sum, 2),
+        "run_task_calls": ecs.calls.get("run_task", 0),
+        "describe_tasks_calls": ecs.calls.get("describe_tasks", 0),
+        "secrets_calls": workers.secrets.calls,
+        "scheduler_db_peak": pool_usage.peak_checked_out,
+        "scheduler_db_connects": pool_usage.connects,
+        "worker_peak_running": workers.peak_running,
+        "worker_db_peak": workers.peak_running * CONNECTIONS_PER_TASK,
+    }
+
+
+def run_point(executor_name: str, parallelism: int, argv: list[str]) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json") as result:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *argv,
+             "--child", executor_name, str(parallelism), result.name],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode)
+        with open(result.name) as f:
+            return json.load(f)
+
+
+def print_row(result: dict):
+    def value(name, fmt):
+        return format(result[name], fmt) if result[name] is not None else "-".rjust(int(fmt.split(".")[0].rstrip("d")))
+
+    print(
+        f"{result['executor']:<30} {result['parallelism']:>4} "
+        f"{result['finished']:>5}/{result['tasks']:<5} {value('tasks_per_minute', '8.1f')} "
+        f"{value('makespan', '8.1f')} {value('queued_to_running_p50', '7.2f')} {value('total_p50', '7.2f')} "
+        f"{value('loop_p50', '7.3f')} {value('loop_p95', '7.3f')} {value('loop_max', '7.3f')} "
+        f"{value('heartbeat_seconds', '7.1f')} {value('run_task_calls', '7d')} {value('describe_tasks_calls', '8d')} "
+        f"{result['scheduler_db_peak']:>4}/{result['scheduler_db_connects']:<5} {value('worker_db_peak', '6d')}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--executors", default=",".join(EXECUTORS), help="comma-separated executors to sweep")
+    parser.add_argument("--parallelism", default="8,32", help="comma-separated PARALLELISM values to sweep")
+    parser.add_argument("--dags", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=25, help="parallel tasks per DAG")
+    parser.add_argument("--cold-start", type=float, default=5.0, help="seconds before a Fargate task runs")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds each task instance runs")
+    parser.add_argument("--secrets-latency", type=float, default=0.05, help="seconds per Secrets Manager call")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="seconds per ECS call")
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds before a point gives up")
+    parser.add_argument("--json", action="store_true", help="print one JSON result per line")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        executor_name, parallelism, result_path = args.child
+        result = run_child(executor_name, int(parallelism), args)
+        with open(result_path, "w") as f:
+            json.dump(result, f)
+        exit(0)
+
+    # Children get the same options; everything but --child, --executors,
+    # --parallelism and --json
+    argv = [
+        "--dags", str(args.dags), "--tasks", str(args.tasks), "--cold-start", str(args.cold_start),
+        "--duration", str(args.duration), "--secrets-latency", str(args.secrets_latency),
+        "--api-latency", str(args.api_latency), "--timeout", str(args.timeout),
+    ]
+    if not args.json:
+        print(f"{args.dags} DAGs x {args.tasks} tasks of {args.duration}s, cold start {args.cold_start}s, "
+              f"Secrets Manager {args.secrets_latency}s, ECS API {args.api_latency}s per call")
+        print(
+            f"{'executor':<30} {'par':>4} {'finished':>11} {'tasks/min':>8} {'makespan':>8} "
+            f"{'q->run':>7} {'q->done':>7} {'loop50':>7} {'loop95':>7} {'loopmax':>7} {'exec_hb':>7} "
+            f"{'RunTask':>7} {'Describe':>8} {'sched_db':>10} {'wrk_db':>6}"
+        )
+    failed = False
+    for executor_name in args.executors.split(","):
+        for parallelism in [int(p) for p in args.parallelism.split(",")]:
+            try:
+                result = run_point(executor_name, parallelism, argv)
+            except RuntimeError as e:
+                print(f"{executor_name} with parallelism {parallelism} failed: {e}", file=sys.stderr)
+                failed = True
+                continue
+            failed = failed or result["finished"] < result["tasks"]
+            print(json.dumps(result) if args.json else "", end="\n" if args.json else "")
+            if not args.json:
+                print_row(result)
+    if failed:
+        exit(1)
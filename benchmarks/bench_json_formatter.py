@@ -0,0 +1,91 @@
+"""Compare json_formatter.FastJsonFormatter with pythonjsonlogger's JsonFormatter
+(the formatter log_config used before) on records per second and on the bytes
+allocated while formatting one record.
+
+    python benchmarks/bench_json_formatter.py --records 50000
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "airflow_home", "config"))
+
+from json_formatter import FastJsonFormatter, orjson  # noqa: E402
+
+# The format string of the json formatter in log_config.LOG_CONFIG
+LOG_FORMAT = "[%%(asctime)s] {{%%(filename)s:%%(lineno)d}} %%(levelname)s - %%(message)s"
+
+
+def make_records() -> list[logging.LogRecord]:
+    """A plain message, a message with an extra field, and an exception
+    """
+    def record(msg, args=(), exc_info=None, **extra):
+        r = logging.LogRecord("airflow.task", logging.INFO, __file__, 42, msg, args, exc_info)
+        r.__dict__.update(extra)
+        return r
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        exc_info = sys.exc_info()
+    return [
+        record("Running %s on host %s", ("<TaskInstance: tutorial.sleep>", "ip-10-0-0-1")),
+        record("Marking task as SUCCESS", dag_id="tutorial", task_id="sleep", try_number=1),
+        record("Task failed with exception", exc_info=exc_info),
+    ]
+
+
+def records_per_second(formatter: logging.Formatter, records: list, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        formatter.format(records[i % len(records)])
+    return count / (time.perf_counter() - start)
+
+
+def bytes_per_record(formatter: logging.Formatter, records: list, count: int) -> float:
+    """Average peak of traced memory allocated while formatting one record
+    """
+    total = 0
+    tracemalloc.start()
+    for i in range(count):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        formatter.format(records[i % len(records)])
+        total += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return total / count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=50000)
+    args = parser.parse_args()
+
+    formatters = {"FastJsonFormatter": FastJsonFormatter(LOG_FORMAT)}
+    try:
+        from pythonjsonlogger.jsonlogger import JsonFormatter
+        formatters["pythonjsonlogger"] = JsonFormatter(LOG_FORMAT)
+    except ImportError:
+        print("pythonjsonlogger is not installed, only timing FastJsonFormatter", file=sys.stderr)
+
+    records = make_records()
+    if "pythonjsonlogger" in formatters:
+        for record in records:
+            fast = json.loads(formatters["FastJsonFormatter"].format(record))
+            reference = json.loads(formatters["pythonjsonlogger"].format(record))
+            assert list(fast) == list(reference), (list(fast), list(reference))
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json'}")
+    results = {}
+    for name, formatter in formatters.items():
+        rate = records_per_second(formatter, records, args.records)
+        allocated = bytes_per_record(formatter, records, min(args.records, 5000))
+        results[name] = rate
+        print(f"{name:<20} {rate:>12,.0f} records/s {allocated:>10,.0f} bytes allocated/record")
+    if len(results) == 2:
+        print(f"speedup: {results['FastJsonFormatter'] / results['pythonjsonlogger']:.1f}x")
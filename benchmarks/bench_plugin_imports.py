@@ -0,0 +1,115 @@
+"""Report what loading the plugins costs each Airflow component.
+
+Each role runs in a fresh interpreter with AIRFLOW_ROLE set, imports airflow,
+then goes through the plugin integration that component does:
+
+* worker: macros and listeners, as `airflow tasks run` does
+* dag-processor, triggerer: macros
+* scheduler: executors, then imports the configured executor
+* webserver: the web UI views, menu links and blueprints
+
+For each role, the report shows the time taken by the plugins (median of
+--runs), the resident memory of the process at the end, the number of modules
+the plugins imported, and which of the expensive modules were imported.
+
+    python benchmarks/bench_plugin_imports.py
+    python benchmarks/bench_plugin_imports.py --plugins-folder /tmp/old-plugins worker
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+PLUGINS_FOLDER = os.path.join(REPO_ROOT, "airflow_home", "plugins")
+CONFIG_FOLDER = os.path.join(REPO_ROOT, "airflow_home", "config")
+ROLES = ["worker", "dag-processor", "triggerer", "scheduler", "webserver"]
+HEAVY_MODULES = ["boto3", "flask_appbuilder", "airflow_aws_executors", "fargate_executors", "marshmallow"]
+
+# Runs in the child interpreter with the role and the executor as arguments
+LOAD_PLUGINS = f"""
+import json, resource, sys, time
+import airflow
+from airflow import plugins_manager
+from airflow.configuration import conf
+role = sys.argv[1]
+before = set(sys.modules)
+start = time.perf_counter()
+plugins_manager.ensure_plugins_loaded()
+if role in ("worker", "dag-processor", "triggerer"):
+    plugins_manager.integrate_macros_plugins()
+if role == "worker":
+    from airflow.listeners.listener import get_listener_manager
+    get_listener_manager()
+if role == "scheduler":
+    from airflow.executors.executor_loader import ExecutorLoader
+    # Set once configured: Airflow refuses the throwaway SQLite database with it
+    conf.set("core", "executor", sys.argv[2])
+    ExecutorLoader.import_executor_cls(sys.argv[2])
+if role == "webserver":
+    plugins_manager.initialize_web_ui_plugins()
+seconds = time.perf_counter() - start
+imported = set(sys.modules) - before
+print(json.dumps({{
+    "seconds": seconds,
+    "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(imported),
+    "plugins": len(plugins_manager.plugins or []),
+    "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(role: str, executor: str, runs: int, env: dict) -> dict:
+    results = []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-c", LOAD_PLUGINS, role, executor],
+            capture_output=True, text=True, env={**env, "AIRFLOW_ROLE": role}, cwd=REPO_ROOT,
+        )
+        if proc.returncode != 0 or not proc.stdout.strip():
+            return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "no output"}
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return {
+        **results[0],
+        "seconds": statistics.median(r["seconds"] for r in results),
+        "max_rss_kib": statistics.median(r["max_rss_kib"] for r in results),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("roles", nargs="*", default=ROLES)
+    parser.add_argument("--plugins-folder", default=PLUGINS_FOLDER)
+    parser.add_argument("--executor", default="aws_executors_plugin.ProfileRoutingFargateExecutor")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    airflow_home = tempfile.mkdtemp(prefix="bench-plugin-imports-")
+    env = dict(
+        os.environ,
+        AIRFLOW_HOME=airflow_home,
+        AIRFLOW__CORE__LOAD_EXAMPLES="False",
+        AIRFLOW__CORE__PLUGINS_FOLDER=args.plugins_folder,
+        # Same sys.path entries as Airflow processes get
+        PYTHONPATH=os.pathsep.join([CONFIG_FOLDER, args.plugins_folder]),
+    )
+
+    failed = False
+    for role in args.roles:
+        result = measure(role, args.executor, args.runs, env)
+        if "error" in result:
+            print(f"{role}: {result['error']}", file=sys.stderr)
+            failed = True
+            continue
+        print(
+            f"{role:<14} {result['seconds']:6.3f}s  {result['max_rss_kib'] / 1024:6.1f} MiB RSS  "
+            f"{result['modules']:>4} modules from {result['plugins']} plugins  "
+            f"heavy: {', '.join(result['heavy']) or '-'}"
+        )
+    if failed:
+        exit(1)
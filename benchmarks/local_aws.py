@@ -0,0 +1,358 @@
+"""In-process stand-ins for the AWS APIs used by this repository.
+
+They implement just enough of the boto3 client interface for the benchmarks
+(and for exercising the helpers without an AWS account), with an optional
+per-call latency to mimic the network round trip
+"""
+import hashlib
+import io
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+class LocalSecretsManager:
+    """Stand-in for boto3.client("secretsmanager")
+    """
+
+    def __init__(self, secrets: dict[str, dict], latency: float = 0.0):
+        self.secrets = {name: json.dumps(value) for name, value in secrets.items()}
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_secret_value(self, SecretId: str) -> dict:
+        self._call()
+        return {"Name": SecretId, "SecretString": self.secrets[SecretId]}
+
+    def batch_get_secret_value(self, SecretIdList: list[str]) -> dict:
+        self._call()
+        values, errors = [], []
+        for secret_id in SecretIdList:
+            if secret_id in self.secrets:
+                values.append({"Name": secret_id, "SecretString": self.secrets[secret_id]})
+            else:
+                errors.append({"SecretId": secret_id, "ErrorCode": "ResourceNotFoundException"})
+        return {"SecretValues": values, "Errors": errors}
+
+
+SAMPLE_SECRETS = {
+    "airflow_rds_conn": {
+        "host": "airflow.abcdefghijkl.us-west-2.rds.amazonaws.com",
+        "port": "5432",
+        "login": "airflow",
+        "password": "airflow",
+    },
+    "airflow_config": {
+        "logging__remote_base_log_folder": "s3://airflow-remote-logs/airflow",
+        "ecs_fargate__security_groups": "sg-0123456789abcdef0",
+        "ecs_fargate__subnets": "subnet-0123456789abcdef0,subnet-0123456789abcdef1",
+    },
+}
+
+
+def run_for(duration: float):
+    """Container runner that works for `duration` seconds and exits with 0
+    """
+    def runner(task_arn: str, command: list[str], environment: dict, stop_event: threading.Event) -> int:
+        stop_event.wait(duration)
+        return 0
+    return runner
+
+
+class LocalEcs:
+    """Stand-in for boto3.client("ecs") that runs every task in a thread.
+
+    A task is PROVISIONING for `cold_start` seconds, then RUNNING while
+    `runner(task_arn, command, environment, stop_event)` runs the container
+    command of the first container override, then STOPPED with the runner's
+    return value as the container's exit code. stop_task sets the stop_event.
+
+    With `run_task_rate`, RunTask is throttled like the real API once more
+    than `run_task_burst` calls come faster than that rate. With
+    `spot_capacity`, at most that many Fargate Spot tasks run at a time and
+    further Spot launches fail for lack of capacity
+    """
+
+    def __init__(self, cold_start: float = 0.0, runner=None, latency: float = 0.0, region: str = "us-west-2",
+                 run_task_rate: float | None = None, run_task_burst: float = 10.0,
+                 spot_capacity: int | None = None):
+        self.cold_start = cold_start
+        self.runner = runner or run_for(0.0)
+        self.latency = latency
+        self.region = region
+        self.run_task_rate = run_task_rate
+        self.run_task_burst = run_task_burst
+        self.spot_capacity = spot_capacity
+        self._run_task_tokens = run_task_burst
+        self._run_task_refilled_at = time.monotonic()
+        self.calls: dict[str, int] = {}
+        self.tasks: dict[str, dict] = {}
+        self._stop_events: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _call(self, operation: str):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _set(self, task_arn: str, **fields):
+        with self._lock:
+            self.tasks[task_arn].update(fields)
+
+    def _run(self, task_arn: str, command: list[str], environment: dict):
+        stop_event = self._stop_events[task_arn]
+        if stop_event.wait(self.cold_start):
+            self._set(task_arn, lastStatus="STOPPED", desiredStatus="STOPPED",
+                      stoppedReason="Task stopped before it started")
+            return
+        self._set(task_arn, lastStatus="RUNNING", startedAt=time.time())
+        try:
+            exit_code = self.runner(task_arn, command, environment, stop_event)
+            reason = "Essential container in task exited"
+        except Exception as e:
+            exit_code, reason = 1, f"Container runner raised {e!r}"
+        with self._lock:
+            task = self.tasks[task_arn]
+            task["containers"][0].update(lastStatus="STOPPED", exitCode=exit_code)
+            task.update(lastStatus="STOPPED", desiredStatus="STOPPED", stoppedAt=time.time(),
+                        stoppedReason=task.get("stoppedReason") or reason)
+
+    def _throttle_run_task(self):
+        if self.run_task_rate is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._run_task_tokens = min(
+                self.run_task_burst, self._run_task_tokens + (now - self._run_task_refilled_at) * self.run_task_rate,
+            )
+            self._run_task_refilled_at = now
+            if self._run_task_tokens < 1:
+                self.calls["run_task_throttled"] = self.calls.get("run_task_throttled", 0) + 1
+                raise ClientError(
+                    {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "RunTask",
+                )
+            self._run_task_tokens -= 1
+
+    def _spot_capacity_left(self) -> int:
+        with self._lock:
+            running = sum(
+                1 for task in self.tasks.values()
+                if task.get("capacityProviderName") == "FARGATE_SPOT" and task["lastStatus"] != "STOPPED"
+            )
+        return self.spot_capacity - running
+
+    def run_task(self, cluster: str, taskDefinition: str, count: int = 1, overrides: dict | None = None,
+                 capacityProviderStrategy: list[dict] | None = None, startedBy: str | None = None, **kwargs) -> dict:
+        self._call("run_task")
+        self._throttle_run_task()
+        capacity_provider = (capacityProviderStrategy or [{}])[0].get("capacityProvider", "FARGATE")
+        if capacity_provider == "FARGATE_SPOT" and self.spot_capacity is not None:
+            if self._spot_capacity_left() < count:
+                reason = (
+                    "Capacity is unavailable at this time. "
+                    "Please try again later or in a different availability zone"
+                )
+                return {"tasks": [], "failures": [{"reason": reason}]}
+        container = ((overrides or {}).get("containerOverrides") or [{"name": "worker"}])[0]
+        environment = {env["name"]: env["value"] for env in container.get("environment", [])}
+        tasks = []
+        for _ in range(count):
+            with self._lock:
+                self._next_id += 1
+                task_arn = f"arn:aws:ecs:{self.region}:000000000000:task/{cluster}/{self._next_id:032x}"
+                self.tasks[task_arn] = {
+                    "taskArn": task_arn,
+                    "clusterArn": cluster,
+                    "taskDefinitionArn": taskDefinition,
+                    "capacityProviderName": capacity_provider,
+                    "lastStatus": "PROVISIONING",
+                    "desiredStatus": "RUNNING",
+                    "containers": [{"name": container["name"], "lastStatus": "PENDING"}],
+                    "createdAt": time.time(),
+                }
+                if startedBy:
+                    self.tasks[task_arn]["startedBy"] = startedBy
+                self._stop_events[task_arn] = threading.Event()
+                task = json.loads(json.dumps(self.tasks[task_arn]))
+            threading.Thread(
+                target=self._run, args=(task_arn, container.get("command", []), environment), daemon=True,
+            ).start()
+            tasks.append(task)
+        return {"tasks": tasks, "failures": []}
+
+    def describe_tasks(self, cluster: str, tasks: list[str], **kwargs) -> dict:
+        self._call("describe_tasks")
+        if len(tasks) > 100:
+            raise ValueError("describe_tasks takes at most 100 tasks")
+        found, failures = [], []
+        with self._lock:
+            for task_arn in tasks:
+                if task_arn in self.tasks:
+                    found.append(json.loads(json.dumps(self.tasks[task_arn])))
+                else:
+                    failures.append({"arn": task_arn, "reason": "MISSING"})
+        return {"tasks": found, "failures": failures}
+
+    def list_tasks(self, cluster: str, desiredStatus: str = "RUNNING", nextToken: str | None = None,
+                   maxResults: int = 100, family: str | None = None, startedBy: str | None = None,
+                   **kwargs) -> dict:
+        self._call("list_tasks")
+        with self._lock:
+            arns = [
+                arn for arn, task in self.tasks.items()
+                if task["desiredStatus"] == desiredStatus
+                and family in (None, task["taskDefinitionArn"].split("/")[-1].split(":")[0])
+                and startedBy in (None, task.get("startedBy"))
+            ]
+        start = int(nextToken or 0)
+        response = {"taskArns": arns[start:start + maxResults]}
+        if start + maxResults < len(arns):
+            response["nextToken"] = str(start + maxResults)
+        return response
+
+    def stop_task(self, cluster: str, task: str, reason: str = "", **kwargs) -> dict:
+        self._call("stop_task")
+        self._set(task, desiredStatus="STOPPED", stoppedReason=reason or "Task stopped by user")
+        self._stop_events[task].set()
+        with self._lock:
+            return {"task": json.loads(json.dumps(self.tasks[task]))}
+
+
+class LocalS3:
+    """Stand-in for boto3.client("s3") that keeps the objects, and the parts of
+    multipart uploads, in memory
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.objects: dict[tuple[str, str], dict] = {}
+        self.uploads: dict[str, dict[int, tuple[bytes, str]]] = {}
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, Bucket: str, Key: str) -> dict:
+        with self._lock:
+            obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise ClientError(
+                {"Error": {"Code": "NoSuchKey", "Message": "The specified key does not exist."}}, "GetObject",
+            )
+        return obj
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> dict:
+        self._call("put_object")
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        with self._lock:
+            self.objects[(Bucket, Key)] = {
+                "Body": bytes(Body),
+                "ETag": etag,
+                "ContentEncoding": kwargs.get("ContentEncoding"),
+                "LastModified": datetime.now(timezone.utc),
+            }
+        return {"ETag": etag}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("create_multipart_upload")
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes, **kwargs) -> dict:
+        self._call("upload_part")
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = (bytes(Body), etag)
+        return {"ETag": etag}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict,
+                                  **kwargs) -> dict:
+        self._call("complete_multipart_upload")
+        with self._lock:
+            parts = self.uploads.pop(UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        for number in numbers[:-1]:
+            if len(parts[number][0]) < 5 * 1024 * 1024:
+                raise ClientError(
+                    {"Error": {"Code": "EntityTooSmall", "Message": "Your proposed upload is smaller than the "
+                                                                     "minimum allowed object size."}},
+                    "CompleteMultipartUpload",
+                )
+        body = b"".join(parts[number][0] for number in numbers)
+        digest = hashlib.md5(b"".join(bytes.fromhex(parts[n][1].strip('"')) for n in numbers)).hexdigest()
+        etag = f'"{digest}-{len(numbers)}"'
+        with self._lock:
+            self.objects[(Bucket, Key)] = {
+                "Body": body, "ETag": etag, "ContentEncoding": None, "LastModified": datetime.now(timezone.utc),
+            }
+        return {"Bucket": Bucket, "Key": Key, "ETag": etag}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self._call("abort_multipart_upload")
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+        return {}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("head_object")
+        obj = self._get(Bucket, Key)
+        return {"ContentLength": len(obj["Body"]), "ETag": obj["ETag"]}
+
+    def get_object(self, Bucket: str, Key: str, Range: str | None = None, **kwargs) -> dict:
+        self._call("get_object")
+        obj = self._get(Bucket, Key)
+        body = obj["Body"]
+        if Range:
+            # bytes=start-end or bytes=-suffix
+            start, _, end = Range.removeprefix("bytes=").partition("-")
+            if start:
+                body = body[int(start):int(end) + 1 if end else None]
+            else:
+                body = body[-int(end):]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body), "ETag": obj["ETag"]}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._call("delete_object")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs) -> dict:
+        self._call("delete_objects")
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop((Bucket, obj["Key"]), None)
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", **kwargs) -> dict:
+        self._call("list_objects_v2")
+        with self._lock:
+            contents = [
+                {"Key": key, "Size": len(obj["Body"]), "ETag": obj["ETag"], "LastModified": obj["LastModified"]}
+                for (bucket, key), obj in sorted(self.objects.items())
+                if bucket == Bucket and key.startswith(Prefix)
+            ]
+        return {"Contents": contents, "KeyCount": len(contents)}
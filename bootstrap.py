@@ -0,0 +1,119 @@
+"""Container bootstrap: fetch Airflow's secrets from AWS Secrets Manager, export
+the environment variables built from them, then exec the image's entrypoint.
+
+Both secrets are fetched with one BatchGetSecretValue call (falling back to one
+GetSecretValue per secret on older botocore) and each secret string is parsed
+once. If BOOTSTRAP_CACHE_TTL is set to a positive number of seconds, the
+secrets are cached on tmpfs so that restarts within the TTL skip the API call
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import quote_plus
+
+ENTRYPOINT = os.getenv("BOOTSTRAP_ENTRYPOINT", "/entrypoint")
+RDS_SECRET_ID = os.getenv("RDS_SECRET_ID", "airflow_rds_conn")
+AIRFLOW_CONFIG_SECRET_ID = os.getenv("AIRFLOW_CONFIG_SECRET_ID", "airflow_config")
+CACHE_PATH = os.getenv("BOOTSTRAP_CACHE_PATH", "/dev/shm/airflow-bootstrap-secrets.json")
+CACHE_TTL = float(os.getenv("BOOTSTRAP_CACHE_TTL", "0"))
+
+
+def secretsmanager_client():
+    import boto3  # deferred so that a warm cache never pays for importing boto3
+    return boto3.session.Session().client("secretsmanager")
+
+
+def fetch_secrets(secret_ids: list[str], client) -> dict[str, dict]:
+    """Return the parsed SecretString of every input secret, keyed by secret ID
+    """
+    if hasattr(client, "batch_get_secret_value"):
+        resp = client.batch_get_secret_value(SecretIdList=secret_ids)
+        if resp.get("Errors"):
+            errors = ", ".join(f"{e['SecretId']}: {e['ErrorCode']}" for e in resp["Errors"])
+            raise RuntimeError(f"Failed to fetch secrets: {errors}")
+        # Entries are keyed by name here because SecretIdList accepts names
+        secrets = {v["Name"]: json.loads(v["SecretString"]) for v in resp["SecretValues"]}
+        return {secret_id: secrets[secret_id] for secret_id in secret_ids}
+    return {
+        secret_id: json.loads(client.get_secret_value(SecretId=secret_id)["SecretString"])
+        for secret_id in secret_ids
+    }
+
+
+def read_cache(path: str, ttl: float, clock=time.time) -> dict | None:
+    if ttl <= 0:
+        return None
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("fetched_at", 0) + ttl < clock():
+        return None
+    return cached["secrets"]
+
+
+def write_cache(path: str, secrets: dict, clock=time.time):
+    directory = os.path.dirname(path) or "."
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")  # created with mode 0600
+        with os.fdopen(fd, "w") as f:
+            json.dump({"fetched_at": clock(), "secrets": secrets}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache secrets in {path}: {e}", file=sys.stderr)
+
+
+def load_secrets(
+    secret_ids: list[str],
+    client_factory=secretsmanager_client,
+    cache_path: str = CACHE_PATH,
+    cache_ttl: float = CACHE_TTL,
+) -> dict[str, dict]:
+    """Return the input secrets from the tmpfs cache if it is fresh, otherwise
+    from Secrets Manager
+    """
+    secrets = read_cache(cache_path, cache_ttl)
+    if secrets is not None and all(secret_id in secrets for secret_id in secret_ids):
+        return secrets
+    secrets = fetch_secrets(secret_ids, client_factory())
+    if cache_ttl > 0:
+        write_cache(cache_path, secrets)
+    return secrets
+
+
+def build_environment(rds_conn: dict, airflow_config: dict) -> dict[str, str]:
+    """Return the environment variables that are derived from the secrets
+    """
+    user = quote_plus(rds_conn["login"])
+    password = quote_plus(rds_conn["password"])
+    host, port = rds_conn["host"], rds_conn["port"]
+    # Set to the pgbouncer sidecar of the task definition, if any
+    db_host, _, db_port = os.getenv("DATABASE_PROXY", f"{host}:{port}").partition(":")
+    return {
+        "RDS_HOST": host,
+        "RDS_PORT": str(port),
+        "RDS_USER": rds_conn["login"],
+        "RDS_PASSWORD": rds_conn["password"],
+        "AIRFLOW__DATABASE__SQL_ALCHEMY_CONN": (
+            f"postgresql+psycopg2://{user}:{password}@{db_host}:{db_port}/airflow"
+        ),
+        "AIRFLOW__LOGGING__REMOTE_BASE_LOG_FOLDER": airflow_config["logging__remote_base_log_folder"],
+        "AIRFLOW__ECS_FARGATE__SECURITY_GROUPS": airflow_config["ecs_fargate__security_groups"],
+        "AIRFLOW__ECS_FARGATE__SUBNETS": airflow_config["ecs_fargate__subnets"],
+    }
+
+
+def bootstrap_environment(client_factory=secretsmanager_client) -> dict[str, str]:
+    secrets = load_secrets([RDS_SECRET_ID, AIRFLOW_CONFIG_SECRET_ID], client_factory)
+    return build_environment(secrets[RDS_SECRET_ID], secrets[AIRFLOW_CONFIG_SECRET_ID])
+
+
+if __name__ == "__main__":
+    # Cold-start phase marks, see airflow_home/config/cold_start.py
+    os.environ.setdefault("COLD_START_BOOTSTRAP_STARTED_AT", repr(time.time()))
+    os.environ.update(bootstrap_environment())
+    os.environ.setdefault("COLD_START_SECRETS_FETCHED_AT", repr(time.time()))
+    os.execv(ENTRYPOINT, [ENTRYPOINT, *sys.argv[1:]])
@@ -1,7 +1,11 @@
-"""Generate a JSON for network configurations
+"""Generate a JSON for network configurations, with the subnets that have
+free IP addresses left ranked across availability zones
 """
-from helpers import getenv_or_exit, list_subnet_ids, generate_network_config
+from helpers import getenv_or_exit, generate_network_config
+from helpers.cache import cached_describe_subnets
+from helpers.subnets import MIN_FREE_IPS, rank_subnets
 import json
+import os
 import boto3
 
 if __name__ == "__main__":
@@ -9,7 +13,9 @@ if __name__ == "__main__":
     vpc_id = getenv_or_exit("VPC_ID")
     ecs_security_group = getenv_or_exit("ECS_SG_ID")
     
-    subnet_ids = list_subnet_ids(vpc_id, session.client("ec2"))
+    min_free_ips = int(os.getenv("SUBNET_MIN_FREE_IPS", MIN_FREE_IPS))
+
+    subnet_ids = rank_subnets(cached_describe_subnets(vpc_id, session.client("ec2")), min_free_ips)
 
     network_config = generate_network_config(ecs_security_group, subnet_ids)
     print(json.dumps(network_config))
@@ -1,6 +1,13 @@
+import json
 import os
 import sys
 
+CONFIG_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "airflow_home", "config")
+# The executor imports worker_profiles in the image, so the profiles are loaded
+# and validated by that same module here
+sys.path.append(CONFIG_FOLDER)
+from worker_profiles import check_fargate_size, load_worker_profiles, worker_profile_family
+
 def getenv_or_exit(name: str):
     val = os.getenv(name, None)
     if val is None:
@@ -8,22 +15,48 @@ def getenv_or_exit(name: str):
         exit(1)
     return val
 
-def list_tasks(cluster_name: str, ecs) -> list[str]:
-    """Return a list of Task Arns
+# DescribeTasks accepts at most 100 task ARNs per call
+DESCRIBE_TASKS_BATCH_SIZE = 100
+
+def chunked(items: list, size: int):
+    """Yield successive slices of the input list that are at most size long
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def list_tasks(cluster_name: str, ecs, family: str | None = None) -> list[str]:
+    """Return a list of Task Arns, optionally only those of one task
+    definition family, following nextToken through every page
+    """
+    task_arns = []
+    kwargs = {"cluster": cluster_name}
+    if family is not None:
+        kwargs["family"] = family
+    while True:
+        resp = ecs.list_tasks(**kwargs)
+        task_arns.extend(resp["taskArns"])
+        if not resp.get("nextToken"):
+            return task_arns
+        kwargs["nextToken"] = resp["nextToken"]
+
+def describe_tasks(cluster_name: str, task_arns: list[str], ecs) -> list[dict]:
+    """Return the descriptions of the input tasks, calling DescribeTasks once
+    per batch of DESCRIBE_TASKS_BATCH_SIZE ARNs. Tasks that ECS can no longer
+    find are left out of the result
     """
-    resp = ecs.list_tasks(cluster=cluster_name)
-    return resp["taskArns"]
+    tasks = []
+    for batch in chunked(task_arns, DESCRIBE_TASKS_BATCH_SIZE):
+        resp = ecs.describe_tasks(cluster=cluster_name, tasks=batch)
+        tasks.extend(resp["tasks"])
+    return tasks
 
 def tasks_all_stopped(cluster_name: str, task_arns: list[str], ecs) -> bool:
     """Return true if the input task has stopped
     """
     if len(task_arns) == 0:
         return True
-    resp = ecs.describe_tasks(
-        cluster=cluster_name,
-        tasks=task_arns,
-    )
-    task_statuses = [t["lastStatus"] for t in resp["tasks"]]
+    tasks = describe_tasks(cluster_name, task_arns, ecs)
+    task_statuses = [t["lastStatus"] for t in tasks]
     return all([s == "STOPPED" for s in task_statuses])
 
 def list_subnet_ids(vpc_id, ec2):
@@ -35,6 +68,27 @@ def list_subnet_ids(vpc_id, ec2):
     return [sn["SubnetId"] for sn in resp["Subnets"]]
 
 
+def describe_subnets(vpc_id, ec2) -> list[dict]:
+    """Return the ID, availability zone and number of free IP addresses of
+    every subnet of the input VPC
+    """
+    subnets = []
+    kwargs = {"Filters": [{"Name": "vpc-id", "Values": [vpc_id]}]}
+    while True:
+        resp = ec2.describe_subnets(**kwargs)
+        subnets.extend(
+            {
+                "SubnetId": sn["SubnetId"],
+                "AvailabilityZone": sn["AvailabilityZone"],
+                "AvailableIpAddressCount": sn["AvailableIpAddressCount"],
+            }
+            for sn in resp["Subnets"]
+        )
+        if not resp.get("NextToken"):
+            return subnets
+        kwargs["NextToken"] = resp["NextToken"]
+
+
 def generate_network_config(
     ecs_security_group: str,
     subnet_ids: list[str],
@@ -60,34 +114,55 @@ def get_rds_endpoint(rds_instance_id: str, rds) -> str | None:
         return db_instance["Endpoint"]["Address"]
     return None
 
+CORE_SERVICES_PATH = os.path.join(CONFIG_FOLDER, "core_services.json")
+
+def load_core_services(path: str = CORE_SERVICES_PATH) -> dict[str, dict]:
+    """Return the core services (webserver, scheduler, DAG processor) declared
+    in core_services.json, after checking that each one is a valid Fargate
+    size
+    """
+    with open(path) as f:
+        services = json.load(f)
+    for name, service in services.items():
+        check_fargate_size(f"Core service {name}", service)
+    return services
+
 def generate_airflow_core_task_def(
     image_uri: str,
     aws_account_id: str,
+    service: str = "webserver",
+    services: dict[str, dict] | None = None,
 ):
-    """Return a dictionary that defines the task definition for the Airflow
-    cluster
+    """Return a dictionary that defines the task definition of one Airflow
+    core service (see airflow_home/config/core_services.json). Each service
+    runs in its own task so that it can be sized and scaled on its own
     """
     ecs_task_role = getenv_or_exit("ECS_TASK_ROLE")
+    services = load_core_services() if services is None else services
+    core_service = services[service]
 
     return {
-        "family": getenv_or_exit("AIRFLOW_CORE_TASK_DEF"),
+        "family": getenv_or_exit("AIRFLOW_CORE_TASK_DEF") + core_service.get("familySuffix", ""),
         "containerDefinitions": [
             {
-                "name": "webserver",
+                "name": service,
                 "image": image_uri,
                 "cpu": 0,
                 "portMappings": [
                     {
-                        "containerPort": 8080,
-                        "hostPort": 8080,
+                        "containerPort": port,
+                        "hostPort": port,
                         "protocol": "tcp",
                     }
+                    for port in core_service.get("ports", [])
                 ],
                 "essential": True,
-                "command": [
-                    "webserver"
+                "command": core_service["command"],
+                # AIRFLOW_ROLE tells the plugins which component they are loaded by
+                "environment": [
+                    {"name": name, "value": value}
+                    for name, value in sorted({**core_service.get("environment", {}), "AIRFLOW_ROLE": service}.items())
                 ],
-                "environment": [],
                 "environmentFiles": [],
                 "mountPoints": [],
                 "volumesFrom": [],
@@ -101,29 +176,6 @@ def generate_airflow_core_task_def(
                         "awslogs-stream-prefix": "ecs"
                     }
                 }
-            },
-            {
-                "name": "scheduler",
-                "image": image_uri,
-                "cpu": 0,
-                "portMappings": [],
-                "essential": True,
-                "command": [
-                    "scheduler"
-                ],
-                "environment": [],
-                "environmentFiles": [],
-                "mountPoints": [],
-                "volumesFrom": [],
-                "logConfiguration": {
-                    "logDriver": "awslogs",
-                    "options": {
-                        "awslogs-group": getenv_or_exit("ECS_LOG_GROUP"),
-                        "awslogs-create-group": "true",
-                        "awslogs-region": getenv_or_exit("AWS_REGION"),
-                        "awslogs-stream-prefix": "ecs"
-                    }
-                }
             }
         ],
         "taskRoleArn": f"arn:aws:iam::{aws_account_id}:role/{ecs_task_role}",
@@ -132,10 +184,10 @@ def generate_airflow_core_task_def(
         "requiresCompatibilities": [
             "FARGATE"
         ],
-        "cpu": "1024",
-        "memory": "8192",
+        "cpu": core_service["cpu"],
+        "memory": core_service["memory"],
         "runtimePlatform": {
-            "cpuArchitecture": "X86_64",
+            "cpuArchitecture": core_service["cpuArchitecture"],
             "operatingSystemFamily": "LINUX"
         }
     }
@@ -143,14 +195,18 @@ def generate_airflow_core_task_def(
 def generate_airflow_worker_task_def(
     image_uri: str,
     aws_account_id: str,
+    profile: str = "default",
+    profiles: dict[str, dict] | None = None,
 ):
-    """Return a dictionary that defines the task definition for the Airflow
-    cluster
+    """Return a dictionary that defines the task definition for Airflow workers
+    of the given profile (see airflow_home/config/worker_profiles.json)
     """
     ecs_task_role = getenv_or_exit("ECS_TASK_ROLE")
+    profiles = load_worker_profiles() if profiles is None else profiles
+    worker_profile = profiles[profile]
 
     return {
-        "family": getenv_or_exit("AIRFLOW_WORKER_TASK_DEF"),
+        "family": worker_profile_family(getenv_or_exit("AIRFLOW_WORKER_TASK_DEF"), profile, profiles),
         "containerDefinitions": [
             {
                 "name": "worker",
@@ -158,10 +214,14 @@ def generate_airflow_worker_task_def(
                 "cpu": 0,
                 "portMappings": [],
                 "essential": True,
+                # The executor overrides the command with the task to run, a
+                # worker launched without an override just exits
                 "command": [
-                    "scheduler"
+                    "version"
+                ],
+                "environment": [
+                    {"name": "AIRFLOW_ROLE", "value": "worker"},
                 ],
-                "environment": [],
                 "environmentFiles": [],
                 "mountPoints": [],
                 "volumesFrom": [],
@@ -182,10 +242,22 @@ def generate_airflow_worker_task_def(
         "requiresCompatibilities": [
             "FARGATE"
         ],
-        "cpu": "1024",
-        "memory": "8192",
+        "cpu": worker_profile["cpu"],
+        "memory": worker_profile["memory"],
         "runtimePlatform": {
-            "cpuArchitecture": "X86_64",
+            "cpuArchitecture": worker_profile["cpuArchitecture"],
             "operatingSystemFamily": "LINUX"
         }
     }
+
+def generate_airflow_worker_task_defs(
+    image_uri: str,
+    aws_account_id: str,
+) -> list[dict]:
+    """Return one worker task definition per worker profile
+    """
+    profiles = load_worker_profiles()
+    return [
+        generate_airflow_worker_task_def(image_uri, aws_account_id, profile, profiles)
+        for profile in profiles
+    ]
@@ -0,0 +1,219 @@
+"""TTL cache for the AWS discovery lookups in helpers.
+
+Entries are kept in memory and in one JSON file per resource so that repeated
+tooling runs (every script and run.sh subcommand) can reuse them. run.sh
+invalidates a resource whenever it changes it. The hit and miss counters of
+each run are added to stats.json in the cache directory when it exits, and
+`stats` prints them with the fresh entries of each resource:
+
+    python -m helpers.cache invalidate rds_endpoint
+    python -m helpers.cache stats [--reset]
+"""
+import atexit
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from helpers import describe_subnets, get_rds_endpoint, list_subnet_ids
+
+# Seconds an entry stays fresh, override with HELPERS_CACHE_TTL_<RESOURCE>
+DEFAULT_TTLS = {
+    "subnets": 3600,
+    "subnet_capacity": 60,
+    "rds_endpoint": 600,
+}
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "airflow-ecs-fargate")
+
+
+class DiscoveryCache:
+    """Two-level (memory and disk) cache with a TTL per resource
+    """
+
+    def __init__(self, cache_dir: str | None = None, ttls: dict | None = None, clock=time.time):
+        self.cache_dir = cache_dir or os.getenv("HELPERS_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.enabled = os.getenv("HELPERS_CACHE_DISABLED", "") == ""
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        for resource in self.ttls:
+            override = os.getenv(f"HELPERS_CACHE_TTL_{resource.upper()}")
+            if override:
+                self.ttls[resource] = float(override)
+        self.clock = clock
+        self.hits = Counter()
+        self.misses = Counter()
+        self._memory: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, resource: str) -> str:
+        return os.path.join(self.cache_dir, f"{resource}.json")
+
+    @property
+    def stats_path(self) -> str:
+        return os.path.join(self.cache_dir, "stats.json")
+
+    def _load(self, resource: str) -> dict:
+        if resource not in self._memory:
+            try:
+                with open(self._path(resource)) as f:
+                    self._memory[resource] = json.load(f)
+            except (OSError, ValueError):
+                self._memory[resource] = {}
+        return self._memory[resource]
+
+    def _save(self, resource: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._memory[resource], f)
+        os.replace(tmp_path, self._path(resource))
+
+    def get_or_fetch(self, resource: str, key: str, fetch):
+        """Return the cached value of key if it is still fresh, otherwise call
+        fetch() and cache its result. None results are never cached
+        """
+        if not self.enabled:
+            return fetch()
+        with self._lock:
+            entry = self._load(resource).get(key)
+            if entry is not None and entry["expires_at"] > self.clock():
+                self.hits[resource] += 1
+                return entry["value"]
+            self.misses[resource] += 1
+        value = fetch()
+        if value is not None:
+            with self._lock:
+                # Re-read so that entries written by other processes survive
+                self._memory.pop(resource, None)
+                self._load(resource)[key] = {
+                    "value": value,
+                    "expires_at": self.clock() + self.ttls.get(resource, 0),
+                }
+                self._save(resource)
+        return value
+
+    def invalidate(self, *resources: str):
+        """Drop every entry of the input resources, or of all resources if
+        none are given
+        """
+        with self._lock:
+            for resource in resources or list(self.ttls):
+                self._memory.pop(resource, None)
+                try:
+                    os.remove(self._path(resource))
+                except FileNotFoundError:
+                    pass
+
+    def _load_stats(self) -> dict[str, dict[str, int]]:
+        try:
+            with open(self.stats_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def flush_stats(self):
+        """Add the counters of this process to the ones in stats.json
+        """
+        with self._lock:
+            hits, misses = Counter(self.hits), Counter(self.misses)
+            self.hits.clear()
+            self.misses.clear()
+        if not hits and not misses:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Serializes the read-modify-write of concurrent tooling runs
+        with open(self.stats_path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            totals = self._load_stats()
+            for resource in set(hits) | set(misses):
+                entry = totals.setdefault(resource, {"hits": 0, "misses": 0})
+                entry["hits"] += hits[resource]
+                entry["misses"] += misses[resource]
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(totals, f)
+            os.replace(tmp_path, self.stats_path)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Return the hit and miss counters of every resource, over every run
+        since the last reset including this one
+        """
+        totals = self._load_stats()
+        with self._lock:
+            for resource in set(self.hits) | set(self.misses):
+                entry = totals.setdefault(resource, {"hits": 0, "misses": 0})
+                entry["hits"] += self.hits[resource]
+                entry["misses"] += self.misses[resource]
+        return dict(sorted(totals.items()))
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+        try:
+            os.remove(self.stats_path)
+        except FileNotFoundError:
+            pass
+
+
+CACHE = DiscoveryCache()
+atexit.register(CACHE.flush_stats)
+
+
+def _region(client) -> str:
+    meta = getattr(client, "meta", None)
+    return getattr(meta, "region_name", None) or "default"
+
+
+def cached_list_subnet_ids(vpc_id: str, ec2, cache: DiscoveryCache = CACHE) -> list[str]:
+    """Cached list_subnet_ids
+    """
+    return cache.get_or_fetch(
+        "subnets", f"{_region(ec2)}:{vpc_id}", lambda: list_subnet_ids(vpc_id, ec2)
+    )
+
+
+def cached_describe_subnets(vpc_id: str, ec2, cache: DiscoveryCache = CACHE) -> list[dict]:
+    """Cached describe_subnets. Free IP counts change with every launch, so
+    this entry expires after a minute and run.sh drops it after run-task
+    """
+    return cache.get_or_fetch(
+        "subnet_capacity", f"{_region(ec2)}:{vpc_id}", lambda: describe_subnets(vpc_id, ec2)
+    )
+
+
+def cached_get_rds_endpoint(rds_instance_id: str, rds, cache: DiscoveryCache = CACHE) -> str | None:
+    """Cached get_rds_endpoint. An instance without an endpoint is looked up
+    again on the next call
+    """
+    return cache.get_or_fetch(
+        "rds_endpoint",
+        f"{_region(rds)}:{rds_instance_id}",
+        lambda: get_rds_endpoint(rds_instance_id, rds),
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("invalidate", "stats"):
+        print("Usage: python -m helpers.cache invalidate [resource ...] | stats [--reset]", file=sys.stderr)
+        exit(1)
+    if sys.argv[1] == "invalidate":
+        CACHE.invalidate(*sys.argv[2:])
+    elif sys.argv[2:] == ["--reset"]:
+        CACHE.reset_stats()
+    else:
+        now = CACHE.clock()
+        stats = CACHE.stats()
+        for resource in sorted(CACHE.ttls):
+            entries = CACHE._load(resource)
+            fresh = sum(1 for e in entries.values() if e["expires_at"] > now)
+            counters = stats.get(resource, {"hits": 0, "misses": 0})
+            lookups = counters["hits"] + counters["misses"]
+            hit_rate = f"{counters['hits'] / lookups:.0%}" if lookups else "-"
+            print(
+                f"{resource}: {fresh}/{len(entries)} fresh entries, ttl {CACHE.ttls[resource]}s, "
+                f"{counters['hits']} hits, {counters['misses']} misses, hit rate {hit_rate}"
+            )
@@ -0,0 +1,261 @@
+"""Budget the metadata database connections of every Airflow component.
+
+Peak connections of each component, with pool = pool_size + max_overflow of
+its SQLAlchemy pool:
+
+* webserver: gunicorn workers x pool, per replica
+* scheduler: pool, per replica (the executor runs in the scheduler process)
+* dag-processor: pool for the manager, plus one per parsing process
+* workers: two per running task instance (`airflow tasks run` and its `--raw`
+  child both use NullPool), and up to PARALLELISM task instances per
+  scheduler replica
+
+Workers cannot be pooled, so they are budgeted first. The core services share
+what is left, with the largest per-process pool (up to Airflow's default of
+15) that fits. With a pgbouncer sidecar, a core task opens at most
+pgbouncer_pool_size server connections whatever its clients use.
+plan_connection_budget raises a ConnectionBudgetExceeded when even the
+smallest pools do not fit in max_connections
+"""
+import os
+import re
+from dataclasses import dataclass, field
+from urllib.parse import quote_plus
+
+# Airflow's sql_alchemy_pool_size + sql_alchemy_max_overflow
+DEFAULT_POOL = 15
+MIN_POOL = 2
+CONNECTIONS_PER_TASK = 2
+# Connections kept free for superusers and for RDS itself
+DEFAULT_RESERVED = 5
+PGBOUNCER_IMAGE = "edoburu/pgbouncer:1.18.0"
+PGBOUNCER_PORT = 6432
+
+
+class ConnectionBudgetExceeded(ValueError):
+    pass
+
+
+@dataclass
+class ConnectionBudget:
+    max_connections: int
+    parallelism: int
+    scheduler_replicas: int = 1
+    webserver_replicas: int = 1
+    webserver_workers: int = 4
+    parsing_processes: int = 2
+    reserved: int = DEFAULT_RESERVED
+    pgbouncer: bool = False
+    pgbouncer_pool_size: int = 5
+    # Filled in by plan_connection_budget
+    pools: dict[str, int] = field(default_factory=dict)
+    connections: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return sum(self.connections.values()) + self.reserved
+
+    def environment(self, service: str) -> dict[str, str]:
+        """Return the container environment that applies the pool of a core
+        service
+        """
+        pool = self.pools[service]
+        pool_size = min(5, pool)
+        return {
+            "AIRFLOW__DATABASE__SQL_ALCHEMY_POOL_SIZE": str(pool_size),
+            "AIRFLOW__DATABASE__SQL_ALCHEMY_MAX_OVERFLOW": str(pool - pool_size),
+        }
+
+    def report(self) -> str:
+        lines = [
+            f"{name}: {self.connections[name]} connections"
+            + (f" (pool of {self.pools[name]} per process)" if name in self.pools else "")
+            for name in self.connections
+        ]
+        lines.append(f"reserved: {self.reserved} connections")
+        lines.append(f"total: {self.total}/{self.max_connections}")
+        return "\n".join(lines)
+
+
+def core_connections(budget: ConnectionBudget, pool: int) -> dict[str, int]:
+    """Return the peak connections of each core service with the given
+    per-process pool
+    """
+    per_task = {
+        "webserver": budget.webserver_workers * pool,
+        "scheduler": pool,
+        "dag-processor": pool + budget.parsing_processes,
+    }
+    if budget.pgbouncer:
+        per_task = {name: min(n, budget.pgbouncer_pool_size) for name, n in per_task.items()}
+    return {
+        "webserver": per_task["webserver"] * budget.webserver_replicas,
+        "scheduler": per_task["scheduler"] * budget.scheduler_replicas,
+        "dag-processor": per_task["dag-processor"],
+    }
+
+
+def plan_connection_budget(budget: ConnectionBudget) -> ConnectionBudget:
+    """Fill in the pool and peak connections of every component, or raise a
+    ConnectionBudgetExceeded
+    """
+    workers = CONNECTIONS_PER_TASK * budget.parallelism * budget.scheduler_replicas
+    available = budget.max_connections - budget.reserved - workers
+    for pool in range(DEFAULT_POOL, MIN_POOL - 1, -1):
+        connections = core_connections(budget, pool)
+        if sum(connections.values()) <= available:
+            break
+    else:
+        needed = sum(core_connections(budget, MIN_POOL).values()) + workers + budget.reserved
+        raise ConnectionBudgetExceeded(
+            f"{needed} database connections needed but the instance allows {budget.max_connections}: "
+            f"{workers} for {budget.parallelism * budget.scheduler_replicas} running task instances "
+            f"(PARALLELISM {budget.parallelism} x {budget.scheduler_replicas} schedulers) and "
+            f"{needed - workers - budget.reserved} for the core services at least. "
+            f"Lower PARALLELISM or the scheduler replicas, "
+            + ("lower PGBOUNCER_POOL_SIZE, " if budget.pgbouncer else "add the pgbouncer sidecar, ")
+            + "or use a larger instance"
+        )
+    budget.pools = {name: pool for name in connections}
+    budget.connections = {**connections, "workers": workers}
+    return budget
+
+
+def check_registered_budget(budget: ConnectionBudget, pool: int) -> ConnectionBudget:
+    """Fill in the peak connections of every component with the pool the core
+    services were registered with, e.g. before scaling their replicas, or raise
+    a ConnectionBudgetExceeded
+    """
+    workers = CONNECTIONS_PER_TASK * budget.parallelism * budget.scheduler_replicas
+    connections = core_connections(budget, pool)
+    budget.pools = {name: pool for name in connections}
+    budget.connections = {**connections, "workers": workers}
+    if budget.total > budget.max_connections:
+        raise ConnectionBudgetExceeded(
+            f"{budget.total} database connections needed but the instance allows {budget.max_connections} "
+            f"with {budget.scheduler_replicas} schedulers, {budget.webserver_replicas} webservers and the "
+            f"registered pool of {pool} per process. Register the task definitions again with "
+            f"SCHEDULER_REPLICAS={budget.scheduler_replicas} and WEBSERVER_REPLICAS={budget.webserver_replicas} "
+            f"so that the pools are sized for them, lower PARALLELISM, or add the pgbouncer sidecar"
+        )
+    return budget
+
+
+def registered_pool(task_definition: dict) -> int | None:
+    """Return the pool (pool size + max overflow) that a registered core task
+    definition applies, None if it was registered without a budget
+    """
+    environment = {e["name"]: e["value"] for e in task_definition["containerDefinitions"][0].get("environment", [])}
+    if "AIRFLOW__DATABASE__SQL_ALCHEMY_POOL_SIZE" not in environment:
+        return None
+    return int(environment["AIRFLOW__DATABASE__SQL_ALCHEMY_POOL_SIZE"]) + int(
+        environment.get("AIRFLOW__DATABASE__SQL_ALCHEMY_MAX_OVERFLOW", "0")
+    )
+
+
+def budget_from_environment(services: dict[str, dict], max_connections: int, wrapper_path: str) -> ConnectionBudget:
+    """Return the budget of the deployment: PARALLELISM as exported by
+    wrapper.sh, gunicorn workers and parsing processes as set in
+    core_services.json, replicas and pgbouncer from SCHEDULER_REPLICAS,
+    WEBSERVER_REPLICAS, PGBOUNCER_ENABLED and PGBOUNCER_POOL_SIZE
+    """
+    webserver_env = services["webserver"].get("environment", {})
+    dag_processor_env = services["dag-processor"].get("environment", {})
+    return ConnectionBudget(
+        max_connections=max_connections,
+        parallelism=int(wrapper_setting("AIRFLOW__CORE__PARALLELISM", wrapper_path, "32")),
+        scheduler_replicas=int(os.getenv("SCHEDULER_REPLICAS", "1")),
+        webserver_replicas=int(os.getenv("WEBSERVER_REPLICAS", "1")),
+        webserver_workers=int(webserver_env.get("AIRFLOW__WEBSERVER__WORKERS", "4")),
+        parsing_processes=int(dag_processor_env.get("AIRFLOW__SCHEDULER__PARSING_PROCESSES", "2")),
+        reserved=int(os.getenv("RDS_RESERVED_CONNECTIONS", DEFAULT_RESERVED)),
+        pgbouncer=os.getenv("PGBOUNCER_ENABLED", "").lower() in ("1", "true", "yes"),
+        pgbouncer_pool_size=int(os.getenv("PGBOUNCER_POOL_SIZE", "5")),
+    )
+
+
+def wrapper_setting(name: str, path: str, default: str | None = None) -> str | None:
+    """Return the value that wrapper.sh exports for name"""
+    with open(path) as f:
+        match = re.search(rf'^export {re.escape(name)}="?([^"\n]*)"?$', f.read(), re.MULTILINE)
+    return match.group(1) if match else default
+
+
+def query_max_connections(url: str) -> int:
+    """Return the max_connections setting of the PostgreSQL server at the
+    SQLAlchemy URL
+    """
+    from sqlalchemy import create_engine, text  # only needed when not given RDS_MAX_CONNECTIONS
+
+    engine = create_engine(url, pool_pre_ping=False)
+    try:
+        with engine.connect() as conn:
+            return int(conn.execute(text("SHOW max_connections")).scalar())
+    finally:
+        engine.dispose()
+
+
+def resolve_max_connections(rds_endpoint: str) -> int:
+    """Return RDS_MAX_CONNECTIONS if set, otherwise ask the RDS instance with
+    the credentials of AIRFLOW_RDS_USER and AIRFLOW_RDS_PASSWORD
+    """
+    if os.getenv("RDS_MAX_CONNECTIONS"):
+        return int(os.environ["RDS_MAX_CONNECTIONS"])
+    user = quote_plus(os.environ["AIRFLOW_RDS_USER"])
+    password = quote_plus(os.environ["AIRFLOW_RDS_PASSWORD"])
+    return query_max_connections(f"postgresql+psycopg2://{user}:{password}@{rds_endpoint}:5432/airflow")
+
+
+def pgbouncer_container(rds_secret_arn: str, pool_size: int, log_config: dict) -> dict:
+    """Return the definition of a pgbouncer sidecar that connects to the
+    database of the RDS secret and listens on 127.0.0.1:PGBOUNCER_PORT
+    """
+    return {
+        "name": "pgbouncer",
+        "image": PGBOUNCER_IMAGE,
+        "cpu": 0,
+        "portMappings": [],
+        "essential": True,
+        "environment": [
+            {"name": "AUTH_TYPE", "value": "scram-sha-256"},
+            {"name": "DB_NAME", "value": "airflow"},
+            {"name": "DEFAULT_POOL_SIZE", "value": str(pool_size)},
+            {"name": "LISTEN_PORT", "value": str(PGBOUNCER_PORT)},
+            {"name": "MAX_CLIENT_CONN", "value": "1000"},
+            {"name": "POOL_MODE", "value": "transaction"},
+        ],
+        # JSON keys of the secret created by `./run.sh create-rds-secret`
+        "secrets": [
+            {"name": "DB_HOST", "valueFrom": f"{rds_secret_arn}:host::"},
+            {"name": "DB_PORT", "valueFrom": f"{rds_secret_arn}:port::"},
+            {"name": "DB_USER", "valueFrom": f"{rds_secret_arn}:login::"},
+            {"name": "DB_PASSWORD", "valueFrom": f"{rds_secret_arn}:password::"},
+        ],
+        "healthCheck": {
+            "command": ["CMD-SHELL", f"nc -z 127.0.0.1 {PGBOUNCER_PORT} || exit 1"],
+            "interval": 10,
+            "timeout": 5,
+            "retries": 3,
+            "startPeriod": 10,
+        },
+        "logConfiguration": log_config,
+    }
+
+
+def apply_connection_budget(task_definition: dict, service: str, budget: ConnectionBudget,
+                            rds_secret_arn: str) -> dict:
+    """Set the pool of the core service's container, and with pgbouncer, add
+    the sidecar and point the container at it
+    """
+    container = task_definition["containerDefinitions"][0]
+    environment = {e["name"]: e["value"] for e in container["environment"]}
+    environment.update(budget.environment(service))
+    if budget.pgbouncer:
+        # bootstrap.py builds the connection URL with this host and port
+        environment["DATABASE_PROXY"] = f"127.0.0.1:{PGBOUNCER_PORT}"
+        container["dependsOn"] = [{"containerName": "pgbouncer", "condition": "HEALTHY"}]
+        task_definition["containerDefinitions"].append(
+            pgbouncer_container(rds_secret_arn, budget.pgbouncer_pool_size, container["logConfiguration"])
+        )
+    container["environment"] = [{"name": k, "value": v} for k, v in sorted(environment.items())]
+    return task_definition
@@ -0,0 +1,144 @@
+"""Stop every task in an ECS cluster and wait until all of them are STOPPED.
+
+The ECS client is passed in rather than created here so that the engine can be
+driven by a stubbed client (for example botocore's Stubber or a plain object
+with list_tasks/stop_task/describe_tasks methods)
+"""
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from helpers import DESCRIBE_TASKS_BATCH_SIZE, describe_tasks, list_tasks
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_TIMEOUT = 600.0
+MIN_POLL_DELAY = 1.0
+MAX_POLL_DELAY = 15.0
+
+
+@dataclass
+class DrainResult:
+    task_arns: list[str]
+    stop_failures: dict[str, str] = field(default_factory=dict)
+    still_running: list[str] = field(default_factory=list)
+    stop_seconds: float = 0.0
+    wait_seconds: float = 0.0
+    describe_calls: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return not self.stop_failures and not self.still_running
+
+    @property
+    def total_seconds(self) -> float:
+        return self.stop_seconds + self.wait_seconds
+
+
+def stop_tasks(
+    cluster_name: str,
+    task_arns: list[str],
+    ecs,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    reason: str = "Cluster drain",
+    report=print,
+) -> dict[str, str]:
+    """Call StopTask on every input task using a bounded pool of threads.
+    Return a dictionary that maps the ARN of each task that could not be
+    stopped to the error message
+    """
+    def stop(task_arn: str) -> str | None:
+        try:
+            ecs.stop_task(cluster=cluster_name, task=task_arn, reason=reason)
+        except Exception as e:  # botocore raises many ClientError subclasses
+            return str(e)
+        return None
+
+    failures = {}
+    if not task_arns:
+        return failures
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(task_arns)))) as pool:
+        for i, (task_arn, error) in enumerate(
+            zip(task_arns, pool.map(stop, task_arns)), start=1
+        ):
+            if error is not None:
+                failures[task_arn] = error
+                report(f"Failed to stop task {task_arn}: {error}")
+            if i % 100 == 0 or i == len(task_arns):
+                report(f"Requested stop for {i}/{len(task_arns)} tasks")
+    return failures
+
+
+def wait_until_stopped(
+    cluster_name: str,
+    task_arns: list[str],
+    ecs,
+    timeout: float = DEFAULT_TIMEOUT,
+    min_delay: float = MIN_POLL_DELAY,
+    max_delay: float = MAX_POLL_DELAY,
+    sleep=time.sleep,
+    clock=time.monotonic,
+    report=print,
+) -> tuple[list[str], int]:
+    """Poll DescribeTasks in batches until every input task is STOPPED or the
+    timeout expires. Only tasks that have not stopped yet are described again.
+    The delay between rounds doubles while nothing changes and halves when
+    tasks make progress, staying within [min_delay, max_delay].
+
+    Return the ARNs that were still not stopped and the number of
+    DescribeTasks calls that were made
+    """
+    pending = set(task_arns)
+    deadline = clock() + timeout
+    delay = min_delay
+    describe_calls = 0
+    while pending:
+        ordered = sorted(pending)
+        described = describe_tasks(cluster_name, ordered, ecs)
+        describe_calls += math.ceil(len(ordered) / DESCRIBE_TASKS_BATCH_SIZE)
+        # Tasks that ECS no longer returns have been stopped and cleaned up
+        still_pending = {
+            t["taskArn"] for t in described if t["lastStatus"] != "STOPPED"
+        }
+        stopped_now = len(pending) - len(still_pending)
+        pending = still_pending
+        report(f"{len(task_arns) - len(pending)}/{len(task_arns)} tasks stopped")
+        if not pending or clock() >= deadline:
+            break
+        if stopped_now:
+            delay = max(min_delay, delay / 2)
+        else:
+            delay = min(max_delay, delay * 2)
+        sleep(min(delay, max(0.0, deadline - clock())))
+    return sorted(pending), describe_calls
+
+
+def drain_cluster(
+    cluster_name: str,
+    ecs,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    timeout: float = DEFAULT_TIMEOUT,
+    sleep=time.sleep,
+    clock=time.monotonic,
+    report=print,
+) -> DrainResult:
+    """Stop every task in the cluster and block until all of them are stopped
+    """
+    task_arns = list_tasks(cluster_name, ecs)
+    report(f"Found {len(task_arns)} tasks in cluster {cluster_name}")
+    result = DrainResult(task_arns=task_arns)
+
+    start = clock()
+    result.stop_failures = stop_tasks(
+        cluster_name, task_arns, ecs, max_workers=max_workers, report=report,
+    )
+    result.stop_seconds = clock() - start
+
+    start = clock()
+    to_wait = [arn for arn in task_arns if arn not in result.stop_failures]
+    result.still_running, result.describe_calls = wait_until_stopped(
+        cluster_name, to_wait, ecs,
+        timeout=timeout, sleep=sleep, clock=clock, report=report,
+    )
+    result.wait_seconds = clock() - start
+    return result
@@ -0,0 +1,145 @@
+"""Launch ECS tasks and wait until all of them are RUNNING.
+
+All tasks are watched together with batched DescribeTasks calls, so bringing up
+N tasks takes about as long as the slowest one instead of N polling loops
+"""
+import random
+import time
+from dataclasses import dataclass, field
+
+from helpers import chunked, describe_tasks
+
+# RunTask starts at most 10 tasks per call
+RUN_TASK_MAX_COUNT = 10
+DEFAULT_TIMEOUT = 900.0
+BASE_POLL_DELAY = 2.0
+MAX_POLL_DELAY = 20.0
+
+
+@dataclass
+class LaunchResult:
+    task_arns: list[str] = field(default_factory=list)
+    launch_failures: list[str] = field(default_factory=list)
+    time_to_running: dict[str, float] = field(default_factory=dict)
+    stopped: dict[str, str] = field(default_factory=dict)
+    still_pending: list[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not (self.launch_failures or self.stopped or self.still_pending)
+
+
+def run_tasks(
+    cluster_name: str,
+    task_definition: str,
+    count: int,
+    network_config: dict,
+    ecs,
+) -> tuple[list[str], list[str]]:
+    """Call RunTask as many times as needed to start count Fargate tasks.
+    Return the ARNs of the started tasks and the reasons of any failures
+    """
+    task_arns, failures = [], []
+    for batch in chunked(list(range(count)), RUN_TASK_MAX_COUNT):
+        resp = ecs.run_task(
+            cluster=cluster_name,
+            count=len(batch),
+            launchType="FARGATE",
+            networkConfiguration=network_config,
+            taskDefinition=task_definition,
+        )
+        task_arns.extend(t["taskArn"] for t in resp["tasks"])
+        failures.extend(
+            f"{f.get('arn', '')}: {f.get('reason', 'unknown')}" for f in resp["failures"]
+        )
+    return task_arns, failures
+
+
+def backoff_delay(
+    attempt: int,
+    base: float = BASE_POLL_DELAY,
+    cap: float = MAX_POLL_DELAY,
+    rand=random.random,
+) -> float:
+    """Exponential backoff with equal jitter: half of the delay is fixed and the
+    other half is random so that concurrent pollers do not synchronize
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + rand() * delay / 2
+
+
+def wait_until_running(
+    cluster_name: str,
+    task_arns: list[str],
+    ecs,
+    timeout: float = DEFAULT_TIMEOUT,
+    sleep=time.sleep,
+    clock=time.monotonic,
+    rand=random.random,
+    report=print,
+    started_at: float | None = None,
+) -> tuple[dict[str, float], dict[str, str], list[str]]:
+    """Poll DescribeTasks in batches until every input task is RUNNING, has
+    stopped, or the timeout expires.
+
+    Return the seconds each task took to reach RUNNING (measured from
+    started_at), the stop reason of tasks that stopped before running, and the
+    ARNs that were still pending
+    """
+    started_at = clock() if started_at is None else started_at
+    deadline = clock() + timeout
+    pending = set(task_arns)
+    running, stopped = {}, {}
+    attempt = 0
+    while pending:
+        for task in describe_tasks(cluster_name, sorted(pending), ecs):
+            arn, status = task["taskArn"], task["lastStatus"]
+            if status == "RUNNING":
+                running[arn] = clock() - started_at
+                pending.discard(arn)
+                report(f"Task {arn} is RUNNING after {running[arn]:.1f}s")
+            elif status in ("DEACTIVATING", "STOPPING", "DEPROVISIONING", "STOPPED"):
+                stopped[arn] = task.get("stoppedReason", status)
+                pending.discard(arn)
+                report(f"Task {arn} stopped before running: {stopped[arn]}")
+        if not pending or clock() >= deadline:
+            break
+        report(f"{len(running)}/{len(task_arns)} tasks running, {len(pending)} pending")
+        sleep(min(backoff_delay(attempt, rand=rand), max(0.0, deadline - clock())))
+        attempt += 1
+    return running, stopped, sorted(pending)
+
+
+def launch_and_wait(
+    cluster_name: str,
+    task_definition: str,
+    placements: list[tuple[dict, int]],
+    ecs,
+    timeout: float = DEFAULT_TIMEOUT,
+    sleep=time.sleep,
+    clock=time.monotonic,
+    rand=random.random,
+    report=print,
+) -> LaunchResult:
+    """Start tasks from the task definition, as many with each network
+    configuration as its placement says, and block until all of them are
+    RUNNING
+    """
+    start = clock()
+    result = LaunchResult()
+    for network_config, count in placements:
+        task_arns, launch_failures = run_tasks(
+            cluster_name, task_definition, count, network_config, ecs,
+        )
+        result.task_arns.extend(task_arns)
+        result.launch_failures.extend(launch_failures)
+    for failure in result.launch_failures:
+        report(f"Failed to launch task: {failure}")
+    result.time_to_running, result.stopped, result.still_pending = wait_until_running(
+        cluster_name, result.task_arns, ecs,
+        timeout=timeout, sleep=sleep, clock=clock, rand=rand, report=report,
+        started_at=start,
+    )
+    result.seconds = clock() - start
+    return result
@@ -0,0 +1,74 @@
+"""Choose the subnets Fargate tasks are launched into by free IP capacity.
+
+Every awsvpc task takes one IP address of its subnet, so a subnet that is
+nearly out of addresses makes a burst of launches fail ENI allocation. Subnets
+with fewer than min_free_ips addresses left are left out, availability zones
+are ranked by their free addresses, and launches are spread over the zones in
+proportion to their free addresses
+"""
+import heapq
+from collections import defaultdict
+
+# Keep a few addresses per subnet for whatever else runs in it
+MIN_FREE_IPS = 16
+# awsvpcConfiguration takes at most 16 subnets
+MAX_SUBNETS = 16
+
+
+def usable_subnets(subnets: list[dict], min_free_ips: int = MIN_FREE_IPS) -> list[dict]:
+    return [sn for sn in subnets if sn["AvailableIpAddressCount"] >= min_free_ips]
+
+
+def subnets_by_zone(subnets: list[dict]) -> dict[str, list[dict]]:
+    """Group the subnets by availability zone, most free addresses first
+    """
+    zones = defaultdict(list)
+    for sn in sorted(subnets, key=lambda sn: -sn["AvailableIpAddressCount"]):
+        zones[sn["AvailabilityZone"]].append(sn)
+    return dict(zones)
+
+
+def rank_subnets(subnets: list[dict], min_free_ips: int = MIN_FREE_IPS) -> list[str]:
+    """Return the IDs of the usable subnets, alternating between availability
+    zones (the zone with the most free addresses first) so that the first
+    subnets of the list cover as many zones as possible
+    """
+    zones = sorted(
+        subnets_by_zone(usable_subnets(subnets, min_free_ips)).values(),
+        key=lambda zone: -sum(sn["AvailableIpAddressCount"] for sn in zone),
+    )
+    ranked = []
+    for i in range(max((len(zone) for zone in zones), default=0)):
+        ranked.extend(zone[i]["SubnetId"] for zone in zones if i < len(zone))
+    return ranked[:MAX_SUBNETS]
+
+
+def plan_launches(subnets: list[dict], count: int, min_free_ips: int = MIN_FREE_IPS) -> list[tuple[list[str], int]]:
+    """Split count launches over the availability zones and return (subnet
+    IDs of the zone, number of tasks) pairs. Raise a ValueError when the
+    usable subnets do not have count free addresses
+    """
+    zones = subnets_by_zone(usable_subnets(subnets, min_free_ips))
+    free = {
+        az: sum(sn["AvailableIpAddressCount"] - min_free_ips + 1 for sn in zone)
+        for az, zone in zones.items()
+    }
+    if sum(free.values()) < count:
+        raise ValueError(
+            f"Only {sum(free.values())} IP addresses left for {count} tasks in subnets "
+            f"with at least {min_free_ips} free addresses"
+        )
+    # Highest averages: each next task goes to the zone with the most free
+    # addresses per task planned there so far, without exceeding its capacity
+    heap = [(-left, az) for az, left in free.items()]
+    heapq.heapify(heap)
+    planned = defaultdict(int)
+    for _ in range(count):
+        _, az = heapq.heappop(heap)
+        planned[az] += 1
+        if planned[az] < free[az]:
+            heapq.heappush(heap, (-free[az] / (planned[az] + 1), az))
+    return [
+        ([sn["SubnetId"] for sn in zones[az]][:MAX_SUBNETS], n)
+        for az, n in sorted(planned.items(), key=lambda kv: -kv[1])
+    ]
@@ -0,0 +1,73 @@
+"""Register task definitions only when their content changed.
+
+Each registered revision is tagged with a hash of the definition that produced
+it, so comparing against the latest ACTIVE revision of a family takes a single
+DescribeTaskDefinition call and does not depend on how ECS echoes the
+definition back
+"""
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from helpers.cache import cached_get_rds_endpoint, cached_list_subnet_ids
+
+CONTENT_HASH_TAG = "content-hash"
+
+
+def task_definition_hash(task_definition: dict) -> str:
+    """Return a stable SHA-256 hex digest of the task definition
+    """
+    canonical = json.dumps(task_definition, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def latest_revision(family: str, ecs) -> tuple[int | None, str | None]:
+    """Return the revision number and content hash of the latest ACTIVE
+    revision of the family. Either value is None if the family does not exist
+    or the revision was registered without a content hash
+    """
+    try:
+        resp = ecs.describe_task_definition(taskDefinition=family, include=["TAGS"])
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ClientException":
+            return None, None
+        raise
+    tags = {t["key"]: t["value"] for t in resp.get("tags", [])}
+    revision = resp["taskDefinition"]["revision"]
+    return revision, tags.get(CONTENT_HASH_TAG)
+
+
+def register_if_changed(task_definition: dict, ecs) -> tuple[bool, int]:
+    """Register the task definition unless the latest ACTIVE revision of its
+    family has the same content hash. Return whether a new revision was
+    registered and the revision that is now the latest
+    """
+    content_hash = task_definition_hash(task_definition)
+    revision, latest_hash = latest_revision(task_definition["family"], ecs)
+    if revision is not None and latest_hash == content_hash:
+        return False, revision
+    resp = ecs.register_task_definition(
+        **task_definition,
+        tags=[{"key": CONTENT_HASH_TAG, "value": content_hash}],
+    )
+    return True, resp["taskDefinition"]["revision"]
+
+
+def resolve_lookups(
+    vpc_id: str,
+    rds_instance_id: str,
+    ec2,
+    rds,
+) -> tuple[list[str], str | None]:
+    """Look up the VPC's subnet IDs and the RDS endpoint concurrently, going
+    through the discovery cache
+
+    :param ec2: boto3.session.client("ec2")
+    :param rds: boto3.session.client("rds")
+    """
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        subnet_ids = pool.submit(cached_list_subnet_ids, vpc_id, ec2)
+        rds_endpoint = pool.submit(cached_get_rds_endpoint, rds_instance_id, rds)
+        return subnet_ids.result(), rds_endpoint.result()
@@ -0,0 +1,77 @@
+"""Build one task definition per core service and one worker task definition
+per worker profile in one process, and register the ones whose content changed
+since the latest ACTIVE revision.
+
+The database connection pools of the core services are sized to fit the RDS
+instance's max_connections (see helpers/connections.py), and nothing is
+registered when they do not fit
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from helpers import (
+    getenv_or_exit, generate_airflow_core_task_def, generate_airflow_worker_task_defs,
+    load_core_services,
+)
+from helpers.connections import (
+    ConnectionBudgetExceeded, apply_connection_budget, budget_from_environment,
+    plan_connection_budget, resolve_max_connections,
+)
+from helpers.task_definitions import register_if_changed, resolve_lookups
+
+WRAPPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper.sh")
+
+if __name__ == "__main__":
+    session = boto3.Session()
+    aws_account_id = getenv_or_exit("AWS_ACCOUNT_ID")
+    image_tag = getenv_or_exit("IMAGE_TAG")
+    aws_region = getenv_or_exit("AWS_REGION")
+    rds_instance_id = getenv_or_exit("RDS_INSTANCE_ID")
+    vpc_id = getenv_or_exit("VPC_ID")
+    image_uri = f"{aws_account_id}.dkr.ecr.{aws_region}.amazonaws.com/airflow:{image_tag}"
+    # boto3 sessions are not thread-safe, so create every client up front
+    ecs = session.client("ecs")
+
+    subnet_ids, rds_endpoint = resolve_lookups(
+        vpc_id, rds_instance_id, session.client("ec2"), session.client("rds"),
+    )
+    if not subnet_ids:
+        print(f"Subnet IDs missing", file=sys.stderr)
+        exit(1)
+    if rds_endpoint is None:
+        print(f"RDS {rds_instance_id} is not ready", file=sys.stderr)
+        exit(1)
+
+    services = load_core_services()
+    try:
+        budget = plan_connection_budget(
+            budget_from_environment(services, resolve_max_connections(rds_endpoint), WRAPPER_PATH)
+        )
+    except ConnectionBudgetExceeded as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    print(budget.report())
+    rds_secret_arn = (
+        f"arn:aws:secretsmanager:{aws_region}:{aws_account_id}:secret:"
+        f"{os.getenv('RDS_SECRET_ID', 'airflow_rds_conn')}"
+    )
+
+    task_definitions = [
+        *(
+            apply_connection_budget(
+                generate_airflow_core_task_def(image_uri, aws_account_id, service, services),
+                service, budget, rds_secret_arn,
+            )
+            for service in services
+        ),
+        *generate_airflow_worker_task_defs(image_uri, aws_account_id),
+    ]
+    with ThreadPoolExecutor(max_workers=min(8, len(task_definitions))) as pool:
+        results = pool.map(lambda td: register_if_changed(td, ecs), task_definitions)
+        for task_definition, (registered, revision) in zip(task_definitions, results):
+            family = task_definition["family"]
+            if registered:
+                print(f"{family}: registered revision {revision}")
+            else:
+                print(f"{family}: unchanged, latest revision is {revision}")
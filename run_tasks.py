@@ -0,0 +1,138 @@
+"""Launch Airflow core services or workers and block until they are RUNNING.
+Tasks are spread over the availability zones by the free IP addresses of
+their subnets, read again on every run.
+
+"core" launches one task of every core service (webserver, scheduler, DAG
+processor). With --replicas, the role is scaled to that many running tasks
+instead: missing tasks are launched and surplus tasks are stopped. Scaling up
+the schedulers or the webservers is refused when the database connections of
+that many replicas, with the pools their task definition was registered with,
+exceed the instance's max_connections (see helpers/connections.py)
+"""
+import argparse
+import os
+import sys
+import boto3
+from helpers import getenv_or_exit, generate_network_config, list_tasks, load_core_services
+from helpers.cache import cached_describe_subnets, cached_get_rds_endpoint
+from helpers.connections import (
+    DEFAULT_POOL, ConnectionBudgetExceeded, budget_from_environment, check_registered_budget, registered_pool,
+    resolve_max_connections,
+)
+from helpers.drain import stop_tasks
+from helpers.launch import DEFAULT_TIMEOUT, launch_and_wait
+from helpers.subnets import MIN_FREE_IPS, plan_launches
+
+WRAPPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper.sh")
+# Roles whose replicas count in the connection budget
+BUDGETED_REPLICAS = {"scheduler": "scheduler_replicas", "webserver": "webserver_replicas"}
+
+
+def task_definition_family(role: str, services: dict[str, dict]) -> str:
+    if role == "worker":
+        return getenv_or_exit("AIRFLOW_WORKER_TASK_DEF")
+    return getenv_or_exit("AIRFLOW_CORE_TASK_DEF") + services[role].get("familySuffix", "")
+
+
+def check_replicas_budget(role: str, replicas: int, services: dict[str, dict], session, ecs):
+    """Exit if `replicas` tasks of the role would exceed the connection budget"""
+    rds_instance_id = getenv_or_exit("RDS_INSTANCE_ID")
+    rds_endpoint = cached_get_rds_endpoint(rds_instance_id, session.client("rds"))
+    if rds_endpoint is None:
+        print(f"RDS {rds_instance_id} is not ready", file=sys.stderr)
+        exit(1)
+    task_definition = ecs.describe_task_definition(
+        taskDefinition=task_definition_family(role, services)
+    )["taskDefinition"]
+    budget = budget_from_environment(services, resolve_max_connections(rds_endpoint), WRAPPER_PATH)
+    setattr(budget, BUDGETED_REPLICAS[role], replicas)
+    try:
+        budget = check_registered_budget(budget, registered_pool(task_definition) or DEFAULT_POOL)
+    except ConnectionBudgetExceeded as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    print(budget.report())
+
+
+if __name__ == "__main__":
+    services = load_core_services()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("role", nargs="?", default="core", choices=["core", *services, "worker"])
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--replicas", type=int, default=None)
+    parser.add_argument(
+        "--timeout", type=float, default=float(os.getenv("LAUNCH_TIMEOUT", DEFAULT_TIMEOUT))
+    )
+    args = parser.parse_args()
+    if args.replicas is not None and args.role == "core":
+        print("--replicas takes a single role, e.g. scheduler", file=sys.stderr)
+        exit(1)
+
+    session = boto3.Session()
+    ecs = session.client("ecs")
+    cluster_name = getenv_or_exit("ECS_CLUSTER_NAME")
+    vpc_id = getenv_or_exit("VPC_ID")
+    ecs_security_group = getenv_or_exit("ECS_SG_ID")
+    min_free_ips = int(os.getenv("SUBNET_MIN_FREE_IPS", MIN_FREE_IPS))
+
+    roles = list(services) if args.role == "core" else [args.role]
+    counts = {role: args.count for role in roles}
+    if args.replicas is not None:
+        family = task_definition_family(args.role, services)
+        running = list_tasks(cluster_name, ecs, family=family)
+        print(f"{len(running)} {args.role} tasks running, scaling to {args.replicas}")
+        if len(running) > args.replicas:
+            surplus = running[args.replicas:]
+            failures = stop_tasks(
+                cluster_name, surplus, ecs, reason=f"Scaled {args.role} down to {args.replicas}",
+            )
+            exit(1 if failures else 0)
+        counts[args.role] = args.replicas - len(running)
+        if counts[args.role] == 0:
+            exit(0)
+        if args.role in BUDGETED_REPLICAS:
+            check_replicas_budget(args.role, args.replicas, services, session, ecs)
+
+    subnets = cached_describe_subnets(vpc_id, session.client("ec2"))
+    try:
+        plan = plan_launches(subnets, sum(counts.values()), min_free_ips)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        exit(1)
+    network_configs = []
+    for subnet_ids, count in plan:
+        network_configs.extend([generate_network_config(ecs_security_group, subnet_ids)] * count)
+
+    ok = True
+    for role, count in counts.items():
+        # Take this role's share of the planned placements, grouped by zone
+        placements = []
+        for network_config in network_configs[:count]:
+            if placements and placements[-1][0] is network_config:
+                placements[-1] = (network_config, placements[-1][1] + 1)
+            else:
+                placements.append((network_config, 1))
+        del network_configs[:count]
+        for network_config, n in placements:
+            print(f"{n} {role} tasks into {', '.join(network_config['awsvpcConfiguration']['subnets'])}")
+
+        result = launch_and_wait(
+            cluster_name, task_definition_family(role, services), placements, ecs,
+            timeout=args.timeout,
+        )
+
+        for task_arn, seconds in sorted(result.time_to_running.items(), key=lambda kv: kv[1]):
+            print(f"{task_arn}\t{seconds:.1f}s to RUNNING")
+        print(
+            f"{len(result.time_to_running)}/{count} {role} tasks running "
+            f"after {result.seconds:.1f}s"
+        )
+        if not result.ok:
+            print(
+                f"{len(result.launch_failures)} failed to launch, "
+                f"{len(result.stopped)} stopped, {len(result.still_pending)} still pending",
+                file=sys.stderr,
+            )
+            ok = False
+    if not ok:
+        exit(1)
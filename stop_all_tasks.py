@@ -1,22 +1,29 @@
-import time
+import os
+import sys
 import boto3
-from helpers import getenv_or_exit, list_tasks, tasks_all_stopped
+from helpers import getenv_or_exit
+from helpers.drain import DEFAULT_MAX_WORKERS, DEFAULT_TIMEOUT, drain_cluster
 
 
 if __name__ == "__main__":
     session = boto3.Session()
     ecs = session.client("ecs")
     cluster_name = getenv_or_exit("ECS_CLUSTER_NAME")
+    max_workers = int(os.getenv("DRAIN_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+    timeout = float(os.getenv("DRAIN_TIMEOUT", DEFAULT_TIMEOUT))
 
-    task_arns = list_tasks(cluster_name, ecs)
+    result = drain_cluster(cluster_name, ecs, max_workers=max_workers, timeout=timeout)
 
-    for task_arn in task_arns:
-        ecs.stop_task(
-            cluster=cluster_name,
-            task=task_arn
+    print(
+        f"Stopped {len(result.task_arns)} tasks in {result.total_seconds:.1f}s "
+        f"(stop: {result.stop_seconds:.1f}s, wait: {result.wait_seconds:.1f}s, "
+        f"{result.describe_calls} DescribeTasks calls)"
+    )
+    if not result.ok:
+        print(
+            f"{len(result.stop_failures)} tasks could not be stopped and "
+            f"{len(result.still_running)} tasks did not stop in time",
+            file=sys.stderr,
         )
-        print(f"Attempted to stop task {task_arn}")
-    
-    while not tasks_all_stopped(cluster_name, task_arns, ecs):
-        time.sleep(5)
+        exit(1)
     print("Tasks all stopped")
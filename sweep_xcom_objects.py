@@ -0,0 +1,26 @@
+"""Delete the S3 objects of XCom values that no XCom row references anymore,
+e.g. after their DAG run was deleted or `airflow db clean` ran. Objects younger
+than --min-age-days are kept, since the task that wrote one may not have
+committed its row yet.
+
+    python sweep_xcom_objects.py --min-age-days 1 --dry-run
+"""
+import argparse
+import os
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "airflow_home", "plugins"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-age-days", type=float, default=float(os.getenv("XCOM_ORPHAN_MIN_AGE_DAYS", "1")))
+    parser.add_argument("--dry-run", action="store_true", help="only list the orphaned objects")
+    args = parser.parse_args()
+
+    from s3_xcom_backend import sweep_orphans
+
+    orphans = sweep_orphans(timedelta(days=args.min_age_days), dry_run=args.dry_run)
+    for reference in orphans:
+        print(f"s3://{reference}")
+    print(f"{'Found' if args.dry_run else 'Deleted'} {len(orphans)} orphaned XCom objects", file=sys.stderr)
@@ -0,0 +1,167 @@
+"""State sync of AdaptiveSyncFargateExecutor (fargate_executors) against a
+stubbed ECS client, with an injected clock. Needs Airflow and
+airflow-aws-executors; the executor reads its [ecs_fargate] settings from the
+environment, as in the benchmarks
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+for name, value in {
+    "AIRFLOW_HOME": tempfile.mkdtemp(prefix="airflow-test-"),
+    "AIRFLOW__CORE__LOAD_EXAMPLES": "False",
+    "AIRFLOW__ECS_FARGATE__REGION": "us-west-2",
+    "AIRFLOW__ECS_FARGATE__CLUSTER": "airflow",
+    "AIRFLOW__ECS_FARGATE__CONTAINER_NAME": "worker",
+    "AIRFLOW__ECS_FARGATE__TASK_DEFINITION": "airflow-worker",
+    "AIRFLOW__ECS_FARGATE__LAUNCH_TYPE": "FARGATE",
+}.items():
+    os.environ.setdefault(name, value)
+pytest.importorskip("airflow_aws_executors")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "airflow_home", "config"))
+from airflow.models.taskinstance import TaskInstanceKey  # noqa: E402
+from airflow.utils.state import TaskInstanceState  # noqa: E402
+from fargate_executors import AdaptiveSyncFargateExecutor  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StubEcs:
+    """ECS client whose tasks keep the status they were last given with
+    set_status; DescribeTasks reports the ARNs of `missing` as failures"""
+
+    def __init__(self):
+        self.tasks = {}
+        self.missing = set()
+        self.described = []
+
+    def run_task(self, **kwargs) -> dict:
+        arn = f"arn:task/{len(self.tasks)}"
+        self.tasks[arn] = {
+            "taskArn": arn, "lastStatus": "PROVISIONING", "desiredStatus": "RUNNING",
+            "containers": [{"name": "worker", "lastStatus": "PENDING"}],
+        }
+        return {"tasks": [self.tasks[arn]], "failures": []}
+
+    def set_status(self, arn: str, last_status: str, desired_status: str = "RUNNING", **fields):
+        self.tasks[arn].update(lastStatus=last_status, desiredStatus=desired_status, **fields)
+
+    def describe_tasks(self, cluster: str, tasks: list[str]) -> dict:
+        assert len(tasks) <= 100
+        self.described.append(list(tasks))
+        return {
+            "tasks": [self.tasks[arn] for arn in tasks if arn not in self.missing],
+            "failures": [{"arn": arn, "reason": "MISSING"} for arn in tasks if arn in self.missing],
+        }
+
+    def finish(self, arn: str, exit_code: int):
+        self.set_status(arn, "STOPPED", "STOPPED", startedAt=1.0)
+        self.tasks[arn]["containers"][0].update(lastStatus="STOPPED", exitCode=exit_code)
+
+
+@pytest.fixture
+def executor():
+    executor = AdaptiveSyncFargateExecutor(parallelism=500)
+    executor.start()
+    executor.ecs = StubEcs()
+    executor.clock = FakeClock()
+    executor.min_poll_interval, executor.max_poll_interval, executor.poll_interval_factor = 0.0, 30.0, 0.1
+    return executor
+
+
+def launch(executor, count: int) -> list:
+    keys = [TaskInstanceKey("dag", f"task_{i}", "run", 1) for i in range(count)]
+    for key in keys:
+        executor.running.add(key)
+        executor.execute_async(key, ["airflow", "tasks", "run", key.task_id])
+    executor.attempt_task_runs()
+    return keys
+
+
+def described(executor) -> list[str]:
+    arns = [arn for batch in executor.ecs.described for arn in batch]
+    executor.ecs.described.clear()
+    return arns
+
+
+def test_describes_at_most_100_tasks_per_call(executor):
+    launch(executor, 250)
+    executor.sync_running_tasks()
+    assert [len(batch) for batch in executor.ecs.described] == [100, 100, 50]
+    assert executor.sync_metrics.summary()["describe_tasks_calls"] == 3
+
+
+def test_tasks_are_polled_less_often_the_longer_their_status_stays(executor):
+    launch(executor, 1)
+    arn = executor.active_workers.get_all_arns()[0]
+    executor.sync_running_tasks()
+    assert described(executor) == [arn]
+
+    # Still PROVISIONING after 100s: next poll in 100 x 0.1 = 10s
+    executor.clock.now = 100.0
+    executor.sync_running_tasks()
+    assert described(executor) == [arn]
+    executor.clock.now = 105.0
+    executor.sync_running_tasks()
+    assert described(executor) == []
+    executor.clock.now = 110.0
+    executor.ecs.set_status(arn, "RUNNING", startedAt=110.0)
+    executor.sync_running_tasks()
+    assert described(executor) == [arn]
+
+    # A new status is polled again on the next sync, and never beyond the cap
+    executor.clock.now = 110.5
+    executor.sync_running_tasks()
+    assert described(executor) == [arn]
+    executor.clock.now = 1000.0
+    executor.sync_running_tasks()
+    assert described(executor) == [arn]
+    executor.clock.now = 1029.0
+    executor.sync_running_tasks()
+    assert described(executor) == []
+    executor.clock.now = 1030.0
+    executor.sync_running_tasks()
+    assert described(executor) == [arn]
+
+
+def test_finished_tasks_are_reported_and_never_described_again(executor):
+    keys = launch(executor, 3)
+    arns = [executor.active_workers.key_to_arn[key] for key in keys]
+    executor.ecs.finish(arns[0], exit_code=0)
+    executor.ecs.finish(arns[1], exit_code=1)
+    executor.sync_running_tasks()
+    assert described(executor) == arns
+    assert executor.event_buffer == {
+        keys[0]: (TaskInstanceState.SUCCESS, None), keys[1]: (TaskInstanceState.FAILED, None),
+    }
+    assert executor.active_workers.get_all_arns() == [arns[2]]
+    assert list(executor.poll_schedule) == [arns[2]]
+
+    executor.clock.now = 1000.0
+    executor.sync_running_tasks()
+    assert described(executor) == [arns[2]]
+
+
+def test_tasks_removed_before_running_are_launched_again(executor):
+    keys = launch(executor, 2)
+    removed, missing = (executor.active_workers.key_to_arn[key] for key in keys)
+    # Stopped without ever starting, and no longer known to ECS
+    executor.ecs.set_status(removed, "STOPPED", "STOPPED", stoppedReason="Timeout waiting for network interface")
+    executor.ecs.missing.add(missing)
+    executor.sync()
+    assert len(executor.ecs.tasks) == 4
+    relaunched = [executor.active_workers.key_to_arn[key] for key in keys]
+    assert not set(relaunched) & {removed, missing}
+    assert [executor.active_workers.failure_count_by_key(key) for key in keys] == [1, 1]
+    assert executor.event_buffer == {}
+
+    described(executor)
+    executor.sync()
+    assert sorted(described(executor)) == sorted(relaunched)
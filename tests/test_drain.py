@@ -0,0 +1,124 @@
+"""Cluster drain (helpers/drain.py) against a stubbed ECS client, with an
+injected clock and sleep so that the polling schedule runs instantly
+"""
+import threading
+from helpers.drain import drain_cluster, wait_until_stopped
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class StubEcs:
+    """ECS client holding the lastStatus of each task. ListTasks returns
+    page_size tasks per page, StopTask fails for the ARNs of stop_errors and
+    otherwise stops the task right away
+    """
+
+    def __init__(self, task_arns: list[str], page_size: int = 100, stop_errors: dict[str, str] | None = None):
+        self.statuses = {arn: "RUNNING" for arn in task_arns}
+        self.page_size = page_size
+        self.stop_errors = stop_errors or {}
+        self.list_calls = []
+        self.stopped = []
+        self.described = []
+        self._lock = threading.Lock()
+
+    def list_tasks(self, cluster: str, nextToken: str | None = None, **kwargs) -> dict:
+        self.list_calls.append(nextToken)
+        arns = list(self.statuses)
+        start = int(nextToken or 0)
+        resp = {"taskArns": arns[start:start + self.page_size]}
+        if start + self.page_size < len(arns):
+            resp["nextToken"] = str(start + self.page_size)
+        return resp
+
+    def stop_task(self, cluster: str, task: str, reason: str = "") -> dict:
+        if task in self.stop_errors:
+            raise RuntimeError(self.stop_errors[task])
+        with self._lock:
+            self.stopped.append(task)
+            self.statuses[task] = "STOPPED"
+        return {"task": {"taskArn": task}}
+
+    def describe_tasks(self, cluster: str, tasks: list[str]) -> dict:
+        assert len(tasks) <= 100
+        self.described.append(list(tasks))
+        return {"tasks": [{"taskArn": arn, "lastStatus": self.statuses[arn]} for arn in tasks], "failures": []}
+
+
+def task_arns(count: int) -> list[str]:
+    return [f"arn:aws:ecs:us-west-2:000000000000:task/airflow/{i:032x}" for i in range(count)]
+
+
+def test_drain_follows_list_tasks_pages():
+    arns = task_arns(250)
+    ecs = StubEcs(arns, page_size=100)
+    clock = FakeClock()
+    result = drain_cluster("airflow", ecs, sleep=clock.sleep, clock=clock, report=lambda _: None)
+    assert ecs.list_calls == [None, "100", "200"]
+    assert result.task_arns == arns
+    assert sorted(ecs.stopped) == sorted(arns)
+    assert result.ok
+    # One round of DescribeTasks, in batches of 100
+    assert [len(batch) for batch in ecs.described] == [100, 100, 50]
+    assert result.describe_calls == 3
+    assert clock.sleeps == []
+
+
+def test_drain_reports_partial_stop_failures():
+    arns = task_arns(5)
+    ecs = StubEcs(arns, stop_errors={arns[1]: "AccessDeniedException", arns[3]: "ServerException"})
+    clock = FakeClock()
+    result = drain_cluster("airflow", ecs, max_workers=2, sleep=clock.sleep, clock=clock, report=lambda _: None)
+    assert result.stop_failures == {arns[1]: "AccessDeniedException", arns[3]: "ServerException"}
+    assert not result.ok
+    assert result.still_running == []
+    # The tasks that could not be stopped are not waited for
+    assert sorted(arn for batch in ecs.described for arn in batch) == sorted([arns[0], arns[2], arns[4]])
+
+
+def test_wait_until_stopped_gives_up_at_the_timeout():
+    arns = task_arns(120)
+    ecs = StubEcs(arns)
+    clock = FakeClock()
+    still_running, describe_calls = wait_until_stopped(
+        "airflow", arns, ecs, timeout=10.0, min_delay=1.0, max_delay=4.0,
+        sleep=clock.sleep, clock=clock, report=lambda _: None,
+    )
+    assert still_running == sorted(arns)
+    # The delay doubles while nothing stops, the last sleep ends at the deadline
+    assert clock.sleeps == [2.0, 4.0, 4.0]
+    assert clock.now == 10.0
+    assert describe_calls == 4 * 2
+
+
+def test_wait_until_stopped_describes_only_pending_tasks():
+    arns = task_arns(4)
+    ecs = StubEcs(arns)
+    clock = FakeClock()
+
+    def sleep(seconds: float):
+        clock.sleep(seconds)
+        # One more task stops during each wait
+        ecs.statuses[sorted(arn for arn, status in ecs.statuses.items() if status != "STOPPED")[0]] = "STOPPED"
+
+    still_running, describe_calls = wait_until_stopped(
+        "airflow", arns, ecs, timeout=60.0, min_delay=1.0, max_delay=8.0,
+        sleep=sleep, clock=clock, report=lambda _: None,
+    )
+    assert still_running == []
+    # A task that stopped is described once more, then dropped
+    assert [len(batch) for batch in ecs.described] == [4, 4, 3, 2, 1]
+    assert describe_calls == 5
+    # Nothing stopped in the first round, then progress keeps the delay down
+    assert clock.sleeps == [2.0, 1.0, 1.0, 1.0]
@@ -0,0 +1,112 @@
+"""Task launches (helpers/launch.py) against a stubbed ECS client, with an
+injected clock, sleep and jitter so that the polling schedule runs instantly
+"""
+from helpers.launch import launch_and_wait, run_tasks, wait_until_running
+
+NETWORK_CONFIG = {"awsvpcConfiguration": {"subnets": ["subnet-a"], "assignPublicIp": "ENABLED"}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class StubEcs:
+    """ECS client whose tasks go through the statuses of `timeline`, one per
+    DescribeTasks round, staying in the last one. RunTask fails to place the
+    first `placement_failures` tasks it is asked for
+    """
+
+    def __init__(self, timeline: list[dict] | None = None, placement_failures: int = 0):
+        self.timeline = timeline or []
+        self.placement_failures = placement_failures
+        self.run_task_calls = []
+        self.described = []
+        self.statuses = {}
+
+    def run_task(self, cluster: str, count: int, networkConfiguration: dict, **kwargs) -> dict:
+        self.run_task_calls.append((count, networkConfiguration["awsvpcConfiguration"]["subnets"]))
+        failed = min(count, self.placement_failures)
+        self.placement_failures -= failed
+        first = len(self.statuses)
+        arns = [f"arn:task/{first + i}" for i in range(count - failed)]
+        self.statuses.update((arn, "PROVISIONING") for arn in arns)
+        return {
+            "tasks": [{"taskArn": arn, "lastStatus": "PROVISIONING"} for arn in arns],
+            "failures": [{"reason": "RESOURCE:ENI"} for _ in range(failed)],
+        }
+
+    def describe_tasks(self, cluster: str, tasks: list[str]) -> dict:
+        assert len(tasks) <= 100
+        self.described.append(list(tasks))
+        statuses = self.timeline[min(len(self.described), len(self.timeline)) - 1] if self.timeline else {}
+        described = []
+        for arn in tasks:
+            status = statuses.get(arn, self.statuses.get(arn, "PROVISIONING"))
+            task = {"taskArn": arn, "lastStatus": status}
+            if status == "STOPPED":
+                task["stoppedReason"] = "Essential container in task exited"
+            described.append(task)
+        return {"tasks": described, "failures": []}
+
+
+def test_run_tasks_starts_at_most_ten_tasks_per_call():
+    ecs = StubEcs(placement_failures=2)
+    task_arns, failures = run_tasks("airflow", "airflow-worker", 23, NETWORK_CONFIG, ecs)
+    assert [count for count, _ in ecs.run_task_calls] == [10, 10, 3]
+    assert len(task_arns) == 21
+    assert failures == [": RESOURCE:ENI", ": RESOURCE:ENI"]
+
+
+def test_wait_until_running_splits_running_stopped_and_pending():
+    ecs = StubEcs(timeline=[
+        {"a": "PENDING", "b": "PROVISIONING", "c": "PROVISIONING"},
+        {"a": "RUNNING", "b": "STOPPED", "c": "PENDING"},
+    ])
+    clock = FakeClock()
+    running, stopped, pending = wait_until_running(
+        "airflow", ["a", "b", "c"], ecs, timeout=30.0,
+        sleep=clock.sleep, clock=clock, rand=lambda: 0.0, report=lambda _: None,
+    )
+    assert running == {"a": 1.0}
+    assert stopped == {"b": "Essential container in task exited"}
+    assert pending == ["c"]
+    # Tasks that ran or stopped are not described again
+    assert ecs.described[:3] == [["a", "b", "c"], ["a", "b", "c"], ["c"]]
+
+
+def test_wait_until_running_deadline_cuts_the_backoff():
+    ecs = StubEcs(timeline=[{"a": "PROVISIONING"}])
+    clock = FakeClock()
+    running, stopped, pending = wait_until_running(
+        "airflow", ["a"], ecs, timeout=10.0,
+        sleep=clock.sleep, clock=clock, rand=lambda: 1.0, report=lambda _: None,
+    )
+    assert (running, stopped, pending) == ({}, {}, ["a"])
+    # 2s, 4s, then 8s cut down to the 4s left before the deadline
+    assert clock.sleeps == [2.0, 4.0, 4.0]
+    assert clock.now == 10.0
+    assert len(ecs.described) == 4
+
+
+def test_launch_and_wait_launches_every_placement():
+    ecs = StubEcs(timeline=[{}, {f"arn:task/{i}": "RUNNING" for i in range(12)}])
+    clock = FakeClock()
+    other_config = {"awsvpcConfiguration": {"subnets": ["subnet-b"], "assignPublicIp": "ENABLED"}}
+    result = launch_and_wait(
+        "airflow", "airflow-worker", [(NETWORK_CONFIG, 11), (other_config, 1)], ecs,
+        sleep=clock.sleep, clock=clock, rand=lambda: 0.0, report=lambda _: None,
+    )
+    assert ecs.run_task_calls == [(10, ["subnet-a"]), (1, ["subnet-a"]), (1, ["subnet-b"])]
+    assert result.ok
+    assert len(result.task_arns) == 12
+    assert set(result.time_to_running.values()) == {1.0}
+    assert result.seconds == 1.0
@@ -0,0 +1,109 @@
+"""Failure classification, backoff and token bucket of the RunTask calls of
+RateLimitedFargateExecutor (airflow_home/config/launch_control.py)
+"""
+import os
+import sys
+import pytest
+
+pytest.importorskip("botocore")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "airflow_home", "config"))
+from botocore.exceptions import ClientError  # noqa: E402
+from launch_control import (  # noqa: E402
+    CAPACITY, CONFIG, THROTTLE, RetryPolicy, TokenBucket, capacity_kwargs, classify_error, classify_reason,
+    classify_reasons,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def client_error(code: str, message: str = "") -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, "RunTask")
+
+
+@pytest.mark.parametrize("code, message, kind", [
+    ("ThrottlingException", "Rate exceeded", THROTTLE),
+    ("TooManyRequestsException", "", THROTTLE),
+    ("ClientException", "Rate exceeded", THROTTLE),
+    ("AccessDeniedException", "", CONFIG),
+    ("InvalidParameterException", "No Container Instances were found in your cluster.", CONFIG),
+    ("ClientException", "TaskDefinition not found.", CONFIG),
+    ("ClientException", "Fargate capacity is unavailable at this time.", CAPACITY),
+    ("ClientException", "You've reached the limit on the number of tasks you can run concurrently", CAPACITY),
+    ("ServerException", "Service unavailable", CAPACITY),
+])
+def test_classify_error(code, message, kind):
+    assert classify_error(client_error(code, message)) == kind
+
+
+@pytest.mark.parametrize("reason, kind", [
+    ("RESOURCE:ENI", CAPACITY),
+    ("RESOURCE:MEMORY", CAPACITY),
+    ("Capacity is unavailable at this time. Please try again later or in a different availability zone", CAPACITY),
+    ("Rate exceeded", THROTTLE),
+    ("Request throttled", THROTTLE),
+    ("ATTRIBUTE", CONFIG),
+    ("MISSING", CONFIG),
+    ("INACTIVE", CONFIG),
+])
+def test_classify_reason(reason, kind):
+    assert classify_reason(reason) == kind
+
+
+def test_classify_reasons_picks_the_least_retryable_kind():
+    assert classify_reasons(["RESOURCE:ENI", "Rate exceeded"]) == THROTTLE
+    assert classify_reasons(["RESOURCE:ENI", "Rate exceeded", "MISSING"]) == CONFIG
+    assert classify_reasons(["RESOURCE:ENI", "RESOURCE:MEMORY"]) == CAPACITY
+
+
+def test_retry_delay_doubles_up_to_the_cap_with_equal_jitter():
+    policy = RetryPolicy(base=10.0, cap=300.0, max_attempts=30)
+    assert [policy.delay(attempt, rand=lambda: 0.0) for attempt in (1, 2, 3, 6, 10)] == [5, 10, 20, 150, 150]
+    assert [policy.delay(attempt, rand=lambda: 1.0) for attempt in (1, 2, 3, 6, 10)] == [10, 20, 40, 300, 300]
+
+
+def test_capacity_kwargs_swaps_the_launch_type_for_fargate_spot():
+    kwargs = {"launchType": "FARGATE", "taskDefinition": "airflow-worker"}
+    assert capacity_kwargs(kwargs, spot=False) is kwargs
+    assert capacity_kwargs(kwargs, spot=True) == {
+        "taskDefinition": "airflow-worker",
+        "capacityProviderStrategy": [{"capacityProvider": "FARGATE_SPOT", "weight": 1}],
+    }
+    assert kwargs == {"launchType": "FARGATE", "taskDefinition": "airflow-worker"}
+
+
+def test_bucket_allows_a_burst_then_refills_at_its_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, burst=5.0, clock=clock)
+    assert [bucket.take() for _ in range(6)] == [True] * 5 + [False]
+    clock.now = 1.0
+    assert [bucket.take() for _ in range(3)] == [True, True, False]
+    clock.now = 100.0
+    assert sum(bucket.take() for _ in range(10)) == 5
+
+
+def test_bucket_halves_its_rate_when_throttled_down_to_min_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=8.0, burst=10.0, min_rate=1.5, clock=clock)
+    bucket.throttled()
+    assert bucket.rate == 4.0
+    assert not bucket.take()
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 1.5
+
+
+def test_bucket_recovers_its_rate_one_successful_call_at_a_time():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=8.0, burst=10.0, recovery=0.5, clock=clock)
+    bucket.throttled()
+    bucket.succeeded()
+    assert bucket.rate == 4.5
+    for _ in range(20):
+        bucket.succeeded()
+    assert bucket.rate == 8.0